@@ -0,0 +1,66 @@
+"""Incremental daily rollups of booking activity.
+
+Two rollups are kept, both as running sums that a booking adds to when it
+is written and subtracts from when it is cancelled or deleted:
+
+* per room and night - rooms sold (``stays``) and the revenue earned that
+  night (the stay's total spread evenly over its nights); occupancy is
+  ``stays`` over the number of rooms;
+* per booking day and room type - bookings made, nights sold, revenue and
+  the summed lead time (days from booking to check-in), from which the
+  average stay length and lead time follow.
+
+Reports then read a few hundred rollup rows however long the booking
+history grows.  ``RollupDelta`` collects the changes of one transaction;
+app.py applies it with upserts in the same transaction as the bookings.
+"""
+from datetime import datetime
+
+from rates import iter_nights
+
+
+def _day(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+class RollupDelta:
+    def __init__(self):
+        self.nights = {}  # (room_id, night) -> [room_type, stays, revenue]
+        self.days = {}    # (day, room_type) -> [bookings, nights, revenue, lead_days]
+
+    def __bool__(self):
+        return bool(self.nights or self.days)
+
+    def add(self, stay, sign=1):
+        """Count a booking in (sign=1) or out (sign=-1).
+
+        ``stay`` needs room_id, room_type, check_in, check_out, total_price
+        and created_at, with dates already parsed.
+        """
+        check_in, check_out = stay['check_in'], stay['check_out']
+        nights = (check_out - check_in).days
+        if nights < 1:
+            return
+        room_type = stay['room_type'] or ''
+        total = stay['total_price'] or 0.0
+        per_night = total / nights
+        for night in iter_nights(check_in, check_out):
+            entry = self.nights.setdefault((stay['room_id'], night), [room_type, 0, 0.0])
+            entry[1] += sign
+            entry[2] += sign * per_night
+
+        booked_on = _day(stay['created_at'])
+        entry = self.days.setdefault((booked_on, room_type), [0, 0, 0.0, 0])
+        entry[0] += sign
+        entry[1] += sign * nights
+        entry[2] += sign * total
+        entry[3] += sign * max((check_in - booked_on).days, 0)
+
+    def night_rows(self):
+        return [{'room_id': room_id, 'night': night, 'room_type': room_type, 'stays': stays, 'revenue': revenue}
+                for (room_id, night), (room_type, stays, revenue) in self.nights.items()]
+
+    def day_rows(self):
+        return [{'day': day, 'room_type': room_type, 'bookings': bookings, 'nights': nights,
+                 'revenue': revenue, 'lead_days': lead_days}
+                for (day, room_type), (bookings, nights, revenue, lead_days) in self.days.items()]
@@ -1,56 +1,166 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, abort, Response, stream_with_context, g, send_from_directory, appcontext_pushed
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect, text
+from markupsafe import escape
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from werkzeug.utils import secure_filename
+import click
 import os
-from datetime import datetime
+import io
+import csv
+import json
+import base64
+import hashlib
+import hmac
+import re
+import time
+import threading
+from datetime import datetime, date, timedelta
 import uuid
+import math
+import mimetypes
+import tempfile
+
+from availability import AvailabilityIndex
+from db_profile import DatabaseProfile
+from assets import AssetManifest, build as build_assets
+from image_pipeline import download as download_image, make_variants
+from job_queue import JobQueue, WorkerPool
+from mailer import build_message, mailer_from_env
+from upload_store import ContentStore, etag_for, is_content_addressed
+from fragment_cache import FragmentCache
+from instrumentation import Metrics
+from cart_store import Cart, MemoryCartStore, SQLCartStore, new_cart_id
+from pricing import CartPricer, PricingError
+from rates import iter_nights, nightly_rate, occupancy_by_night, rule_window
+from analytics import RollupDelta
 
 app = Flask(__name__)
 basedir = os.path.abspath(os.path.dirname(__file__))
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'hotel.db')
+db_profile = DatabaseProfile.from_env('sqlite:///' + os.path.join(basedir, 'hotel.db'))
+app.config['SQLALCHEMY_DATABASE_URI'] = db_profile.url
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = db_profile.engine_options()
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.secret_key = 'dev-secret-key-change-me'
+app.secret_key = os.environ.get('SECRET_KEY')
+DEV_SECRET_KEY = 'dev-secret-key-change-me'  # only with DEBUG or TESTING, see create_app()
 
 # File upload configuration
 UPLOAD_FOLDER = os.path.join(basedir, 'static', 'uploads')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 MAX_FILE_SIZE = 5 * 1024 * 1024  # 5 MB
+REVIEWS_PAGE_SIZE = 10
+REVIEW_IMAGE_SIZES = '(max-width: 576px) 100vw, 300px'
+ADMIN_BOOKINGS_PAGE_SIZE = 50
+ROOM_IMPORT_BATCH_SIZE = 500
+# Where carts live server-side: 'sqlite' (shared by all workers) or 'memory'
+CART_STORE = os.environ.get('CART_STORE', 'sqlite')
+CART_TTL = 7 * 24 * 3600  # seconds a cart survives without being touched
+# Background job threads per web process; 0 leaves jobs to 'flask run-worker'
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_RETENTION_DAYS = 14  # finished jobs kept for inspection
+MAIL_SINK_DIR = os.path.join(basedir, 'instance', 'mail')  # used when SMTP_HOST is unset
+UPLOAD_MAX_AGE = 365 * 24 * 3600  # content-addressed uploads never change
+UPLOAD_GRACE_SECONDS = 3600  # unreferenced files younger than this are left for gc-uploads
+# Output of 'flask build-assets': fingerprinted, minified, precompressed static files
+ASSET_DIR = os.path.join(basedir, 'static', 'dist')
+ASSET_MAX_AGE = 365 * 24 * 3600
+# Local copies of Room.image_url: widths made, download cap, and the <img sizes> per layout
+ROOM_IMAGE_WIDTHS = (320, 640, 960)
+ROOM_IMAGE_MAX_BYTES = 10 * 1024 * 1024
+ROOM_CARD_IMAGE_SIZES = '(max-width: 767px) 100vw, (max-width: 991px) 50vw, 290px'
+ROOM_DETAIL_IMAGE_SIZES = '(max-width: 991px) 100vw, 600px'
+DEFAULT_ROOM_IMAGE = 'https://images.unsplash.com/photo-1631049307264-da0ec9d70304?auto=format&fit=crop&w=600&q=85'
+FRAGMENT_CACHE_SIZE = int(os.environ.get('FRAGMENT_CACHE_SIZE', 512))
+# Opt-in request/SQL/template timing, scraped from /admin/metrics
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '').lower() in ('1', 'true', 'yes')
+SLOW_QUERY_MS = int(os.environ.get('SLOW_QUERY_MS', 200))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # lets a scraper in without an admin login
+RATE_CALENDAR_DAYS = int(os.environ.get('RATE_CALENDAR_DAYS', 365))  # nights ahead kept in RoomRate
+# Finished stays that ended more than this many days ago move to booking_archive
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 730))
+ARCHIVE_BATCH_SIZE = 500
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
 
-# Create uploads folder if it doesn't exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+upload_store = ContentStore(UPLOAD_FOLDER)
 
-db = SQLAlchemy(app)
+db = SQLAlchemy()  # bound to the app in init_runtime(), once create_app() has set the config
+metrics = Metrics(SLOW_QUERY_MS) if METRICS_ENABLED else None
+
+# --- Process start-up -------------------------------------------------------
+
+_runtime_lock = threading.Lock()
+_runtime_ready = False
+startup_timings = {}  # phase -> seconds, shown on /admin/metrics
+
+
+def init_runtime():
+    """One-time setup of this process, run on its first app context.
+
+    Importing the module only defines routes and models; everything that
+    touches the filesystem or the engine waits until here, so a server can
+    import the app cheaply and every worker sets itself up.  No database
+    connection is opened: the first query does that.  The database and
+    upload folder are taken from app.config here, after any overrides.
+    """
+    global _runtime_ready, mailer
+    if _runtime_ready:
+        return
+    with _runtime_lock:
+        if _runtime_ready:
+            return
+        t0 = time.perf_counter()
+        db.init_app(app)
+        upload_store.root = app.config['UPLOAD_FOLDER']
+        os.makedirs(upload_store.root, exist_ok=True)
+        db_profile.install(db.engine)
+        if metrics is not None:
+            metrics.install(app, db.engine)
+        mailer = mailer_from_env(MAIL_SINK_DIR)
+        startup_timings['init'] = time.perf_counter() - t0
+        _runtime_ready = True
+
+
+@appcontext_pushed.connect_via(app)
+def _init_on_first_context(sender, **extra):
+    # Covers requests, CLI commands and job worker threads alike.
+    init_runtime()
 
-# In-memory global reviews (visible to all users). Used alongside session-backed reviews.
-REVIEWS = {}
 
 def get_reviews_for(room_id):
-    key = str(room_id)
-    out = []
-    # global stored reviews
-    if key in REVIEWS:
-        out.extend(REVIEWS.get(key, []))
-    # session reviews (per-user)
-    try:
-        sess = session.get('reviews', {})
-        out.extend(sess.get(key, []))
-    except Exception:
-        pass
-    return out
+    """Newest reviews of a room as dicts, read from the Review table every worker shares"""
+    reviews, _ = review_page(room_id)
+    return [review_to_dict(review) for review in reviews]
 
 app.jinja_env.globals['get_reviews'] = get_reviews_for
+app.jinja_env.globals['review_image_sizes'] = REVIEW_IMAGE_SIZES
+app.jinja_env.globals['room_card_image_sizes'] = ROOM_CARD_IMAGE_SIZES
+app.jinja_env.globals['room_detail_image_sizes'] = ROOM_DETAIL_IMAGE_SIZES
+
+DATE_INPUT_FORMATS = ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y')
+
+
+def parse_date(value):
+    """Parse a date in any of the accepted input formats, or return None"""
+    if isinstance(value, date):
+        return value
+    if not value:
+        return None
+    for fmt in DATE_INPUT_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except Exception:
+            continue
+    return None
 
-# Seed a demo review for room 1
-REVIEWS.setdefault('1', []).append({'name': 'สมชาย', 'rating': 5, 'comment': 'บริการดี ห้องสะอาด และใกล้สถานที่ท่องเที่ยว'})
 
 def format_date(value, outfmt='%d/%m/%Y'):
-    from datetime import datetime
     if not value:
         return ''
+    if isinstance(value, date):
+        return value.strftime(outfmt)
     # Try common stored format YYYY-MM-DD or pass-through
-    for fmt in ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y'):
+    for fmt in DATE_INPUT_FORMATS:
         try:
             d = datetime.strptime(value, fmt)
             return d.strftime(outfmt)
@@ -67,23 +177,23 @@ def allowed_file(filename):
 
 
 def save_review_image(file):
-    """Save uploaded image and return the filename, or None if invalid"""
+    """Save uploaded image and return (filename, is_new), or (None, False) if invalid.
+
+    Files are stored under a hash of their content, so re-uploading a photo
+    that is already stored returns the existing filename.
+    """
     if not file or file.filename == '':
-        return None
+        return None, False
     
     if not allowed_file(file.filename):
-        return None
+        return None, False
     
     try:
-        # Generate unique filename to avoid collisions
         ext = file.filename.rsplit('.', 1)[1].lower()
-        filename = f"review_{uuid.uuid4().hex}_{int(datetime.now().timestamp())}.{ext}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        return filename
+        return upload_store.save(file.stream, ext)
     except Exception as e:
         print(f"Error saving file: {e}")
-        return None
+        return None, False
 
 
 class Room(db.Model):
@@ -93,7 +203,108 @@ class Room(db.Model):
     capacity = db.Column(db.Integer, nullable=False)
     price_per_night = db.Column(db.Float, nullable=False)
     image_url = db.Column(db.String(500))
-    amenities = db.Column(db.String(500))
+    amenities = db.Column(db.String(500))  # display text; searchable copy in room_amenity
+
+    image_variants = db.relationship('RoomImageVariant', cascade='all, delete-orphan',
+                                     order_by='RoomImageVariant.width')
+
+    __table_args__ = (
+        db.Index('ix_room_type_price', 'room_type', 'price_per_night'),
+        db.Index('ix_room_capacity_price', 'capacity', 'price_per_night'),
+    )
+
+    def _current_variants(self, fmt):
+        # Copies of an earlier image_url are ignored until the job replaces them.
+        return [v for v in self.image_variants if v.format == fmt and v.source_url == self.image_url]
+
+    def image_srcset(self, fmt):
+        """srcset over the local copies of image_url in one format; empty until they are made"""
+        return ', '.join(f"{url_for('upload_file', filename=v.filename)} {v.width}w"
+                         for v in self._current_variants(fmt))
+
+    def image_src(self, width=640):
+        """URL for <img src>: the local JPEG nearest ``width``, else image_url, else the stock photo"""
+        copies = self._current_variants('jpg')
+        if copies:
+            best = min(copies, key=lambda v: (v.width < width, abs(v.width - width)))
+            return url_for('upload_file', filename=best.filename)
+        return self.image_url or DEFAULT_ROOM_IMAGE
+
+
+class RoomImageVariant(db.Model):
+    """A resized local copy of a room's image_url, made by the 'room_image_variants' job"""
+    id = db.Column(db.Integer, primary_key=True)
+    room_id = db.Column(db.Integer, db.ForeignKey('room.id'), nullable=False, index=True)
+    source_url = db.Column(db.String(500), nullable=False)  # the image_url it was made from
+    width = db.Column(db.Integer, nullable=False)
+    format = db.Column(db.String(10), nullable=False)  # webp, jpg
+    filename = db.Column(db.String(200), nullable=False, index=True)
+
+
+class Amenity(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(100), nullable=False, unique=True)  # lower-cased for matching
+    name = db.Column(db.String(100), nullable=False)
+
+
+room_amenity = db.Table(
+    'room_amenity',
+    db.Column('room_id', db.Integer, db.ForeignKey('room.id'), primary_key=True),
+    db.Column('amenity_id', db.Integer, db.ForeignKey('amenity.id'), primary_key=True),
+    # The primary key serves room -> amenities; this serves amenity -> rooms.
+    db.Index('ix_room_amenity_amenity', 'amenity_id', 'room_id'),
+)
+
+
+def amenity_key(name):
+    return ' '.join(name.split()).lower()
+
+
+def _chunks(items, size=500):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def sync_room_amenities(room_ids=None):
+    """Rebuild room_amenity from Room.amenities for some rooms (all if None).
+
+    Runs in the caller's transaction; call it after any write that changes
+    Room.amenities.
+    """
+    query = db.session.query(Room.id, Room.amenities)
+    if room_ids is None:
+        rows = query.all()
+        db.session.execute(room_amenity.delete())
+    else:
+        rows = []
+        for chunk in _chunks(room_ids):
+            rows.extend(query.filter(Room.id.in_(chunk)).all())
+            db.session.execute(room_amenity.delete().where(room_amenity.c.room_id.in_(chunk)))
+
+    wanted = {}  # room_id -> set of keys
+    names = {}   # key -> display name
+    for room_id, amenities in rows:
+        keys = wanted.setdefault(room_id, set())
+        for name in (amenities or '').split(','):
+            name = ' '.join(name.split())
+            if name:
+                keys.add(amenity_key(name))
+                names.setdefault(amenity_key(name), name)
+    if not names:
+        return
+
+    for chunk in _chunks(names.items()):
+        db.session.execute(
+            sqlite_insert(Amenity).values([{'key': k, 'name': n} for k, n in chunk])
+            .on_conflict_do_nothing(index_elements=[Amenity.key])
+        )
+    ids = {}
+    for chunk in _chunks(names):
+        ids.update(db.session.query(Amenity.key, Amenity.id).filter(Amenity.key.in_(chunk)).all())
+    links = [{'room_id': room_id, 'amenity_id': ids[key]} for room_id, keys in wanted.items() for key in keys]
+    if links:
+        db.session.execute(room_amenity.insert(), links)
 
 
 class Booking(db.Model):
@@ -103,8 +314,8 @@ class Booking(db.Model):
     room_id = db.Column(db.Integer, db.ForeignKey('room.id'), nullable=False)
     room_name = db.Column(db.String(200), nullable=False)
     room_type = db.Column(db.String(100))
-    check_in = db.Column(db.String(20), nullable=False)
-    check_out = db.Column(db.String(20), nullable=False)
+    check_in = db.Column(db.Date, nullable=False)
+    check_out = db.Column(db.Date, nullable=False)
     guests = db.Column(db.Integer, nullable=False)
     price_per_night = db.Column(db.Float, nullable=False)
     nights = db.Column(db.Integer, nullable=False)
@@ -113,6 +324,40 @@ class Booking(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.now)
     updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
 
+    __table_args__ = (
+        db.Index('ix_booking_room_dates', 'room_id', 'check_in', 'check_out'),
+        db.Index('ix_booking_created', 'created_at'),
+        db.Index('ix_booking_customer_email', 'customer_email', 'created_at'),
+        # AUTOINCREMENT so ids are never reused once the newest rows have
+        # been archived; an id then names one booking across both tables.
+        {'sqlite_autoincrement': True},
+    )
+
+
+class BookingArchive(db.Model):
+    """Old finished stays moved out of Booking by archive_bookings(); same columns plus archived_at"""
+    id = db.Column(db.Integer, primary_key=True)  # the id it had in Booking
+    customer_name = db.Column(db.String(200), nullable=False)
+    customer_email = db.Column(db.String(200), nullable=False)
+    room_id = db.Column(db.Integer, nullable=False)  # no FK: the room may be gone by now
+    room_name = db.Column(db.String(200), nullable=False)
+    room_type = db.Column(db.String(100))
+    check_in = db.Column(db.Date, nullable=False)
+    check_out = db.Column(db.Date, nullable=False)
+    guests = db.Column(db.Integer, nullable=False)
+    price_per_night = db.Column(db.Float, nullable=False)
+    nights = db.Column(db.Integer, nullable=False)
+    total_price = db.Column(db.Float, nullable=False)
+    status = db.Column(db.String(50))
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    __table_args__ = (
+        db.Index('ix_booking_archive_customer_email', 'customer_email', 'created_at'),
+        db.Index('ix_booking_archive_created', 'created_at'),
+    )
+
 
 class Review(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -120,10 +365,1253 @@ class Review(db.Model):
     name = db.Column(db.String(200), nullable=False)
     rating = db.Column(db.Integer, nullable=False, default=5)
     comment = db.Column(db.Text, nullable=False)
-    image = db.Column(db.String(500))  # filename of the uploaded image
-    created_at = db.Column(db.DateTime, default=datetime.now)
+    image = db.Column(db.String(500), index=True)  # filename of the uploaded image
+    # Part of the review page cursor, so it must always be set
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
     
     room = db.relationship('Room', backref='reviews')
+    variants = db.relationship('ReviewImageVariant', backref='review', cascade='all, delete-orphan',
+                               order_by='ReviewImageVariant.width')
+
+    __table_args__ = (
+        db.Index('ix_review_room_created', 'room_id', 'created_at', 'id'),
+    )
+
+    def srcset(self, fmt):
+        """srcset attribute value for the resized copies in one format"""
+        return ', '.join(
+            f"{url_for('upload_file', filename=v.filename)} {v.width}w"
+            for v in self.variants if v.format == fmt
+        )
+
+    def image_src(self, **url_args):
+        """URL for <img src>: the largest JPEG copy, which carries no EXIF/GPS; the original until it exists"""
+        copies = [v for v in self.variants if v.format == 'jpg']  # ordered by width
+        return url_for('upload_file', filename=copies[-1].filename if copies else self.image, **url_args)
+
+
+class ReviewImageVariant(db.Model):
+    """A resized, metadata-stripped copy of a review image"""
+    id = db.Column(db.Integer, primary_key=True)
+    review_id = db.Column(db.Integer, db.ForeignKey('review.id'), nullable=False, index=True)
+    width = db.Column(db.Integer, nullable=False)
+    format = db.Column(db.String(10), nullable=False)  # webp, jpg
+    filename = db.Column(db.String(200), nullable=False, index=True)
+
+
+class RoomRatingStats(db.Model):
+    """Running review totals per room, maintained on every review write"""
+    room_id = db.Column(db.Integer, db.ForeignKey('room.id'), primary_key=True)
+    review_count = db.Column(db.Integer, nullable=False, default=0)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+    stars_1 = db.Column(db.Integer, nullable=False, default=0)
+    stars_2 = db.Column(db.Integer, nullable=False, default=0)
+    stars_3 = db.Column(db.Integer, nullable=False, default=0)
+    stars_4 = db.Column(db.Integer, nullable=False, default=0)
+    stars_5 = db.Column(db.Integer, nullable=False, default=0)
+
+    @property
+    def average(self):
+        return self.rating_sum / self.review_count if self.review_count else 0
+
+    @property
+    def histogram(self):
+        return {n: getattr(self, f'stars_{n}') for n in range(1, 6)}
+
+
+def record_review_rating(room_id, rating):
+    """Add one rating to the room's aggregate row in the current transaction"""
+    star = f'stars_{rating}'
+    stmt = sqlite_insert(RoomRatingStats).values(room_id=room_id, review_count=1, rating_sum=rating, **{star: 1})
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[RoomRatingStats.room_id],
+        set_={
+            'review_count': RoomRatingStats.review_count + 1,
+            'rating_sum': RoomRatingStats.rating_sum + rating,
+            star: getattr(RoomRatingStats, star) + 1,
+        },
+    )
+    db.session.execute(stmt)
+
+
+def rebuild_review_stats():
+    """Recompute every room's aggregate from the Review table"""
+    columns = [
+        Review.room_id,
+        db.func.count(Review.id),
+        db.func.sum(Review.rating),
+    ] + [db.func.sum(db.case((Review.rating == n, 1), else_=0)) for n in range(1, 6)]
+    rows = db.session.query(*columns).group_by(Review.room_id).all()
+    RoomRatingStats.query.delete()
+    db.session.add_all(
+        RoomRatingStats(room_id=row[0], review_count=row[1], rating_sum=row[2],
+                        stars_1=row[3], stars_2=row[4], stars_3=row[5], stars_4=row[6], stars_5=row[7])
+        for row in rows
+    )
+    db.session.commit()
+    return len(rows)
+
+
+class CacheVersion(db.Model):
+    """Write counters that key the rendered-fragment cache.
+
+    'rooms' changes with any room or review write; 'room:<id>' only with
+    writes to that room's card.  Kept in the database so every worker
+    process sees the same versions.
+    """
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+def bump_cache_versions(names, sess=None):
+    """Increment cache versions in the current transaction"""
+    sess = sess or db.session
+    for name in names:
+        stmt = sqlite_insert(CacheVersion).values(name=name, version=1).on_conflict_do_update(
+            index_elements=[CacheVersion.name],
+            set_={'version': CacheVersion.version + 1},
+        )
+        sess.execute(stmt)
+
+
+def cache_versions():
+    return dict(db.session.query(CacheVersion.name, CacheVersion.version).all())
+
+
+class Payment(db.Model):
+    """One completed checkout; the unique token makes resubmitted forms harmless"""
+    id = db.Column(db.Integer, primary_key=True)
+    token = db.Column(db.String(32), unique=True, nullable=False)
+    customer_name = db.Column(db.String(200), nullable=False)
+    customer_email = db.Column(db.String(200), nullable=False)
+    total_price = db.Column(db.Float, nullable=False)
+    booking_count = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+
+class CartSession(db.Model):
+    """Server-side cart contents; the cookie only carries the id"""
+    id = db.Column(db.String(32), primary_key=True)
+    data = db.Column(db.Text, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, index=True)
+
+
+if CART_STORE == 'memory':
+    cart_store = MemoryCartStore(ttl=CART_TTL)
+else:
+    cart_store = SQLCartStore(lambda: db.engine, CartSession.__table__, ttl=CART_TTL)
+
+
+def get_cart():
+    """The current visitor's cart, loaded from the cart store once per request"""
+    if 'cart' not in g:
+        cart_id = session.get('cart_id')
+        data = cart_store.load(cart_id) if cart_id else None
+        g.cart = Cart(cart_id if data is not None else None, data)
+        # Carry over anything still held in cookies from before the cart store.
+        for key in ('bookings', 'payment_info'):
+            if key in session:
+                g.cart[key] = session.pop(key)
+        session.pop('reviews', None)  # reviews live in the Review table now
+    return g.cart
+
+
+@app.after_request
+def _save_cart(response):
+    cart = g.get('cart')
+    if cart is not None and cart.modified:
+        if cart.id is None:
+            cart.id = new_cart_id()
+            session['cart_id'] = cart.id
+        cart_store.save(cart.id, dict(cart))
+    return response
+
+
+def quote_cart(cart):
+    """Price the cart's bookings, dropping lines that can no longer be priced"""
+    quote = pricer.price_cart(cart.get('bookings', []), rates_version())
+    if quote.invalid:
+        cart['bookings'] = quote.lines
+        flash('บางรายการในตะกร้ามีวันที่ไม่ถูกต้องและถูกนำออกแล้ว', 'warning')
+    elif quote.changed:
+        cart.modified = True
+    return quote
+
+
+@app.context_processor
+def _inject_cart():
+    return {'cart': get_cart()}
+
+
+@app.cli.command('purge-carts')
+def purge_carts_command():
+    """Delete carts that have expired."""
+    print(f'Purged {cart_store.purge_expired()} expired carts.')
+
+
+# --- Background jobs --------------------------------------------------------
+
+class Job(db.Model):
+    """A unit of background work; see job_queue.py"""
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, dead
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    locked_until = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_job_status_run_at', 'status', 'run_at'),
+    )
+
+
+job_queue = JobQueue(lambda: db.engine, Job.__table__)
+job_workers = WorkerPool(job_queue, JOB_WORKERS, context=app.app_context)
+mailer = None  # set by init_runtime()
+
+
+def enqueue_job(name, **payload):
+    """Queue a job in the current transaction; it only runs if that commits"""
+    job_queue.enqueue(name, payload, conn=db.session)
+
+
+@app.before_request
+def _start_job_workers():
+    if not job_workers.started:
+        job_workers.start()
+
+
+@job_queue.handler('send_mail')
+def send_mail_job(to, subject, body):
+    mailer.send(build_message(to, subject, body))
+
+
+@app.cli.command('run-worker')
+def run_worker_command():
+    """Run background jobs until interrupted."""
+    pool = WorkerPool(job_queue, max(JOB_WORKERS, 1), context=app.app_context)
+    pool.start()
+    print(f'Running jobs on {pool.threads} threads; Ctrl+C to stop.')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pool.stop()
+
+
+@app.cli.command('retry-dead-jobs')
+def retry_dead_jobs_command():
+    """Put every dead job back in the queue."""
+    print(f'Requeued {job_queue.retry()} dead jobs.')
+
+
+@app.cli.command('purge-jobs')
+def purge_jobs_command():
+    """Delete finished jobs older than the retention period."""
+    print(f'Purged {job_queue.purge(timedelta(days=JOB_RETENTION_DAYS))} finished jobs.')
+
+
+# --- Rate calendar ----------------------------------------------------------
+
+class RateRule(db.Model):
+    """A seasonal, weekday or occupancy price adjustment; see rates.py"""
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200), nullable=False)
+    room_type = db.Column(db.String(100))  # None: every room type
+    start_date = db.Column(db.Date)
+    end_date = db.Column(db.Date)
+    weekdays = db.Column(db.String(7), nullable=False, default='')  # date.weekday() digits, '' for every night
+    min_occupancy = db.Column(db.Float)  # 0-1; None: regardless of occupancy
+    multiplier = db.Column(db.Float, nullable=False)
+    active = db.Column(db.Boolean, nullable=False, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+
+class RoomRate(db.Model):
+    """Materialized price of one room for one night, kept by refresh_rate_calendar()"""
+    room_id = db.Column(db.Integer, db.ForeignKey('room.id'), primary_key=True)
+    night = db.Column(db.Date, primary_key=True)
+    rate = db.Column(db.Float, nullable=False)
+
+
+def rates_version():
+    return db.session.query(CacheVersion.version).filter_by(name='rates').scalar() or 0
+
+
+def _active_rules():
+    return RateRule.query.filter_by(active=True).order_by(RateRule.id).all()
+
+
+def room_type_occupancy(room_types, start, end):
+    """Booked share of each room type's rooms per night in [start, end)"""
+    counts = dict(db.session.query(Room.room_type, db.func.count(Room.id))
+                  .filter(Room.room_type.in_(room_types)).group_by(Room.room_type))
+    stays = db.session.query(Room.room_type, Booking.check_in, Booking.check_out).join(
+        Room, Room.id == Booking.room_id
+    ).filter(
+        Room.room_type.in_(room_types),
+        Booking.status != 'cancelled',
+        Booking.check_in < end,
+        Booking.check_out > start,
+    )
+    return occupancy_by_night(stays, counts, start, end)
+
+
+def refresh_rate_calendar(room_ids=None, start=None, end=None, room_types=None):
+    """Recompute RoomRate rows for some rooms and nights (default: all, whole horizon).
+
+    Runs in the caller's transaction and bumps the 'rates' version so cart
+    lines priced from the old rows are repriced.  Returns the rows written.
+    """
+    today = date.today()
+    horizon = today + timedelta(days=RATE_CALENDAR_DAYS)
+    start = max(start or today, today)
+    end = min(end or horizon, horizon)
+    if start >= end:
+        return 0
+    query = db.session.query(Room.id, Room.room_type, Room.price_per_night)
+    if room_types is not None:
+        query = query.filter(Room.room_type.in_(room_types))
+    if room_ids is None:
+        rooms = query.all()
+    else:
+        rooms = []
+        for chunk in _chunks(room_ids):
+            rooms.extend(query.filter(Room.id.in_(chunk)).all())
+    if not rooms:
+        return 0
+
+    rules = _active_rules()
+    occupancy = {}
+    if any(rule.min_occupancy is not None for rule in rules):
+        occupancy = room_type_occupancy({room_type for _, room_type, _ in rooms}, start, end)
+    rows = [
+        {'room_id': room_id, 'night': night,
+         'rate': nightly_rate(base, room_type, night, rules, occupancy.get((room_type, night), 0.0))}
+        for room_id, room_type, base in rooms
+        for night in iter_nights(start, end)
+    ]
+    rate_table = RoomRate.__table__
+    for chunk in _chunks([room_id for room_id, _, _ in rooms]):
+        db.session.execute(rate_table.delete().where(
+            rate_table.c.room_id.in_(chunk), rate_table.c.night >= start, rate_table.c.night < end))
+    for chunk in _chunks(rows, 5000):
+        db.session.execute(rate_table.insert(), chunk)
+    bump_cache_versions(['rates'])
+    return len(rows)
+
+
+@job_queue.handler('refresh_rates')
+def refresh_rates_job(room_ids=None, room_types=None, start=None, end=None):
+    refresh_rate_calendar(room_ids, parse_date(start), parse_date(end), room_types)
+    db.session.commit()
+
+
+def clear_rate_calendar(room_ids=None, room_types=None, start=None, end=None):
+    """Drop the calendar rows a refresh will rewrite, in the caller's transaction.
+
+    quote_stay() prices nights missing from the calendar straight from the
+    room and the rules, so until the refresh has run customers are charged
+    the new price, never the one the stale rows held.
+    """
+    rate_table = RoomRate.__table__
+    today = date.today()
+    stmt = rate_table.delete().where(rate_table.c.night >= max(start or today, today))
+    if end is not None:
+        stmt = stmt.where(rate_table.c.night < end)
+    if room_types is not None:
+        stmt = stmt.where(rate_table.c.room_id.in_(db.select(Room.id).where(Room.room_type.in_(room_types))))
+    if room_ids is None:
+        db.session.execute(stmt)
+    else:
+        for chunk in _chunks(room_ids):
+            db.session.execute(stmt.where(rate_table.c.room_id.in_(chunk)))
+    bump_cache_versions(['rates'])
+
+
+def queue_rate_refresh(room_ids=None, room_types=None, start=None, end=None):
+    """Refresh part of the calendar in the background once this transaction commits.
+
+    The affected rows are cleared now, so prices are right before the job runs.
+    """
+    room_ids = room_ids and list(room_ids)
+    clear_rate_calendar(room_ids, room_types, start, end)
+    enqueue_job('refresh_rates', room_ids=room_ids and list(room_ids), room_types=room_types and list(room_types),
+                start=start and start.isoformat(), end=end and end.isoformat())
+
+
+def queue_rule_refresh(rule):
+    """Refresh only the rooms and nights a rule can affect"""
+    today = date.today()
+    window = rule_window(rule, today, today + timedelta(days=RATE_CALENDAR_DAYS))
+    if window is not None:
+        queue_rate_refresh(room_types=[rule.room_type] if rule.room_type else None, start=window[0], end=window[1])
+
+
+@job_queue.handler('refresh_occupancy_rates')
+def refresh_occupancy_rates(stays):
+    """Re-run occupancy rules over the nights of newly booked [room_id, check_in, check_out] stays"""
+    if not stays or not RateRule.query.filter(RateRule.active, RateRule.min_occupancy.isnot(None)).first():
+        return
+    room_ids = {room_id for room_id, _, _ in stays}
+    room_types = {t for (t,) in db.session.query(Room.room_type).filter(Room.id.in_(room_ids)).distinct()}
+    refresh_rate_calendar(start=min(parse_date(s[1]) for s in stays), end=max(parse_date(s[2]) for s in stays),
+                          room_types=room_types)
+    db.session.commit()
+
+
+def live_rates(room_id, start, end):
+    """Evaluate the rules directly for nights the calendar doesn't hold"""
+    room = db.session.get(Room, room_id)
+    if room is None:
+        raise PricingError(f'room {room_id} no longer exists')
+    rules = _active_rules()
+    occupancy = {}
+    if any(rule.min_occupancy is not None for rule in rules):
+        occupancy = room_type_occupancy({room.room_type}, start, end)
+    return {
+        night: nightly_rate(room.price_per_night, room.room_type, night, rules,
+                            occupancy.get((room.room_type, night), 0.0))
+        for night in iter_nights(start, end)
+    }
+
+
+def room_rates(room_id, start, end):
+    """Nightly rates for [start, end), from the calendar where it has them"""
+    rates = dict(db.session.query(RoomRate.night, RoomRate.rate).filter(
+        RoomRate.room_id == room_id, RoomRate.night >= start, RoomRate.night < end))
+    if len(rates) < (end - start).days:
+        rates = {**live_rates(room_id, start, end), **rates}
+    return dict(sorted(rates.items()))
+
+
+def quote_stay(room_id, check_in, check_out):
+    """Price of a stay as one indexed range sum over the rate calendar"""
+    check_in, check_out = parse_date(check_in), parse_date(check_out)
+    priced, total = db.session.query(
+        db.func.count(RoomRate.night), db.func.coalesce(db.func.sum(RoomRate.rate), 0.0)
+    ).filter(RoomRate.room_id == room_id, RoomRate.night >= check_in, RoomRate.night < check_out).one()
+    if priced == (check_out - check_in).days:
+        return round(total, 2)
+    # Past the horizon, or rooms whose refresh hasn't run yet.
+    return round(sum(room_rates(room_id, check_in, check_out).values()), 2)
+
+
+pricer = CartPricer(stay_total=quote_stay)
+
+
+@app.cli.command('refresh-rates')
+def refresh_rates_command():
+    """Rebuild the nightly rate calendar and drop past nights; run daily."""
+    RoomRate.query.filter(RoomRate.night < date.today()).delete()
+    written = refresh_rate_calendar()
+    db.session.commit()
+    print(f'Wrote {written} nightly rates for the next {RATE_CALENDAR_DAYS} days.')
+
+
+def upload_ref_count(filename):
+    """How many reviews and room photos use a stored file, as the original or a resized copy"""
+    return (Review.query.filter(Review.image == filename).count()
+            + ReviewImageVariant.query.filter(ReviewImageVariant.filename == filename).count()
+            + RoomImageVariant.query.filter(RoomImageVariant.filename == filename).count())
+
+
+def detach_review_image(review):
+    """Clear a review's image and resized copies; returns the filenames it used.
+
+    Pass the result to release_uploads() once the change is committed.
+    """
+    filenames = [review.image] + [v.filename for v in review.variants]
+    review.image = None
+    review.variants = []
+    return filenames
+
+
+def release_uploads(filenames):
+    """Delete stored files that nothing references any more.
+
+    Recently written files are kept: an upload of the same bytes may be
+    about to commit a row naming them.  gc-uploads collects them later.
+    """
+    for filename in filenames:
+        if upload_ref_count(filename) == 0:
+            try:
+                upload_store.delete(filename, UPLOAD_GRACE_SECONDS)
+            except Exception as e:
+                print(f"Error deleting file: {e}")
+
+
+def attach_review_variants(review, is_new):
+    """Give a review resized copies of its image, reusing them for duplicate uploads.
+
+    Runs as the 'review_image_variants' job; the page shows the original
+    until it has finished.
+    """
+    if not is_new:
+        twin = Review.query.filter(Review.image == review.image, Review.id != review.id,
+                                   Review.variants.any()).first()
+        if twin is not None:
+            review.variants = [ReviewImageVariant(width=v.width, format=v.format, filename=v.filename)
+                               for v in twin.variants]
+            db.session.commit()
+            return
+    variants = make_variants(upload_store.path(review.image), upload_store.root)
+    if variants:
+        review.variants = [ReviewImageVariant(width=w, format=fmt, filename=name) for w, fmt, name in variants]
+        db.session.commit()
+
+
+@job_queue.handler('review_image_variants')
+def review_image_variants_job(review_id, is_new):
+    review = db.session.get(Review, review_id)
+    if review is None or review.image is None:
+        return  # deleted before the job ran
+    attach_review_variants(review, is_new)
+
+
+def cache_room_image(room):
+    """Download a room's image_url and give the room resized local copies of it.
+
+    Runs as the 'room_image_variants' job; pages hot-link image_url until
+    it has finished, and keep doing so if Pillow is missing.  Returns the
+    number of copies made.
+    """
+    url = room.image_url
+    old = {v.filename for v in room.image_variants}
+    variants = []
+    if url:
+        data = download_image(url, ROOM_IMAGE_MAX_BYTES)
+        # A stale .upload- temp file is removed by gc-uploads if we die here.
+        fd, tmp = tempfile.mkstemp(dir=upload_store.root, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                fh.write(data)
+            variants = make_variants(tmp, upload_store.root, ROOM_IMAGE_WIDTHS)
+        finally:
+            os.remove(tmp)
+        if not variants:
+            return 0
+    room.image_variants = [RoomImageVariant(room_id=room.id, source_url=url, width=w, format=fmt, filename=name)
+                           for w, fmt, name in variants]
+    db.session.commit()
+    release_uploads(old - {name for _, _, name in variants})
+    return len(variants)
+
+
+@job_queue.handler('room_image_variants')
+def room_image_variants_job(room_id):
+    room = db.session.get(Room, room_id)
+    if room is None:
+        return  # deleted before the job ran
+    cache_room_image(room)
+
+
+def queue_room_images(room_ids):
+    """Queue local copies of the given rooms' images in the current transaction"""
+    for room_id in room_ids:
+        enqueue_job('room_image_variants', room_id=room_id)
+
+
+@app.cli.command('cache-room-images')
+def cache_room_images_command():
+    """Queue local copies for every room whose image isn't cached yet."""
+    current = db.select(RoomImageVariant.id).where(
+        RoomImageVariant.room_id == Room.id, RoomImageVariant.source_url == Room.image_url)
+    room_ids = db.session.scalars(
+        db.select(Room.id).where(Room.image_url != '', Room.image_url.isnot(None), ~current.exists())
+    ).all()
+    queue_room_images(room_ids)
+    db.session.commit()
+    print(f'Queued image downloads for {len(room_ids)} rooms.')
+
+
+@app.route('/media/<path:filename>')
+def upload_file(filename):
+    if not is_content_addressed(filename):
+        # Files from before content addressing can be replaced in place.
+        return send_from_directory(upload_store.root, filename, max_age=3600)
+    response = send_from_directory(upload_store.root, filename, max_age=UPLOAD_MAX_AGE, etag=etag_for(filename))
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+asset_manifest = AssetManifest(os.path.join(ASSET_DIR, 'manifest.json'))
+
+
+def asset_url(filename):
+    """URL of a static file: fingerprinted and cached forever once build-assets has run, plain otherwise"""
+    built = asset_manifest.lookup(filename)
+    if built is None:
+        return url_for('static', filename=filename)
+    return url_for('asset_file', filename=built)
+
+app.jinja_env.globals['asset_url'] = asset_url
+
+
+@app.route('/assets/<path:filename>')
+def asset_file(filename):
+    """A fingerprinted build output, precompressed when the client accepts it"""
+    if asset_manifest.encodings(filename) is None:
+        abort(404)
+    path, encoding = asset_manifest.negotiate(filename, request.accept_encodings)
+    response = send_from_directory(ASSET_DIR, path, mimetype=mimetypes.guess_type(filename)[0],
+                                   max_age=ASSET_MAX_AGE)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@app.after_request
+def _preload_stylesheet(response):
+    # Announced in a header so a proxy that sends 103 Early Hints can start
+    # fetching the CSS while the page is still being rendered.
+    if response.mimetype == 'text/html':
+        built = asset_manifest.lookup('style.css')
+        if built is not None:
+            response.headers.add('Link', f"<{url_for('asset_file', filename=built)}>; rel=preload; as=style")
+    return response
+
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Fingerprint, minify and precompress static/ into static/dist/."""
+    manifest = build_assets(os.path.join(basedir, 'static'), ASSET_DIR)
+    asset_manifest.reload()
+    for source, entry in sorted(manifest.items()):
+        print(f"{source} -> {entry['path']} {' '.join(entry['encodings'])}")
+
+
+@app.cli.command('gc-uploads')
+def gc_uploads_command():
+    """Delete uploaded files that no review references."""
+    referenced = {name for (name,) in db.session.query(Review.image).filter(Review.image.isnot(None)).distinct()}
+    referenced.update(name for (name,) in db.session.query(ReviewImageVariant.filename).distinct())
+    referenced.update(name for (name,) in db.session.query(RoomImageVariant.filename).distinct())
+    removed = upload_store.sweep(referenced, UPLOAD_GRACE_SECONDS)
+    print(f'Removed {len(removed)} unreferenced uploads.')
+
+
+def encode_review_cursor(review):
+    raw = f'{review.created_at.isoformat()}|{review.id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_review_cursor(cursor):
+    """Return (created_at, id) from a cursor, or None if it is malformed"""
+    try:
+        created_at, review_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), int(review_id)
+    except Exception:
+        return None
+
+
+def review_page(room_id, after=None, limit=REVIEWS_PAGE_SIZE):
+    """Newest-first page of a room's reviews using keyset pagination.
+
+    ``after`` is a decoded cursor; rows are read straight off the
+    (room_id, created_at, id) index so the cost doesn't depend on how many
+    reviews come before the page.  Returns (reviews, next_cursor).
+    """
+    query = Review.query.filter(Review.room_id == room_id)
+    if after is not None:
+        query = query.filter(db.tuple_(Review.created_at, Review.id) < after)
+    rows = query.options(db.selectinload(Review.variants)).order_by(
+        Review.created_at.desc(), Review.id.desc()
+    ).limit(limit + 1).all()
+    next_cursor = encode_review_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def review_to_dict(review):
+    return {
+        'id': review.id,
+        'name': review.name,
+        'rating': review.rating,
+        'comment': review.comment,
+        'image': review.image,
+        'src': review.image_src() if review.image else '',
+        'srcset_webp': review.srcset('webp') if review.image else '',
+        'srcset_jpg': review.srcset('jpg') if review.image else '',
+        'date': review.created_at.strftime('%d/%m/%Y %H:%M') if review.created_at else ''
+    }
+
+
+@app.cli.command('rebuild-amenities')
+def rebuild_amenities_command():
+    """Rebuild the amenity search index from Room.amenities."""
+    sync_room_amenities()
+    db.session.commit()
+    print(f'Indexed amenities for {Room.query.count()} rooms.')
+
+
+@app.cli.command('backfill-review-stats')
+def backfill_review_stats_command():
+    """Rebuild per-room rating aggregates from existing reviews."""
+    count = rebuild_review_stats()
+    print(f'Rebuilt rating stats for {count} rooms.')
+
+
+# --- Review search ----------------------------------------------------------
+# An external-content FTS5 index over Review.name and Review.comment, kept
+# in step by triggers so every write path (add_review, bulk loads, deletes)
+# is covered.  Thai is written without spaces between words, so the
+# unicode61 tokenizer would index whole phrases; the trigram tokenizer
+# indexes every 3-character run instead, which matches Thai words and
+# English substrings alike, case-insensitively.
+
+REVIEW_FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS review_fts USING fts5(
+        name, comment, content='review', content_rowid='id', tokenize='trigram')""",
+    """CREATE TRIGGER IF NOT EXISTS review_fts_ai AFTER INSERT ON review BEGIN
+        INSERT INTO review_fts(rowid, name, comment) VALUES (new.id, new.name, new.comment);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS review_fts_ad AFTER DELETE ON review BEGIN
+        INSERT INTO review_fts(review_fts, rowid, name, comment) VALUES ('delete', old.id, old.name, old.comment);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS review_fts_au AFTER UPDATE OF name, comment ON review BEGIN
+        INSERT INTO review_fts(review_fts, rowid, name, comment) VALUES ('delete', old.id, old.name, old.comment);
+        INSERT INTO review_fts(rowid, name, comment) VALUES (new.id, new.name, new.comment);
+    END""",
+]
+REVIEW_SEARCH_PAGE_SIZE = 20
+REVIEW_SNIPPET_CHARS = 160  # comment text shown around the first match
+
+
+def ensure_review_search():
+    with db.engine.begin() as conn:
+        for ddl in REVIEW_FTS_DDL:
+            conn.exec_driver_sql(ddl)
+
+
+def rebuild_review_search():
+    """Re-index every existing review"""
+    ensure_review_search()
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql("INSERT INTO review_fts(review_fts) VALUES ('rebuild')")
+
+
+def _fts_query(terms):
+    # Quote every term so user input can't use FTS5 query syntax.
+    return ' '.join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def review_snippet(comment, terms, width=REVIEW_SNIPPET_CHARS):
+    """HTML for about ``width`` characters of a comment around its first match, terms in <mark>.
+
+    Cut here rather than by FTS5 snippet(): under the trigram tokenizer
+    each token is about one character, so its 64-token cap is too short.
+    """
+    if not terms:
+        return str(escape(comment[:width])) + ('…' if len(comment) > width else '')
+    pattern = re.compile('|'.join(re.escape(t) for t in sorted(terms, key=len, reverse=True)), re.IGNORECASE)
+    first = pattern.search(comment)
+    start = max(0, min((first.start() if first else 0) - width // 4, len(comment) - width))
+    end = min(len(comment), start + width)
+    piece = comment[start:end]
+    parts, pos = [], 0
+    for match in pattern.finditer(piece):
+        parts.append(str(escape(piece[pos:match.start()])))
+        parts.append(f'<mark>{escape(match.group())}</mark>')
+        pos = match.end()
+    parts.append(str(escape(piece[pos:])))
+    return ('…' if start else '') + ''.join(parts) + ('…' if end < len(comment) else '')
+
+
+def search_reviews(q, room_id=None, limit=REVIEW_SEARCH_PAGE_SIZE, offset=0):
+    """Best-matching reviews for ``q`` as dicts with highlighted snippets.
+
+    Terms of three or more characters go through the FTS index and are
+    ranked by bm25 (comment matches weigh more than name matches).
+    Trigrams can't match shorter terms, so those are applied as LIKE
+    filters on the rows the index returns - or scan on their own if the
+    query has no longer term.
+    """
+    terms = q.split()
+    long_terms = [t for t in terms if len(t) >= 3]
+    short_terms = [t for t in terms if len(t) < 3]
+    params = {'limit': limit, 'offset': offset}
+    where = []
+    if long_terms:
+        where.append('review_fts MATCH :match')
+        params['match'] = _fts_query(long_terms)
+    for i, term in enumerate(short_terms):
+        where.append(f"(review_fts.name LIKE :short{i} ESCAPE '\\' OR review_fts.comment LIKE :short{i} ESCAPE '\\')")
+        params[f'short{i}'] = '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    if room_id is not None:
+        where.append('review.room_id = :room_id')
+        params['room_id'] = room_id
+    rank = 'bm25(review_fts, 1.0, 2.0)' if long_terms else '0'
+    sql = f"""
+        SELECT review.id, review.room_id, review.name, review.rating, review.created_at, review.comment,
+               {rank} AS rank
+        FROM review_fts JOIN review ON review.id = review_fts.rowid
+        WHERE {' AND '.join(where)}
+        ORDER BY rank, review.created_at DESC
+        LIMIT :limit OFFSET :offset
+    """
+    rows = db.session.execute(text(sql), params).mappings().all()
+    return [{
+        'id': row['id'],
+        'room_id': row['room_id'],
+        'name': row['name'],
+        'rating': row['rating'],
+        'created_at': row['created_at'],
+        'snippet': review_snippet(row['comment'], terms),
+        'score': -row['rank'] if long_terms else None,
+    } for row in rows]
+
+
+@app.cli.command('rebuild-review-search')
+def rebuild_review_search_command():
+    """Rebuild the full-text index over review names and comments."""
+    rebuild_review_search()
+    print(f'Indexed {Review.query.count()} reviews for search.')
+
+
+# --- Availability -----------------------------------------------------------
+# Stays are half-open [check_in, check_out) intervals; cancelled bookings
+# never block a room.
+
+def overlapping_bookings(room_id, check_in, check_out):
+    """Query for active bookings of a room that overlap [check_in, check_out).
+
+    Served by the (room_id, check_in, check_out) index.
+    """
+    return Booking.query.filter(
+        Booking.room_id == room_id,
+        Booking.check_in < check_out,
+        Booking.check_out > check_in,
+        Booking.status != 'cancelled',
+    )
+
+
+def room_free_during(check_in, check_out):
+    """Filter on Room: no active booking overlaps [check_in, check_out).
+
+    A NOT EXISTS correlated on room_id, so each room is one probe of the
+    (room_id, check_in, check_out) index rather than a scan of all bookings.
+    """
+    return ~db.exists().where(
+        Booking.room_id == Room.id,
+        Booking.check_in < check_out,
+        Booking.check_out > check_in,
+        Booking.status != 'cancelled',
+    )
+
+
+def _load_room_stays(room_id):
+    # Stays that ended before today can't conflict with a new booking, so
+    # the per-process index never holds the room's whole history.
+    return db.session.query(Booking.id, Booking.check_in, Booking.check_out).filter(
+        Booking.room_id == room_id,
+        Booking.status != 'cancelled',
+        Booking.check_out > date.today(),
+    ).all()
+
+
+availability_index = AvailabilityIndex(_load_room_stays)
+
+
+def room_is_available(room_id, check_in, check_out):
+    """Fast availability check against this process's in-memory index.
+
+    Other worker processes may have committed bookings this index has not
+    seen yet, so writes must confirm with overlapping_bookings() inside
+    their transaction.
+    """
+    return availability_index.is_available(room_id, check_in, check_out)
+
+
+def begin_immediate():
+    """Start the session's transaction with SQLite's write lock already held.
+
+    A plain BEGIN only takes the lock at the first write, so two payers can
+    both pass the availability check before either inserts.  Must be called
+    before anything in the transaction has written.
+    """
+    conn = db.session.connection()
+    if not conn.connection.dbapi_connection.in_transaction:
+        t0 = time.perf_counter()
+        conn.exec_driver_sql('BEGIN IMMEDIATE')
+        if metrics is not None:
+            metrics.observe_lock_wait(time.perf_counter() - t0)
+
+
+def insert_bookings(rows):
+    """Insert many Booking rows with one multi-VALUES statement.
+
+    Core inserts skip the ORM flush, so the stays are queued for the
+    availability index and counted into the analytics rollups here instead
+    of in the flush hooks.
+    """
+    result = db.session.execute(
+        db.insert(Booking).values(rows).returning(
+            Booking.id, Booking.room_id, Booking.room_type, Booking.check_in, Booking.check_out,
+            Booking.total_price, Booking.status, Booking.created_at,
+        )
+    )
+    touched = db.session.info.setdefault('touched_bookings', {})
+    delta = RollupDelta()
+    ids = []
+    for row in result:
+        stay = dict(row._mapping, check_in=parse_date(row.check_in), check_out=parse_date(row.check_out))
+        live = row.status != 'cancelled'
+        touched[row.id] = (row.room_id, stay['check_in'], stay['check_out'], live)
+        if live:
+            delta.add(stay)
+        ids.append(row.id)
+    apply_rollup_delta(delta)
+    return ids
+
+
+@event.listens_for(db.session, 'before_flush')
+def _bump_listing_versions(sess, flush_context, instances):
+    names = set()
+    for obj in list(sess.new) + list(sess.dirty) + list(sess.deleted):
+        if isinstance(obj, Room):
+            names.add('rooms')
+            if obj.id is not None:
+                names.add(f'room:{obj.id}')
+        elif isinstance(obj, (Review, RoomImageVariant)):
+            names.update(('rooms', f'room:{obj.room_id}'))
+    if names:
+        bump_cache_versions(sorted(names), sess)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _track_booking_writes(sess, flush_context):
+    # Snapshot now: after commit the instances are expired and can't be read
+    # without starting a new transaction.
+    touched = sess.info.setdefault('touched_bookings', {})
+    for obj in list(sess.new) + list(sess.dirty):
+        if isinstance(obj, Booking):
+            touched[obj.id] = (obj.room_id, parse_date(obj.check_in), parse_date(obj.check_out), obj.status != 'cancelled')
+    for obj in sess.deleted:
+        if isinstance(obj, Booking):
+            touched[obj.id] = None
+
+
+@event.listens_for(db.session, 'after_commit')
+def _apply_booking_writes(sess):
+    touched = sess.info.pop('touched_bookings', None)
+    if not touched:
+        return
+    for booking_id, stay in touched.items():
+        if stay is None or not stay[3]:
+            availability_index.discard(booking_id)
+        else:
+            availability_index.add(booking_id, stay[0], stay[1], stay[2])
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_booking_writes(sess):
+    sess.info.pop('touched_bookings', None)
+
+
+# --- Analytics --------------------------------------------------------------
+
+class RoomNightStat(db.Model):
+    """Rooms sold and revenue earned per room per night; see analytics.py"""
+    room_id = db.Column(db.Integer, primary_key=True)
+    night = db.Column(db.Date, primary_key=True)
+    room_type = db.Column(db.String(100), nullable=False, default='')
+    stays = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+
+    __table_args__ = (
+        db.Index('ix_room_night_stat_night', 'night', 'room_type'),
+    )
+
+
+class DailyBookingStat(db.Model):
+    """Bookings made per day and room type, with the sums behind the averages"""
+    day = db.Column(db.Date, primary_key=True)
+    room_type = db.Column(db.String(100), primary_key=True)
+    bookings = db.Column(db.Integer, nullable=False, default=0)
+    nights = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+    lead_days = db.Column(db.Integer, nullable=False, default=0)
+
+
+def apply_rollup_delta(delta, conn=None):
+    """Add a RollupDelta to the rollup tables in the current transaction"""
+    if not delta:
+        return
+    conn = conn or db.session
+    nights = RoomNightStat.__table__
+    stmt = sqlite_insert(nights)
+    conn.execute(stmt.on_conflict_do_update(
+        index_elements=[nights.c.room_id, nights.c.night],
+        set_={'stays': nights.c.stays + stmt.excluded.stays, 'revenue': nights.c.revenue + stmt.excluded.revenue},
+    ), delta.night_rows())
+    days = DailyBookingStat.__table__
+    stmt = sqlite_insert(days)
+    conn.execute(stmt.on_conflict_do_update(
+        index_elements=[days.c.day, days.c.room_type],
+        set_={name: days.c[name] + stmt.excluded[name] for name in ('bookings', 'nights', 'revenue', 'lead_days')},
+    ), delta.day_rows())
+
+
+_ROLLUP_FIELDS = ('room_id', 'room_type', 'check_in', 'check_out', 'total_price', 'status', 'created_at')
+
+
+def _booking_rollup_state(obj, old=False):
+    """A booking's values as counted in the rollups (before the flush if ``old``), or None if not counted"""
+    attrs = inspect(obj).attrs
+    values = {}
+    for name in _ROLLUP_FIELDS:
+        deleted = attrs[name].history.deleted if old else ()
+        values[name] = deleted[0] if deleted else getattr(obj, name)
+    if values['status'] == 'cancelled':
+        return None
+    values['check_in'] = parse_date(values['check_in'])
+    values['check_out'] = parse_date(values['check_out'])
+    values['created_at'] = values['created_at'] or datetime.now()
+    return values
+
+
+@event.listens_for(db.session, 'after_flush')
+def _roll_up_booking_writes(sess, flush_context):
+    # Attribute history still holds the pre-flush values here.
+    delta = RollupDelta()
+    for obj in sess.new:
+        if isinstance(obj, Booking):
+            new = _booking_rollup_state(obj)
+            if new:
+                delta.add(new)
+    for obj in sess.dirty:
+        if isinstance(obj, Booking) and any(inspect(obj).attrs[n].history.has_changes() for n in _ROLLUP_FIELDS):
+            old, new = _booking_rollup_state(obj, old=True), _booking_rollup_state(obj)
+            if old:
+                delta.add(old, -1)
+            if new:
+                delta.add(new)
+    for obj in sess.deleted:
+        if isinstance(obj, Booking):
+            old = _booking_rollup_state(obj, old=True)
+            if old:
+                delta.add(old, -1)
+    apply_rollup_delta(delta, sess.connection())
+
+
+def rebuild_analytics():
+    """Recompute both rollups from the Booking table"""
+    db.session.execute(RoomNightStat.__table__.delete())
+    db.session.execute(DailyBookingStat.__table__.delete())
+    # Archived stays are still history, so they count too.
+    c = booking_source(include_archived=True).c
+    stmt = db.select(
+        c.room_id, c.room_type, c.check_in, c.check_out, c.total_price, c.created_at,
+    ).where(c.status != 'cancelled').execution_options(yield_per=5000)
+    delta = RollupDelta()
+    count = 0
+    for row in db.session.execute(stmt):
+        delta.add(dict(row._mapping, check_in=parse_date(row.check_in), check_out=parse_date(row.check_out)))
+        count += 1
+    apply_rollup_delta(delta)
+    db.session.commit()
+    return count
+
+
+@app.cli.command('rebuild-analytics')
+def rebuild_analytics_command():
+    """Recompute the analytics rollups from every booking."""
+    print(f'Rolled up {rebuild_analytics()} bookings.')
+
+
+# --- Booking archive --------------------------------------------------------
+
+def booking_source(include_archived=False):
+    """Table of live bookings, or a subquery over live and archived ones with the same columns"""
+    live = Booking.__table__
+    if not include_archived:
+        return live
+    archive = BookingArchive.__table__
+    return db.union_all(
+        db.select(*live.c),
+        db.select(*[archive.c[column.name] for column in live.c]),
+    ).subquery('all_bookings')
+
+
+def archive_bookings(older_than_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE, pause=0.05):
+    """Move finished stays that ended before the horizon into booking_archive.
+
+    Each batch is copied and deleted in its own short write transaction,
+    with a pause in between, so payments never wait behind more than one
+    batch.  The analytics rollups keep counting the moved stays.  Returns
+    the number of bookings moved.
+    """
+    cutoff = date.today() - timedelta(days=older_than_days)
+    live, archive = Booking.__table__, BookingArchive.__table__
+    names = [column.name for column in live.c]
+    moved = 0
+    while True:
+        begin_immediate()
+        ids = db.session.scalars(
+            db.select(live.c.id).where(live.c.check_out < cutoff, live.c.status.in_(('completed', 'cancelled')))
+            .order_by(live.c.id).limit(batch_size)
+        ).all()
+        if not ids:
+            db.session.rollback()
+            return moved
+        db.session.execute(archive.insert().from_select(
+            names + ['archived_at'],
+            db.select(*live.c, db.literal(datetime.now(), db.DateTime)).where(live.c.id.in_(ids)),
+        ))
+        db.session.execute(live.delete().where(live.c.id.in_(ids)))
+        # Core deletes skip the flush hooks; drop the stays from the availability index.
+        db.session.info.setdefault('touched_bookings', {}).update(dict.fromkeys(ids))
+        db.session.commit()
+        moved += len(ids)
+        time.sleep(pause)
+
+
+@job_queue.handler('archive_bookings')
+def archive_bookings_job(older_than_days=ARCHIVE_AFTER_DAYS):
+    archive_bookings(older_than_days)
+
+
+@app.cli.command('archive-bookings')
+@click.option('--days', default=ARCHIVE_AFTER_DAYS, show_default=True, help='Archive stays that ended this long ago.')
+def archive_bookings_command(days):
+    """Move old finished bookings into the archive table."""
+    print(f'Archived {archive_bookings(days)} bookings.')
+
+
+def analytics_report(start, end):
+    """Occupancy, revenue, stay length and lead time for [start, end), from the rollups only"""
+    days = (end - start).days
+    room_counts = dict(db.session.query(Room.room_type, db.func.count(Room.id)).group_by(Room.room_type))
+    total_rooms = sum(room_counts.values())
+
+    by_night = {night: {'night': night, 'stays': 0, 'revenue': 0.0} for night in iter_nights(start, end)}
+    by_type = {}
+
+    def type_entry(room_type):
+        return by_type.setdefault(room_type, {
+            'room_type': room_type, 'rooms': room_counts.get(room_type, 0), 'room_nights': 0, 'stay_revenue': 0.0,
+            'bookings': 0, 'nights_booked': 0, 'booked_revenue': 0.0, 'lead_days': 0,
+        })
+
+    rows = db.session.query(
+        RoomNightStat.night, RoomNightStat.room_type,
+        db.func.sum(RoomNightStat.stays), db.func.sum(RoomNightStat.revenue),
+    ).filter(RoomNightStat.night >= start, RoomNightStat.night < end).group_by(
+        RoomNightStat.night, RoomNightStat.room_type)
+    for night, room_type, stays, revenue in rows:
+        by_night[night]['stays'] += stays
+        by_night[night]['revenue'] += revenue
+        entry = type_entry(room_type)
+        entry['room_nights'] += stays
+        entry['stay_revenue'] += revenue
+
+    rows = db.session.query(
+        DailyBookingStat.room_type, db.func.sum(DailyBookingStat.bookings), db.func.sum(DailyBookingStat.nights),
+        db.func.sum(DailyBookingStat.revenue), db.func.sum(DailyBookingStat.lead_days),
+    ).filter(DailyBookingStat.day >= start, DailyBookingStat.day < end).group_by(DailyBookingStat.room_type)
+    for room_type, bookings, nights, revenue, lead_days in rows:
+        entry = type_entry(room_type)
+        entry['bookings'] += bookings
+        entry['nights_booked'] += nights
+        entry['booked_revenue'] += revenue
+        entry['lead_days'] += lead_days
+
+    for entry in by_night.values():
+        entry['occupancy'] = entry['stays'] / total_rooms if total_rooms else 0.0
+        entry['revenue'] = round(entry['revenue'], 2)
+    for entry in by_type.values():
+        capacity = entry['rooms'] * days
+        entry['occupancy'] = entry['room_nights'] / capacity if capacity else 0.0
+        entry['avg_stay'] = entry['nights_booked'] / entry['bookings'] if entry['bookings'] else 0.0
+        entry['avg_lead_days'] = entry.pop('lead_days') / entry['bookings'] if entry['bookings'] else 0.0
+        entry['stay_revenue'] = round(entry['stay_revenue'], 2)
+        entry['booked_revenue'] = round(entry['booked_revenue'], 2)
+
+    types = sorted(by_type.values(), key=lambda e: e['room_type'])
+    room_nights = sum(e['room_nights'] for e in types)
+    bookings = sum(e['bookings'] for e in types)
+    return {
+        'from': start,
+        'to': end,
+        'totals': {
+            'rooms': total_rooms,
+            'occupancy': room_nights / (total_rooms * days) if total_rooms and days else 0.0,
+            'stay_revenue': round(sum(e['stay_revenue'] for e in types), 2),
+            'bookings': bookings,
+            'booked_revenue': round(sum(e['booked_revenue'] for e in types), 2),
+            'avg_stay': sum(e['nights_booked'] for e in types) / bookings if bookings else 0.0,
+            'avg_lead_days': sum(e['avg_lead_days'] * e['bookings'] for e in types) / bookings if bookings else 0.0,
+        },
+        'room_types': types,
+        'nights': list(by_night.values()),
+    }
+
+
+def ensure_indexes():
+    """create_all() skips tables that already exist, so add any missing indexes"""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+
+def ensure_booking_autoincrement():
+    """Rebuild a booking table created without AUTOINCREMENT, and start its id sequence past every archived id"""
+    if not db_profile.is_sqlite:
+        return
+    table = Booking.__table__
+    with db.engine.begin() as conn:
+        ddl = conn.exec_driver_sql("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'booking'").scalar()
+        if ddl and 'AUTOINCREMENT' not in ddl.upper():
+            # The indexes follow the renamed table; drop them so create() can remake them.
+            conn.exec_driver_sql('ALTER TABLE booking RENAME TO booking_old')
+            for index in table.indexes:
+                conn.exec_driver_sql(f'DROP INDEX IF EXISTS {index.name}')
+            table.create(conn)
+            columns = ', '.join(column.name for column in table.c)
+            conn.exec_driver_sql(f'INSERT INTO booking ({columns}) SELECT {columns} FROM booking_old')
+            conn.exec_driver_sql('DROP TABLE booking_old')
+        top = conn.exec_driver_sql(
+            'SELECT max(coalesce((SELECT max(id) FROM booking), 0), coalesce((SELECT max(id) FROM booking_archive), 0))'
+        ).scalar()
+        seq = conn.exec_driver_sql("SELECT seq FROM sqlite_sequence WHERE name = 'booking'").scalar()
+        if seq is None:
+            conn.exec_driver_sql("INSERT INTO sqlite_sequence (name, seq) VALUES ('booking', ?)", (top,))
+        elif seq < top:
+            conn.exec_driver_sql("UPDATE sqlite_sequence SET seq = ? WHERE name = 'booking'", (top,))
+
+
+def init_db():
+    """Create missing tables, indexes and search triggers, and fill derived tables that are still empty"""
+    db.create_all()
+    ensure_booking_autoincrement()
+    ensure_indexes()
+    ensure_review_search()
+    # Older databases allowed a NULL created_at, which review cursors can't encode.
+    if Review.query.filter(Review.created_at.is_(None)).update(
+            {Review.created_at: datetime.now()}, synchronize_session=False):
+        db.session.commit()
+    if not RoomRatingStats.query.first():
+        rebuild_review_stats()
+    if not DailyBookingStat.query.first() and Booking.query.first():
+        rebuild_analytics()
+    if not RoomRate.query.first():
+        refresh_rate_calendar()
+        db.session.commit()
+
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create or upgrade the schema; run once per deploy, not per worker."""
+    init_db()
+    print('Database ready:', db_profile.url)
 
 
 def seed_rooms():
@@ -146,52 +1634,146 @@ def seed_rooms():
                  amenities='WiFi, AC, 2 TVs, Kitchen'),
         ]
         db.session.add_all(samples)
+        db.session.flush()
+        sync_room_amenities([room.id for room in samples])
+        refresh_rate_calendar([room.id for room in samples])
+        queue_room_images([room.id for room in samples])
+        # A demo review so the first room doesn't look empty
+        db.session.add(Review(room_id=samples[0].id, name='สมชาย', rating=5,
+                              comment='บริการดี ห้องสะอาด และใกล้สถานที่ท่องเที่ยว'))
+        record_review_rating(samples[0].id, 5)
         db.session.commit()
         print(f'Inserted {len(samples)} sample rooms.')
 
 
+@app.cli.command('seed-rooms')
+def seed_rooms_command():
+    """Insert the sample rooms into a database that has none."""
+    seed_rooms()
+
+
+fragment_cache = FragmentCache(FRAGMENT_CACHE_SIZE)
+_LISTING_TEMPLATES = ('base.html', 'index.html', '_room_grid.html', '_room_card.html')
+_listing_template_hash = None
+
+
+def listing_template_hash():
+    """Fingerprint of the listing templates so a deploy changes every ETag"""
+    global _listing_template_hash
+    if _listing_template_hash is None:
+        digest = hashlib.sha1()
+        for name in _LISTING_TEMPLATES:
+            with open(os.path.join(app.root_path, app.template_folder, name), 'rb') as fh:
+                digest.update(fh.read())
+        _listing_template_hash = digest.hexdigest()[:12]
+    return _listing_template_hash
+
+
+def render_room_grid(versions):
+    """The room grid HTML, rebuilt from cached per-room cards on a miss"""
+    def render():
+        rooms = Room.query.options(db.selectinload(Room.image_variants)).order_by(Room.id).all()
+        rating_stats = {stats.room_id: stats for stats in RoomRatingStats.query.all()}
+        cards = [
+            fragment_cache.get_or_render(
+                ('room_card', room.id, versions.get(f'room:{room.id}', 0)),
+                lambda room=room: render_template('_room_card.html', room=room, stats=rating_stats.get(room.id)),
+            )
+            for room in rooms
+        ]
+        return render_template('_room_grid.html', cards=cards)
+    return fragment_cache.get_or_render(('room_grid', versions.get('rooms', 0)), render)
+
+
 @app.route('/')
 def index():
-    rooms = Room.query.all()
-    return render_template('index.html', rooms=rooms)
+    versions = cache_versions()
+    # The page also shows the cart badge and links fingerprinted assets,
+    # so the ETag covers both.
+    cart = get_cart()
+    etag = (f"{listing_template_hash()}-{asset_manifest.digest()}-{versions.get('rooms', 0)}"
+            f"-{cart.id or ''}-{len(cart.get('bookings', []))}")
+    if request.if_none_match.contains(etag) and not session.get('_flashes'):
+        response = Response(status=304)
+    else:
+        response = app.make_response(render_template('index.html', room_grid=render_room_grid(versions)))
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    response.cache_control.private = True
+    return response
+
+
+@app.route('/admin/metrics')
+def admin_metrics():
+    if metrics is None:
+        abort(404)
+    bearer = request.headers.get('Authorization', '')
+    if not session.get('admin') and not (
+            METRICS_TOKEN and hmac.compare_digest(bearer.encode(), f'Bearer {METRICS_TOKEN}'.encode())):
+        abort(403)
+    startup = ['# HELP process_startup_seconds Time spent starting this worker, by phase.',
+               '# TYPE process_startup_seconds gauge']
+    startup += [f'process_startup_seconds{{phase="{phase}"}} {seconds:.6f}' for phase, seconds in startup_timings.items()]
+    return Response(metrics.render_prometheus() + '\n'.join(startup) + '\n', mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/admin/cache-stats')
+def admin_cache_stats():
+    if not session.get('admin'):
+        return redirect(url_for('login'))
+    return jsonify(fragment_cache.stats())
+
+
+@app.route('/admin/jobs')
+def admin_jobs():
+    """Queue depth per state and the most recent dead jobs with their errors"""
+    if not session.get('admin'):
+        return redirect(url_for('login'))
+    dead = Job.query.filter_by(status='dead').order_by(Job.finished_at.desc()).limit(20).all()
+    return jsonify({
+        'counts': job_queue.stats(),
+        'dead': [{'id': j.id, 'name': j.name, 'payload': json.loads(j.payload), 'attempts': j.attempts,
+                  'finished_at': j.finished_at.isoformat() if j.finished_at else None,
+                  'last_error': j.last_error} for j in dead],
+    })
+
+
+@app.route('/admin/jobs/retry', methods=['POST'])
+def admin_jobs_retry():
+    """Requeue one dead job (?id=) or all of them"""
+    if not session.get('admin'):
+        return redirect(url_for('login'))
+    return jsonify({'requeued': job_queue.retry(request.args.get('id', type=int))})
 
 
 @app.route('/booking/<int:room_id>', methods=['GET', 'POST'])
 def booking(room_id):
     room = Room.query.get_or_404(room_id)
     if request.method == 'POST':
-        check_in = request.form.get('check_in')
-        check_out = request.form.get('check_out')
+        check_in = parse_date(request.form.get('check_in'))
+        check_out = parse_date(request.form.get('check_out'))
         guests = request.form.get('guests')
-        # Normalize incoming date formats to ISO (YYYY-MM-DD).
-        from datetime import datetime
-        def to_iso(date_str):
-            if not date_str:
-                return date_str
-            for fmt in ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y'):
-                try:
-                    d = datetime.strptime(date_str, fmt)
-                    return d.strftime('%Y-%m-%d')
-                except Exception:
-                    continue
-            return date_str
-
-        check_in = to_iso(check_in)
-        check_out = to_iso(check_out)
-        
-        if 'bookings' not in session:
-            session['bookings'] = []
-        
-        session['bookings'].append({
-            'room_id': room_id,
-            'room_name': room.name,
-            'room_type': room.room_type,
-            'check_in': check_in,
-            'check_out': check_out,
-            'guests': guests,
-            'price_per_night': room.price_per_night
-        })
-        session.modified = True
+        cart = get_cart()
+
+        if not check_in or not check_out or check_out <= check_in:
+            flash('กรุณาเลือกวันเข้าพักและวันออกพักให้ถูกต้อง', 'warning')
+            return redirect(url_for('booking', room_id=room_id))
+
+        # The same room may already be in this cart for overlapping nights.
+        in_cart = any(
+            item['room_id'] == room_id
+            and parse_date(item['check_in']) < check_out
+            and parse_date(item['check_out']) > check_in
+            for item in cart.get('bookings', [])
+        )
+        if in_cart or not room_is_available(room_id, check_in, check_out):
+            flash(f'{room.name} ไม่ว่างในช่วงวันที่เลือก', 'warning')
+            return redirect(url_for('booking', room_id=room_id))
+
+        line = pricer.make_line(room, check_in, check_out, guests, rates_version())
+        line['line_id'] = uuid.uuid4().hex[:12]  # what the cancel form names
+        cart.setdefault('bookings', []).append(line)
+        cart.modified = True
         flash(f'Booking for {room.name} added', 'success')
         return redirect(url_for('view_booking'))
     
@@ -223,7 +1805,7 @@ def add_review(room_id):
     if 'review_image' in request.files:
         file = request.files['review_image']
         if file and file.filename != '':
-            image_filename = save_review_image(file)
+            image_filename, image_is_new = save_review_image(file)
             if not image_filename:
                 flash('ไม่สามารถบันทึกรูปภาพ - โปรดใช้รูปภาพ PNG, JPG, JPEG, GIF หรือ WEBP ที่มีขนาดไม่เกิน 5 MB', 'warning')
 
@@ -236,105 +1818,57 @@ def add_review(room_id):
         image=image_filename
     )
     db.session.add(review)
+    record_review_rating(room_id, rating)
+    if image_filename:
+        db.session.flush()
+        enqueue_job('review_image_variants', review_id=review.id, is_new=image_is_new)
     db.session.commit()
-    
-    # Also keep session reviews for backward compatibility
-    reviews = session.get('reviews', {})
-    key = str(room_id)
-    lst = reviews.get(key, [])
-    review_item = {
-        'name': name, 
-        'rating': rating, 
-        'comment': comment,
-        'image': image_filename,
-        'date': datetime.now().strftime('%d/%m/%Y %H:%M')
-    }
-    lst.append(review_item)
-    reviews[key] = lst
-    session['reviews'] = reviews
-    session.modified = True
-    
+
     flash('ขอบคุณสำหรับรีวิว!', 'success')
     return redirect(request.referrer or url_for('index'))
 
 
 @app.route('/my-bookings')
 def view_booking():
-    # Get current session bookings (pending/temporary)
-    session_bookings = session.get('bookings', [])
-    total_price = 0
-    
-    for booking in session_bookings:
-        try:
-            check_in = datetime.strptime(booking.get('check_in', ''), '%Y-%m-%d')
-            check_out = datetime.strptime(booking.get('check_out', ''), '%Y-%m-%d')
-            nights = (check_out - check_in).days
-            if nights < 1:
-                nights = 1
-        except Exception:
-            nights = booking.get('nights', 1)
-
-        booking['nights'] = nights
-        booking['total'] = booking.get('price_per_night', 0) * nights
-        total_price += booking['total']
+    # Get current cart bookings (pending/temporary)
+    quote = quote_cart(get_cart())
     
     # Get historical bookings from database (only if user has logged in with an email)
     historical_bookings = []
     customer_email = session.get('customer_email')
     if customer_email:
-        historical_bookings = Booking.query.filter_by(customer_email=customer_email).order_by(Booking.created_at.desc()).all()
+        source = booking_source(include_archived=True)
+        historical_bookings = db.session.execute(
+            db.select(source).where(source.c.customer_email == customer_email).order_by(source.c.created_at.desc())
+        ).all()
 
-    return render_template('bookings.html', bookings=session_bookings, total_price=total_price, historical_bookings=historical_bookings)
+    return render_template('bookings.html', bookings=quote.lines, total_price=quote.total, historical_bookings=historical_bookings)
 
 
 @app.route('/checkout')
 def checkout():
-    bookings = session.get('bookings', [])
-    if not bookings:
+    quote = quote_cart(get_cart())
+    if not quote.lines:
         flash('ไม่มีการจองที่ต้องชำระเงิน', 'warning')
         return redirect(url_for('index'))
-    
-    # Calculate total nights and price
-    total_price = 0
-    for booking in bookings:
-        from datetime import datetime
-        check_in = datetime.strptime(booking['check_in'], '%Y-%m-%d')
-        check_out = datetime.strptime(booking['check_out'], '%Y-%m-%d')
-        nights = (check_out - check_in).days
-        if nights < 1:
-            nights = 1
-        booking['nights'] = nights
-        booking['total'] = booking['price_per_night'] * nights
-        total_price += booking['total']
-    
-    return render_template('checkout.html', bookings=bookings, total_price=total_price)
+
+    return render_template('checkout.html', bookings=quote.lines, total_price=quote.total)
 
 
 @app.route('/payment', methods=['GET'])
 def payment_page():
-    bookings = session.get('bookings', [])
-    if not bookings:
+    cart = get_cart()
+    quote = quote_cart(cart)
+    if not quote.lines:
         flash('ไม่มีการจองที่ต้องชำระเงิน', 'warning')
         return redirect(url_for('index'))
 
-    # Ensure nights and totals are calculated
-    from datetime import datetime
-    total_price = 0
-    for booking in bookings:
-        try:
-            check_in = datetime.strptime(booking['check_in'], '%Y-%m-%d')
-            check_out = datetime.strptime(booking['check_out'], '%Y-%m-%d')
-            nights = (check_out - check_in).days
-            if nights < 1:
-                nights = 1
-        except Exception:
-            nights = booking.get('nights', 1)
-
-        booking['nights'] = nights
-        booking['total'] = booking.get('price_per_night', 0) * nights
-        total_price += booking['total']
-
-    return render_template('payment.html', bookings=bookings, total_price=total_price)
+    # Reused until the payment goes through, so a second tab or a
+    # double-clicked submit carries the same token.
+    if 'payment_token' not in cart:
+        cart['payment_token'] = uuid.uuid4().hex
+    return render_template('payment.html', bookings=quote.lines, total_price=quote.total,
+                           payment_token=cart['payment_token'])
 
 
 @app.route('/payment', methods=['POST'])
@@ -348,40 +1882,67 @@ def payment():
         return redirect(url_for('checkout'))
     
     # Mock payment processing (in real app, integrate with payment gateway)
-    bookings = session.get('bookings', [])
-    total_price = sum(booking.get('total', 0) for booking in bookings if 'total' in booking)
-    
-    # Save bookings to database
+    cart = get_cart()
+    token = request.form.get('payment_token')
+    if not token or token != cart.get('payment_token'):
+        # A resubmit of a form that already went through, or a stale page.
+        if token and Payment.query.filter_by(token=token).first() is not None:
+            flash('การชำระเงินนี้ดำเนินการเรียบร้อยแล้ว', 'info')
+            return redirect(url_for('payment_success'))
+        flash('หน้าชำระเงินหมดอายุ กรุณาตรวจสอบการจองอีกครั้ง', 'warning')
+        return redirect(url_for('payment_page'))
+
+    quote = quote_cart(cart)
+    bookings = quote.lines
+    if not bookings:
+        flash('ไม่มีการจองที่ต้องชำระเงิน', 'warning')
+        return redirect(url_for('index'))
+    total_price = quote.total
+
+    # Check and write everything under one write lock so concurrent payers
+    # for the same nights serialize instead of both succeeding.
+    begin_immediate()
+    if db.session.query(Payment.id).filter_by(token=token).first() is not None:
+        # Leave the cart alone: the request that won has already saved it.
+        db.session.rollback()
+        flash('การชำระเงินนี้ดำเนินการเรียบร้อยแล้ว', 'info')
+        return redirect(url_for('payment_success'))
+
     for booking in bookings:
-        try:
-            check_in = datetime.strptime(booking['check_in'], '%Y-%m-%d')
-            check_out = datetime.strptime(booking['check_out'], '%Y-%m-%d')
-            nights = (check_out - check_in).days
-            if nights < 1:
-                nights = 1
-        except Exception:
-            nights = booking.get('nights', 1)
-        
-        db_booking = Booking(
-            customer_name=full_name,
-            customer_email=email,
-            room_id=booking['room_id'],
-            room_name=booking['room_name'],
-            room_type=booking.get('room_type', ''),
-            check_in=booking['check_in'],
-            check_out=booking['check_out'],
-            guests=int(booking.get('guests', 1)),
-            price_per_night=booking['price_per_night'],
-            nights=nights,
-            total_price=booking.get('total', 0),
-            status='completed'
-        )
-        db.session.add(db_booking)
-    
+        check_in = parse_date(booking['check_in'])
+        check_out = parse_date(booking['check_out'])
+        if overlapping_bookings(booking['room_id'], check_in, check_out).first() is not None:
+            db.session.rollback()
+            flash(f"{booking['room_name']} ไม่ว่างแล้วในช่วงวันที่เลือก กรุณาแก้ไขการจอง", 'danger')
+            return redirect(url_for('view_booking'))
+
+    payment = Payment(token=token, customer_name=full_name, customer_email=email,
+                      total_price=total_price, booking_count=len(bookings))
+    db.session.add(payment)
+    booking_ids = insert_bookings([{
+        'customer_name': full_name,
+        'customer_email': email,
+        'room_id': booking['room_id'],
+        'room_name': booking['room_name'],
+        'room_type': booking.get('room_type', ''),
+        'check_in': parse_date(booking['check_in']),
+        'check_out': parse_date(booking['check_out']),
+        'guests': int(booking.get('guests') or 1),
+        'price_per_night': booking.get('nightly_rate', booking['price_per_night']),
+        'nights': booking['nights'],
+        'total_price': booking['total'],
+        'status': 'completed',
+    } for booking in bookings])
+    db.session.flush()
+    # Side effects run after the response, from the job queue; they are
+    # queued in this transaction so they exist only if the payment does.
+    enqueue_job('booking_confirmation', payment_id=payment.id, booking_ids=booking_ids)
+    enqueue_job('refresh_occupancy_rates', stays=[[b['room_id'], b['check_in'], b['check_out']] for b in bookings])
     db.session.commit()
-    
-    # Store payment info and customer email in session for future reference
-    session['payment_info'] = {
+    cart.pop('payment_token', None)
+
+    # Store payment info in the cart and customer email in session for future reference
+    cart['payment_info'] = {
         'full_name': full_name,
         'email': email,
         'total_price': total_price,
@@ -390,80 +1951,99 @@ def payment():
     }
     session['customer_email'] = email
     session['customer_name'] = full_name
-    session.modified = True
     flash('ชำระเงินสำเร็จ', 'success')
     return redirect(url_for('payment_success'))
 
 
+@job_queue.handler('booking_confirmation')
+def booking_confirmation_job(payment_id, booking_ids):
+    """Mail the customer a receipt for one payment"""
+    payment = db.session.get(Payment, payment_id)
+    if payment is None:
+        return
+    bookings = Booking.query.filter(Booking.id.in_(booking_ids)).order_by(Booking.check_in).all()
+    lines = [
+        f"- {b.room_name}: {format_date(b.check_in)} - {format_date(b.check_out)} "
+        f"({b.nights} คืน, {b.guests} ท่าน) ฿{b.total_price:,.2f}"
+        for b in bookings
+    ]
+    body = '\n'.join([
+        f'เรียนคุณ {payment.customer_name}',
+        '',
+        'ขอบคุณที่จองห้องพักกับ Boonyisa Hotel การชำระเงินของท่านเสร็จสมบูรณ์แล้ว',
+        '',
+        *lines,
+        '',
+        f'ยอดชำระทั้งหมด: ฿{payment.total_price:,.2f}',
+        f'เลขที่การชำระเงิน: {payment.token[:12].upper()}',
+    ])
+    mailer.send(build_message(payment.customer_email, 'ยืนยันการจองห้องพัก - Boonyisa Hotel', body))
+
+
 @app.route('/payment-success')
 def payment_success():
-    payment_info = session.get('payment_info')
+    cart = get_cart()
+    payment_info = cart.get('payment_info')
     if not payment_info:
         return redirect(url_for('index'))
     
-    bookings = session.get('bookings', [])
+    bookings = cart.get('bookings', [])
     return render_template('payment_success.html', payment_info=payment_info, bookings=bookings)
 
 
 @app.route('/clear-bookings', methods=['POST'])
 def clear_bookings():
-    session.pop('bookings', None)
-    session.pop('payment_info', None)
-    session.modified = True
+    cart = get_cart()
+    cart.pop('bookings', None)
+    cart.pop('payment_info', None)
     flash('การจองและข้อมูลการชำระเงินถูกลบออก', 'info')
     return redirect(url_for('index'))
 @app.route('/cancel-booking/<int:booking_index>', methods=['POST'])
 def cancel_booking(booking_index):
-    if 'bookings' in session:
-        if 0 <= booking_index < len(session['bookings']):
-            session['bookings'].pop(booking_index)
-            session.modified = True
-            flash('Booking cancelled', 'info')
+    """Drop one line from the cart.
+
+    The form names the line by its id, so a double-submitted or stale form
+    can't remove whichever line has moved into that position since; the
+    index only serves carts from before lines had ids.
+    """
+    cart = get_cart()
+    bookings = cart.get('bookings', [])
+    line_id = request.form.get('line_id')
+    if line_id:
+        index = next((i for i, item in enumerate(bookings) if item.get('line_id') == line_id), None)
+    else:
+        index = booking_index if 0 <= booking_index < len(bookings) else None
+    if index is not None:
+        bookings.pop(index)
+        cart.modified = True
+        flash('Booking cancelled', 'info')
     return redirect(url_for('view_booking'))
 
 
 @app.route('/delete-review-image/<int:room_id>/<int:review_index>', methods=['POST'])
 def delete_review_image(room_id, review_index):
-    """Delete a review image"""
-    # Try to delete from database first (if it's a database review)
+    """Delete a review image by its position on the room's page; kept for old links"""
     review_objs = Review.query.filter_by(room_id=room_id).order_by(Review.created_at.desc()).all()
     if 0 <= review_index < len(review_objs):
         review = review_objs[review_index]
-        # Delete the image file if it exists
+        # Delete the image file and its resized copies unless shared
         if review.image:
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], review.image)
-            try:
-                if os.path.exists(filepath):
-                    os.remove(filepath)
-            except Exception as e:
-                print(f"Error deleting file: {e}")
-        
-        # Clear image reference from review
-        review.image = None
+            filenames = detach_review_image(review)
+            db.session.commit()
+            release_uploads(filenames)
+        flash('ลบรูปภาพสำเร็จ', 'success')
+    return redirect(request.referrer or url_for('reviews_page'))
+
+
+@app.route('/review-image/<int:review_id>/delete', methods=['POST'])
+def delete_review_image_by_id(review_id):
+    """Delete a review image by review id (stable across paginated views)"""
+    review = Review.query.get_or_404(review_id)
+    if review.image:
+        filenames = detach_review_image(review)
         db.session.commit()
+        release_uploads(filenames)
         flash('ลบรูปภาพสำเร็จ', 'success')
-    else:
-        # Fallback: try session reviews
-        reviews = session.get('reviews', {})
-        key = str(room_id)
-        
-        if key in reviews and 0 <= review_index < len(reviews[key]):
-            review = reviews[key][review_index]
-            # Delete the image file if it exists
-            if review.get('image'):
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], review['image'])
-                try:
-                    if os.path.exists(filepath):
-                        os.remove(filepath)
-                except Exception as e:
-                    print(f"Error deleting file: {e}")
-            
-            # Remove the image from the review
-            review['image'] = None
-            session['reviews'] = reviews
-            session.modified = True
-            flash('ลบรูปภาพสำเร็จ', 'success')
-    
     return redirect(request.referrer or url_for('reviews_page'))
 
 
@@ -489,73 +2069,245 @@ def logout():
 def admin_dashboard():
     if not session.get('admin'):
         return redirect(url_for('login'))
-    rooms = Room.query.all()
+    rooms = Room.query.options(db.selectinload(Room.image_variants)).all()
     return render_template('admin.html', rooms=rooms)
 
 
+BOOKING_EXPORT_COLUMNS = [
+    'id', 'customer_name', 'customer_email', 'room_id', 'room_name', 'room_type',
+    'check_in', 'check_out', 'guests', 'price_per_night', 'nights', 'total_price',
+    'status', 'created_at',
+]
+
+
+def booking_filters_from_args(args):
+    """Translate admin filter query args into (booking source, SQL criteria, echoed filter values)"""
+    filters = {
+        'date_from': args.get('date_from', ''),
+        'date_to': args.get('date_to', ''),
+        'status': args.get('status', ''),
+        'room_id': args.get('room_id', ''),
+        'archived': '1' if args.get('archived') else '',
+    }
+    source = booking_source(include_archived=bool(filters['archived']))
+    c = source.c
+    criteria = []
+    date_from = parse_date(filters['date_from'])
+    date_to = parse_date(filters['date_to'])
+    if date_from:
+        criteria.append(c.check_in >= date_from)
+    if date_to:
+        criteria.append(c.check_in <= date_to)
+    if filters['status']:
+        criteria.append(c.status == filters['status'])
+    if filters['room_id'].isdigit():
+        criteria.append(c.room_id == int(filters['room_id']))
+    return source, criteria, filters
+
+
+class RowPage:
+    """One page of plain result rows, with the attributes of Flask-SQLAlchemy's Pagination the templates use"""
+
+    def __init__(self, stmt, page, per_page):
+        self.page = max(page, 1)
+        self.per_page = per_page
+        self.total = db.session.execute(db.select(db.func.count()).select_from(stmt.order_by(None).subquery())).scalar()
+        self.items = db.session.execute(stmt.limit(per_page).offset((self.page - 1) * per_page)).all()
+        self.pages = max(math.ceil(self.total / per_page), 1)
+        self.has_prev = self.page > 1
+        self.has_next = self.page < self.pages
+        self.prev_num = self.page - 1 if self.has_prev else None
+        self.next_num = self.page + 1 if self.has_next else None
+
+
 @app.route('/admin/bookings')
 def admin_bookings():
     if not session.get('admin'):
         return redirect(url_for('login'))
-    
-    # Get all bookings from database
-    all_bookings = Booking.query.order_by(Booking.created_at.desc()).all()
-    
-    # Group by customer email for summary
-    customer_summary = {}
-    for booking in all_bookings:
-        email = booking.customer_email
-        if email not in customer_summary:
-            customer_summary[email] = {
-                'name': booking.customer_name,
-                'email': email,
-                'count': 0,
-                'total_spent': 0
-            }
-        customer_summary[email]['count'] += 1
-        customer_summary[email]['total_spent'] += booking.total_price
-    
-    return render_template('admin_bookings.html', bookings=all_bookings, customer_summary=customer_summary)
+
+    source, criteria, filters = booking_filters_from_args(request.args)
+    c = source.c
+
+    pagination = RowPage(
+        db.select(source).where(*criteria).order_by(c.created_at.desc(), c.id.desc()),
+        page=request.args.get('page', 1, type=int), per_page=ADMIN_BOOKINGS_PAGE_SIZE,
+    )
+
+    # Totals and per-customer rollups are computed by SQLite, not by loading rows
+    totals = db.session.execute(db.select(
+        db.func.count(c.id),
+        db.func.count(db.distinct(c.customer_email)),
+        db.func.coalesce(db.func.sum(c.total_price), 0),
+        db.func.coalesce(db.func.sum(c.nights), 0),
+    ).where(*criteria)).one()
+
+    # Top spenders only; the template says so when there are more customers.
+    total_spent = db.func.sum(c.total_price)
+    customer_summary = db.session.execute(db.select(
+        c.customer_email.label('email'),
+        db.func.max(c.customer_name).label('name'),
+        db.func.count(c.id).label('booking_count'),
+        total_spent.label('total_spent'),
+    ).where(*criteria).group_by(c.customer_email).order_by(
+        total_spent.desc()
+    ).limit(ADMIN_BOOKINGS_PAGE_SIZE)).all()
+
+    return render_template(
+        'admin_bookings.html',
+        bookings=pagination.items,
+        pagination=pagination,
+        totals={'bookings': totals[0], 'customers': totals[1], 'revenue': totals[2], 'nights': totals[3]},
+        customer_summary=customer_summary,
+        filters=filters,
+        rooms=Room.query.order_by(Room.id).all(),
+    )
+
+
+ANALYTICS_MAX_DAYS = 366
+
+
+def _analytics_range(args):
+    today = date.today()
+    start = parse_date(args.get('from')) or today - timedelta(days=30)
+    end = parse_date(args.get('to')) or today + timedelta(days=30)
+    if end <= start or (end - start).days > ANALYTICS_MAX_DAYS:
+        abort(400)
+    return start, end
+
+
+@app.route('/admin/analytics')
+def admin_analytics():
+    if not session.get('admin'):
+        return redirect(url_for('login'))
+    start, end = _analytics_range(request.args)
+    return render_template('admin_analytics.html', report=analytics_report(start, end))
+
+
+@app.route('/admin/analytics.json')
+def admin_analytics_json():
+    """The same report for charts and scripts: ?from=&to= (end exclusive)"""
+    if not session.get('admin'):
+        abort(403)
+    start, end = _analytics_range(request.args)
+    return api_response(lambda: analytics_report(start, end))
+
+
+def _iter_booking_rows(source, criteria):
+    """Yield export rows from a streaming cursor, 1000 rows per fetch"""
+    columns = [source.c[name] for name in BOOKING_EXPORT_COLUMNS]
+    stmt = db.select(*columns).where(*criteria).order_by(source.c.id).execution_options(yield_per=1000)
+    for row in db.session.execute(stmt):
+        yield [value.isoformat() if isinstance(value, (date, datetime)) else value for value in row]
+
+
+@app.route('/admin/bookings/archive', methods=['POST'])
+def admin_bookings_archive():
+    if not session.get('admin'):
+        return redirect(url_for('login'))
+    enqueue_job('archive_bookings')
+    db.session.commit()
+    flash(f'กำลังย้ายการจองที่สิ้นสุดเกิน {ARCHIVE_AFTER_DAYS} วันไปยังที่เก็บถาวรในเบื้องหลัง', 'info')
+    return redirect(url_for('admin_bookings'))
+
+
+@app.route('/admin/bookings/export.<fmt>')
+def admin_bookings_export(fmt):
+    if not session.get('admin'):
+        return redirect(url_for('login'))
+    if fmt not in ('csv', 'ndjson'):
+        abort(404)
+
+    source, criteria, _ = booking_filters_from_args(request.args)
+
+    def generate_csv():
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(BOOKING_EXPORT_COLUMNS)
+        for row in _iter_booking_rows(source, criteria):
+            writer.writerow(row)
+            if buf.tell() > 64 * 1024:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue()
+
+    def generate_ndjson():
+        for row in _iter_booking_rows(source, criteria):
+            yield json.dumps(dict(zip(BOOKING_EXPORT_COLUMNS, row)), ensure_ascii=False) + '\n'
+
+    if fmt == 'csv':
+        body, mimetype = generate_csv(), 'text/csv'
+    else:
+        body, mimetype = generate_ndjson(), 'application/x-ndjson'
+    filename = f'bookings-{datetime.now().strftime("%Y%m%d")}.{fmt}'
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
 
 
 @app.route('/reviews')
 def reviews_page():
-    # Get all rooms and their reviews from database
-    rooms = Room.query.all()
-    review_objs = Review.query.order_by(Review.created_at.desc()).all()
-    
-    # Group reviews by room
-    room_reviews = {}
-    for review in review_objs:
-        room_id = review.room_id
-        if room_id not in room_reviews:
-            room_reviews[room_id] = []
-        room_reviews[room_id].append({
-            'name': review.name,
-            'rating': review.rating,
-            'comment': review.comment,
-            'image': review.image,
-            'date': review.created_at.strftime('%d/%m/%Y %H:%M') if review.created_at else ''
-        })
-    
-    # Prepare grouped data
+    # Only rooms that have reviews, each with its newest page
+    rows = db.session.query(Room, RoomRatingStats).join(
+        RoomRatingStats, RoomRatingStats.room_id == Room.id
+    ).filter(RoomRatingStats.review_count > 0).order_by(Room.id).all()
+
     grouped = []
-    for room in rooms:
-        reviews_list = room_reviews.get(room.id, [])
-        # Also include session reviews for backward compatibility
-        try:
-            sess = session.get('reviews', {})
-            sess_reviews = sess.get(str(room.id), [])
-            reviews_list.extend(sess_reviews)
-        except Exception:
-            pass
-        
-        if reviews_list:  # Only show rooms that have reviews
-            grouped.append({'room': room, 'reviews': reviews_list})
-    
+    for room, stats in rows:
+        reviews, next_cursor = review_page(room.id)
+        grouped.append({
+            'room': room,
+            'review_count': stats.review_count,
+            'reviews': [review_to_dict(r) for r in reviews],
+            'next_cursor': next_cursor,
+        })
+
+    return render_template('reviews.html', grouped=grouped)
+
+
+def _room_review_page_args(room_id):
+    room = Room.query.get_or_404(room_id)
+    cursor = request.args.get('cursor')
+    after = None
+    if cursor:
+        after = decode_review_cursor(cursor)
+        if after is None:
+            abort(400)
+    limit = min(max(request.args.get('limit', REVIEWS_PAGE_SIZE, type=int), 1), 50)
+    reviews, next_cursor = review_page(room_id, after, limit)
+    return room, reviews, next_cursor
+
+
+@app.route('/reviews/<int:room_id>')
+def room_reviews(room_id):
+    """One page of a room's reviews; the 'load more' link without JavaScript"""
+    room, reviews, next_cursor = _room_review_page_args(room_id)
+    stats = db.session.get(RoomRatingStats, room_id)
+    grouped = [{
+        'room': room,
+        'review_count': stats.review_count if stats else len(reviews),
+        'reviews': [review_to_dict(r) for r in reviews],
+        'next_cursor': next_cursor,
+    }]
     return render_template('reviews.html', grouped=grouped)
 
 
+@app.route('/reviews/<int:room_id>.json')
+def room_reviews_json(room_id):
+    room, reviews, next_cursor = _room_review_page_args(room_id)
+    items = []
+    for r in reviews:
+        item = review_to_dict(r)
+        item['image_url'] = r.image_src() if r.image else None
+        item['image_sizes'] = REVIEW_IMAGE_SIZES
+        item['delete_image_url'] = url_for('delete_review_image_by_id', review_id=r.id) if r.image else None
+        items.append(item)
+    return jsonify({
+        'room_id': room.id,
+        'reviews': items,
+        'next_cursor': next_cursor,
+    })
+
+
 @app.route('/admin/add', methods=['POST'])
 def admin_add():
     if not session.get('admin'):
@@ -576,6 +2328,11 @@ def admin_add():
                 capacity=capacity_val, price_per_night=price_val, 
                 image_url=image_url or '', amenities=amenities or '')
     db.session.add(room)
+    db.session.flush()
+    sync_room_amenities([room.id])
+    queue_rate_refresh(room_ids=[room.id])
+    if room.image_url:
+        queue_room_images([room.id])
     db.session.commit()
     flash('Room added', 'success')
     return redirect(url_for('admin_dashboard'))
@@ -586,19 +2343,669 @@ def admin_delete(room_id):
     if not session.get('admin'):
         return redirect(url_for('login'))
     room = Room.query.get_or_404(room_id)
+    RoomRatingStats.query.filter_by(room_id=room_id).delete()
+    RoomRate.query.filter_by(room_id=room_id).delete()
+    db.session.execute(room_amenity.delete().where(room_amenity.c.room_id == room_id))
     db.session.delete(room)
     db.session.commit()
     flash('Room deleted', 'success')
     return redirect(url_for('admin_dashboard'))
 
 
+ROOM_EXPORT_COLUMNS = ['id', 'name', 'room_type', 'capacity', 'price_per_night', 'image_url', 'amenities']
+
+
+def parse_room_price(value, field='price_per_night'):
+    """A finite, non-negative nightly price, or ValueError"""
+    try:
+        price = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{field} {value!r} is not a number') from None
+    if not math.isfinite(price):
+        raise ValueError(f'{field} {value!r} is not a number')
+    if price < 0:
+        raise ValueError(f'{field} cannot be negative')
+    return price
+
+
+def room_values_from_row(row):
+    """Validate one imported room; returns column values or raises ValueError"""
+    if not isinstance(row, dict):
+        raise ValueError(f'expected an object, got {type(row).__name__}')
+    name = str(row.get('name') or '').strip()
+    if not name:
+        raise ValueError('name is required')
+    try:
+        capacity = int(row.get('capacity'))
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"capacity {row.get('capacity')!r} is not a whole number") from None
+    price = parse_room_price(row.get('price_per_night'))
+    if capacity < 1:
+        raise ValueError('capacity must be at least 1')
+    amenities = row.get('amenities') or ''
+    if isinstance(amenities, list):
+        amenities = ', '.join(str(a).strip() for a in amenities)
+    return {
+        'name': name,
+        'room_type': str(row.get('room_type') or 'Standard').strip(),
+        'capacity': capacity,
+        'price_per_night': price,
+        'image_url': str(row.get('image_url') or '').strip(),
+        'amenities': amenities.strip(),
+    }
+
+
+def _iter_import_rows(file):
+    """Yield (line number, dict) from an uploaded CSV, JSON array or NDJSON file"""
+    filename = (file.filename or '').lower()
+    text = io.TextIOWrapper(file.stream, encoding='utf-8-sig')
+    if filename.endswith('.csv'):
+        # Line 1 is the header
+        for lineno, row in enumerate(csv.DictReader(text), start=2):
+            yield lineno, row
+    elif filename.endswith(('.ndjson', '.jsonl')):
+        for lineno, line in enumerate(text, start=1):
+            if line.strip():
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    raise ValueError(f'แถว {lineno}: {e}') from None
+                yield lineno, row
+    elif filename.endswith('.json'):
+        # A JSON array has to be parsed whole; uploads are capped at MAX_FILE_SIZE.
+        rows = json.load(text)
+        if not isinstance(rows, list):
+            raise ValueError('ไฟล์ .json ต้องเป็นอาร์เรย์ของห้องพัก')
+        for index, row in enumerate(rows, start=1):
+            yield index, row
+    else:
+        raise ValueError('ใช้ไฟล์ .csv, .json หรือ .ndjson')
+
+
+def import_rooms(file):
+    """Validate and insert every row of an import file in one transaction.
+
+    Returns (inserted, errors); nothing is written if any row is invalid.
+    """
+    new_ids = []
+    errors = []
+    batch = []
+    try:
+        for lineno, row in _iter_import_rows(file):
+            try:
+                batch.append(room_values_from_row(row))
+            except ValueError as e:
+                errors.append(f'แถว {lineno}: {e}')
+                continue
+            if len(batch) >= ROOM_IMPORT_BATCH_SIZE and not errors:
+                new_ids.extend(db.session.scalars(db.insert(Room).returning(Room.id), batch))
+                batch = []
+    except (ValueError, UnicodeDecodeError) as e:
+        errors.append(str(e))
+    if errors:
+        db.session.rollback()
+        return 0, errors
+    if batch:
+        new_ids.extend(db.session.scalars(db.insert(Room).returning(Room.id), batch))
+    sync_room_amenities(new_ids)
+    # Until the job has run quote_stay() prices these rooms from the rules.
+    queue_rate_refresh(room_ids=new_ids)
+    for chunk in _chunks(new_ids):
+        queue_room_images(db.session.scalars(
+            db.select(Room.id).where(Room.id.in_(chunk), Room.image_url != '')))
+    # Core inserts skip the ORM flush hooks, so bump the listing version here.
+    bump_cache_versions(['rooms'])
+    db.session.commit()
+    return len(new_ids), []
+
+
+@app.route('/admin/rooms/import', methods=['POST'])
+def admin_rooms_import():
+    if not session.get('admin'):
+        return redirect(url_for('login'))
+    file = request.files.get('rooms_file')
+    if not file or file.filename == '':
+        flash('กรุณาเลือกไฟล์', 'warning')
+        return redirect(url_for('admin_dashboard'))
+    inserted, errors = import_rooms(file)
+    if errors:
+        shown = '; '.join(errors[:10])
+        more = f' (และอีก {len(errors) - 10} รายการ)' if len(errors) > 10 else ''
+        flash(f'นำเข้าไม่สำเร็จ: {shown}{more}', 'danger')
+    else:
+        flash(f'นำเข้าห้องพัก {inserted} ห้อง', 'success')
+    return redirect(url_for('admin_dashboard'))
+
+
+@app.route('/admin/rooms/export.<fmt>')
+def admin_rooms_export(fmt):
+    if not session.get('admin'):
+        return redirect(url_for('login'))
+    if fmt not in ('csv', 'ndjson'):
+        abort(404)
+
+    def iter_rows():
+        columns = [getattr(Room, name) for name in ROOM_EXPORT_COLUMNS]
+        stmt = db.select(*columns).order_by(Room.id).execution_options(yield_per=1000)
+        for row in db.session.execute(stmt):
+            yield list(row)
+
+    def generate_csv():
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(ROOM_EXPORT_COLUMNS)
+        for row in iter_rows():
+            writer.writerow(row)
+            if buf.tell() > 64 * 1024:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue()
+
+    def generate_ndjson():
+        for row in iter_rows():
+            yield json.dumps(dict(zip(ROOM_EXPORT_COLUMNS, row)), ensure_ascii=False) + '\n'
+
+    if fmt == 'csv':
+        body, mimetype = generate_csv(), 'text/csv'
+    else:
+        body, mimetype = generate_ndjson(), 'application/x-ndjson'
+    filename = f'rooms-{datetime.now().strftime("%Y%m%d")}.{fmt}'
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+
+def _split_amenities(value):
+    return [a.strip() for a in (value or '').split(',') if a.strip()]
+
+
+@app.route('/admin/rooms/batch', methods=['POST'])
+def admin_rooms_batch():
+    """Apply one change to many rooms with set-based statements"""
+    if not session.get('admin'):
+        return redirect(url_for('login'))
+    room_ids = [int(v) for v in request.form.getlist('room_ids') if v.isdigit()]
+    action = request.form.get('action')
+    value = (request.form.get('value') or '').strip()
+    if not room_ids:
+        flash('กรุณาเลือกห้องพัก', 'warning')
+        return redirect(url_for('admin_dashboard'))
+
+    selected = Room.id.in_(room_ids)
+    try:
+        if action == 'delete':
+            RoomRatingStats.query.filter(RoomRatingStats.room_id.in_(room_ids)).delete(synchronize_session=False)
+            RoomRate.query.filter(RoomRate.room_id.in_(room_ids)).delete(synchronize_session=False)
+            RoomImageVariant.query.filter(RoomImageVariant.room_id.in_(room_ids)).delete(synchronize_session=False)
+            db.session.execute(room_amenity.delete().where(room_amenity.c.room_id.in_(room_ids)))
+            count = Room.query.filter(selected).delete(synchronize_session=False)
+        elif action == 'set_price':
+            price = parse_room_price(value)
+            count = Room.query.filter(selected).update({Room.price_per_night: price}, synchronize_session=False)
+            queue_rate_refresh(room_ids=room_ids)
+        elif action == 'adjust_price_pct':
+            factor = 1 + float(value) / 100
+            if not math.isfinite(factor) or factor < 0:
+                raise ValueError('price would become negative')
+            count = Room.query.filter(selected).update(
+                {Room.price_per_night: db.func.round(Room.price_per_night * factor, 2)}, synchronize_session=False)
+            queue_rate_refresh(room_ids=room_ids)
+        elif action in ('add_amenity', 'remove_amenity'):
+            if not value:
+                raise ValueError('amenity is required')
+            # Amenities are free text, so rewrite each selected row's list.
+            updates = []
+            for room_id, amenities in db.session.query(Room.id, Room.amenities).filter(selected):
+                items = _split_amenities(amenities)
+                present = value.lower() in (a.lower() for a in items)
+                if action == 'add_amenity' and not present:
+                    items.append(value)
+                elif action == 'remove_amenity' and present:
+                    items = [a for a in items if a.lower() != value.lower()]
+                else:
+                    continue
+                updates.append({'b_id': room_id, 'amenities': ', '.join(items)})
+            if updates:
+                room_table = Room.__table__
+                db.session.execute(
+                    db.update(room_table).where(room_table.c.id == db.bindparam('b_id'))
+                    .values(amenities=db.bindparam('amenities')),
+                    updates,
+                )
+                sync_room_amenities([u['b_id'] for u in updates])
+            count = len(updates)
+        else:
+            abort(400)
+    except ValueError:
+        db.session.rollback()
+        flash('ค่าที่ระบุไม่ถูกต้อง', 'danger')
+        return redirect(url_for('admin_dashboard'))
+
+    # Bulk statements skip the ORM flush hooks, so bump the listing versions here.
+    bump_cache_versions(['rooms'] + [f'room:{room_id}' for room_id in room_ids])
+    db.session.commit()
+    flash(f'อัปเดต {count} ห้องพัก', 'success')
+    return redirect(url_for('admin_dashboard'))
+
+
+@app.route('/admin/rates', methods=['GET', 'POST'])
+def admin_rates():
+    if not session.get('admin'):
+        return redirect(url_for('login'))
+    if request.method == 'POST':
+        form = request.form
+        try:
+            multiplier = 1 + float(form.get('adjust_pct')) / 100
+            occupancy = form.get('min_occupancy_pct', '').strip()
+            occupancy = float(occupancy) / 100 if occupancy else None
+            if multiplier <= 0 or (occupancy is not None and not 0 <= occupancy <= 1):
+                raise ValueError
+        except (TypeError, ValueError):
+            flash('ค่าที่ระบุไม่ถูกต้อง', 'danger')
+            return redirect(url_for('admin_rates'))
+        rule = RateRule(
+            name=form.get('name') or 'Rate rule',
+            room_type=(form.get('room_type') or '').strip() or None,
+            start_date=parse_date(form.get('start_date')),
+            end_date=parse_date(form.get('end_date')),
+            weekdays=''.join(sorted(d for d in form.getlist('weekdays') if d in '0123456')),
+            min_occupancy=occupancy,
+            multiplier=multiplier,
+        )
+        db.session.add(rule)
+        queue_rule_refresh(rule)
+        db.session.commit()
+        flash('เพิ่มกฎราคาแล้ว ปฏิทินราคาจะอัปเดตในเบื้องหลัง', 'success')
+        return redirect(url_for('admin_rates'))
+
+    calendar = db.session.query(
+        db.func.count(RoomRate.night), db.func.min(RoomRate.night), db.func.max(RoomRate.night)
+    ).one()
+    room_types = [t for (t,) in db.session.query(Room.room_type).distinct().order_by(Room.room_type)]
+    return render_template('admin_rates.html', rules=RateRule.query.order_by(RateRule.id).all(),
+                           calendar=calendar, room_types=room_types)
+
+
+@app.route('/admin/rates/<int:rule_id>/toggle', methods=['POST'])
+def admin_rate_toggle(rule_id):
+    if not session.get('admin'):
+        return redirect(url_for('login'))
+    rule = RateRule.query.get_or_404(rule_id)
+    rule.active = not rule.active
+    queue_rule_refresh(rule)
+    db.session.commit()
+    flash(f"{'เปิด' if rule.active else 'ปิด'}ใช้งานกฎ {rule.name}", 'success')
+    return redirect(url_for('admin_rates'))
+
+
+@app.route('/admin/rates/<int:rule_id>/delete', methods=['POST'])
+def admin_rate_delete(rule_id):
+    if not session.get('admin'):
+        return redirect(url_for('login'))
+    rule = RateRule.query.get_or_404(rule_id)
+    queue_rule_refresh(rule)
+    db.session.delete(rule)
+    db.session.commit()
+    flash('ลบกฎราคาแล้ว', 'success')
+    return redirect(url_for('admin_rates'))
+
+
+# --- JSON API v1 ------------------------------------------------------------
+# Read-only endpoints for the mobile app and channel managers.  Lists use
+# opaque keyset cursors, ?fields=a,b trims each item, and every response
+# carries an ETag (plus Last-Modified where rows have timestamps) so polling
+# clients get 304 Not Modified instead of the full payload.
+
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 200
+
+
+def _api_limit():
+    return min(max(request.args.get('limit', API_PAGE_SIZE, type=int), 1), API_MAX_PAGE_SIZE)
+
+
+def _encode_id_cursor(row_id):
+    return base64.urlsafe_b64encode(str(row_id).encode()).decode()
+
+
+def _decode_id_cursor():
+    """The id after which the requested page starts, or None for the first page"""
+    cursor = request.args.get('cursor')
+    if not cursor:
+        return None
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except Exception:
+        abort(400)
+
+
+def _select_fields(item):
+    fields = request.args.get('fields')
+    if not fields:
+        return item
+    wanted = {f.strip() for f in fields.split(',')}
+    return {k: v for k, v in item.items() if k in wanted}
+
+
+def _api_etag(*parts):
+    """ETag from a data version and the full request (path, filters, fields, cursor)"""
+    raw = '|'.join(str(p) for p in parts) + '|' + request.full_path
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def api_response(build, etag=None, last_modified=None):
+    """JSON response honouring If-None-Match / If-Modified-Since.
+
+    With a precomputed ``etag`` a matching request is answered before
+    ``build()`` runs; otherwise the ETag is a hash of the body.
+    ``last_modified`` may be a callable, evaluated after ``build()``; only
+    pass a timestamp that moves forward on every change to the body, or a
+    client sending just If-Modified-Since is told stale data is current.
+    """
+    if etag is not None and request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    body = json.dumps(build(), ensure_ascii=False, default=lambda v: v.isoformat())
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag or hashlib.sha1(body.encode()).hexdigest())
+    if callable(last_modified):
+        last_modified = last_modified()
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def api_room(room, stats=None):
+    return {
+        'id': room.id,
+        'name': room.name,
+        'room_type': room.room_type,
+        'capacity': room.capacity,
+        'price_per_night': room.price_per_night,
+        'image_url': room.image_url,
+        'amenities': [a.strip() for a in (room.amenities or '').split(',') if a.strip()],
+        'review_count': stats.review_count if stats else 0,
+        'rating_average': round(stats.average, 2) if stats else None,
+    }
+
+
+def api_review(review):
+    return {
+        'id': review.id,
+        'room_id': review.room_id,
+        'name': review.name,
+        'rating': review.rating,
+        'comment': review.comment,
+        'image_url': review.image_src(_external=True) if review.image else None,
+        'created_at': review.created_at,
+    }
+
+
+def api_booking(booking):
+    return {name: getattr(booking, name) for name in BOOKING_EXPORT_COLUMNS}
+
+
+def _rooms_page(query):
+    after = _decode_id_cursor()
+    if after is not None:
+        query = query.filter(Room.id > after)
+    limit = _api_limit()
+    rooms = query.order_by(Room.id).limit(limit + 1).all()
+    next_cursor = _encode_id_cursor(rooms[limit - 1].id) if len(rooms) > limit else None
+    rooms = rooms[:limit]
+    stats = {st.room_id: st for st in RoomRatingStats.query.filter(
+        RoomRatingStats.room_id.in_([r.id for r in rooms]))} if rooms else {}
+    return {'rooms': [_select_fields(api_room(r, stats.get(r.id))) for r in rooms], 'next_cursor': next_cursor}
+
+
+@app.route('/api/v1/rooms')
+def api_rooms():
+    query = Room.query
+    if request.args.get('room_type'):
+        query = query.filter(Room.room_type == request.args['room_type'])
+    if request.args.get('guests', type=int):
+        query = query.filter(Room.capacity >= request.args.get('guests', type=int))
+    etag = _api_etag(cache_versions().get('rooms', 0))
+    return api_response(lambda: _rooms_page(query), etag=etag)
+
+
+@app.route('/api/v1/rooms/<int:room_id>')
+def api_room_detail(room_id):
+    def build():
+        room = Room.query.get_or_404(room_id)
+        return _select_fields(api_room(room, db.session.get(RoomRatingStats, room_id)))
+    return api_response(build, etag=_api_etag(cache_versions().get(f'room:{room_id}', 0)))
+
+
+ROOM_SEARCH_SORTS = {
+    'rating': lambda avg: [avg.desc(), Room.price_per_night.asc()],
+    'price': lambda avg: [Room.price_per_night.asc()],
+    'price_desc': lambda avg: [Room.price_per_night.desc()],
+    'capacity': lambda avg: [Room.capacity.asc(), Room.price_per_night.asc()],
+}
+
+
+@app.route('/api/v1/rooms/search')
+def api_room_search():
+    """Filter rooms by amenities, capacity, price band, type and free dates.
+
+    All filters go into one SQL statement: amenities are matched through
+    the room_amenity index (rooms must have every requested amenity), the
+    price/capacity/type filters use the room indexes, and dates are a
+    correlated NOT EXISTS on the booking (room_id, dates) index.  Results are ranked by rating
+    (or ?sort=price|price_desc|capacity) and paged with ?page&limit.
+    """
+    args = request.args
+    avg_rating = db.func.coalesce(RoomRatingStats.rating_sum * 1.0 / db.func.nullif(RoomRatingStats.review_count, 0), 0)
+    query = db.session.query(Room, RoomRatingStats).outerjoin(RoomRatingStats, RoomRatingStats.room_id == Room.id)
+
+    keys = sorted({amenity_key(a) for a in args.get('amenities', '').split(',') if a.strip()})
+    if keys:
+        matching = db.select(room_amenity.c.room_id).join(
+            Amenity, Amenity.id == room_amenity.c.amenity_id
+        ).where(Amenity.key.in_(keys)).group_by(room_amenity.c.room_id).having(
+            db.func.count() == len(keys)
+        )
+        query = query.filter(Room.id.in_(matching))
+    if args.get('room_type'):
+        query = query.filter(Room.room_type == args['room_type'])
+    if args.get('guests', type=int):
+        query = query.filter(Room.capacity >= args.get('guests', type=int))
+    if args.get('min_price', type=float) is not None:
+        query = query.filter(Room.price_per_night >= args.get('min_price', type=float))
+    if args.get('max_price', type=float) is not None:
+        query = query.filter(Room.price_per_night <= args.get('max_price', type=float))
+    if args.get('check_in') or args.get('check_out'):
+        check_in, check_out = _api_stay_args()
+        query = query.filter(room_free_during(check_in, check_out))
+
+    sort = ROOM_SEARCH_SORTS.get(args.get('sort', 'rating'))
+    if sort is None:
+        abort(400)
+    query = query.order_by(*sort(avg_rating), Room.id)
+    page = max(args.get('page', 1, type=int), 1)
+    limit = _api_limit()
+
+    def build():
+        rows = query.offset((page - 1) * limit).limit(limit + 1).all()
+        return {
+            'rooms': [_select_fields(api_room(room, stats)) for room, stats in rows[:limit]],
+            'page': page,
+            'next_page': page + 1 if len(rows) > limit else None,
+        }
+    return api_response(build)
+
+
+def _api_stay_args():
+    check_in = parse_date(request.args.get('check_in'))
+    check_out = parse_date(request.args.get('check_out'))
+    if not check_in or not check_out or check_out <= check_in:
+        abort(400)
+    return check_in, check_out
+
+
+@app.route('/api/v1/availability')
+def api_availability():
+    """Rooms free for the whole stay; see room_free_during()"""
+    check_in, check_out = _api_stay_args()
+    query = Room.query.filter(room_free_during(check_in, check_out))
+    if request.args.get('guests', type=int):
+        query = query.filter(Room.capacity >= request.args.get('guests', type=int))
+
+    def build():
+        page = _rooms_page(query)
+        page.update({'check_in': check_in, 'check_out': check_out})
+        return page
+    return api_response(build)
+
+
+@app.route('/api/v1/rooms/<int:room_id>/availability')
+def api_room_availability(room_id):
+    Room.query.get_or_404(room_id)
+    check_in, check_out = _api_stay_args()
+    return api_response(lambda: {
+        'room_id': room_id,
+        'check_in': check_in,
+        'check_out': check_out,
+        'available': room_is_available(room_id, check_in, check_out),
+    })
+
+
+@app.route('/api/v1/rooms/<int:room_id>/rates')
+def api_room_rates(room_id):
+    """Nightly prices for a stay, e.g. for a calendar on the booking form"""
+    Room.query.get_or_404(room_id)
+    check_in, check_out = _api_stay_args()
+    if (check_out - check_in).days > 366:
+        abort(400)
+
+    def build():
+        rates = room_rates(room_id, check_in, check_out)
+        return {
+            'room_id': room_id,
+            'check_in': check_in,
+            'check_out': check_out,
+            'nights': [{'night': night, 'rate': rate} for night, rate in rates.items()],
+            'total': round(sum(rates.values()), 2),
+        }
+    return api_response(build, etag=_api_etag('rates', rates_version()))
+
+
+@app.route('/api/v1/rooms/<int:room_id>/reviews')
+def api_room_reviews(room_id):
+    # No Last-Modified: reviews have no edit timestamp, and deleting an
+    # image or a review doesn't move created_at.  The ETag covers it.
+    def build():
+        room, reviews, next_cursor = _room_review_page_args(room_id)
+        return {
+            'room_id': room.id,
+            'reviews': [_select_fields(api_review(r)) for r in reviews],
+            'next_cursor': next_cursor,
+        }
+    return api_response(build, etag=_api_etag(cache_versions().get(f'room:{room_id}', 0)))
+
+
+@app.route('/api/v1/reviews/<int:review_id>')
+def api_review_detail(review_id):
+    review = Review.query.get_or_404(review_id)
+    return api_response(lambda: _select_fields(api_review(review)))
+
+
+@app.route('/api/v1/reviews/search')
+def api_review_search():
+    """Full-text review search: ?q=terms[&room_id=][&page=][&limit=]"""
+    q = (request.args.get('q') or '').strip()
+    if not q:
+        abort(400)
+    room_id = request.args.get('room_id', type=int)
+    page = max(request.args.get('page', 1, type=int), 1)
+    limit = min(_api_limit(), 100)
+
+    def build():
+        results = search_reviews(q, room_id=room_id, limit=limit + 1, offset=(page - 1) * limit)
+        return {
+            'q': q,
+            'reviews': [_select_fields(r) for r in results[:limit]],
+            'page': page,
+            'next_page': page + 1 if len(results) > limit else None,
+        }
+    return api_response(build)
+
+
+@app.route('/api/v1/bookings')
+def api_bookings():
+    if not session.get('admin'):
+        abort(403)
+    source, criteria, _ = booking_filters_from_args(request.args)
+    after = _decode_id_cursor()
+    if after is not None:
+        criteria.append(source.c.id < after)
+    limit = _api_limit()
+    bookings = db.session.execute(
+        db.select(source).where(*criteria).order_by(source.c.id.desc()).limit(limit + 1)
+    ).all()
+    next_cursor = _encode_id_cursor(bookings[limit - 1].id) if len(bookings) > limit else None
+    bookings = bookings[:limit]
+    # No Last-Modified: archiving removes rows, which can move a page's
+    # newest updated_at backwards.  The body ETag catches every change.
+    return api_response(lambda: {
+        'bookings': [_select_fields(api_booking(b)) for b in bookings],
+        'next_cursor': next_cursor,
+    })
+
+
+@app.route('/api/v1/bookings/<int:booking_id>')
+def api_booking_detail(booking_id):
+    if not session.get('admin'):
+        abort(403)
+    booking = Booking.query.get_or_404(booking_id)
+    return api_response(lambda: _select_fields(api_booking(booking)), last_modified=booking.updated_at)
+
+
+# --- Entry points -----------------------------------------------------------
+
+def create_app(config=None):
+    """Return the app ready to serve; wsgi.py calls this once per process.
+
+    Settings come from the environment (the variables above, plus any
+    FLASK_* variable, e.g. FLASK_SQLALCHEMY_DATABASE_URI); ``config``
+    overrides them.  The database and upload folder are set up from the
+    result, so this must run before the app is first used.  Without a
+    SECRET_KEY it refuses to start unless DEBUG or TESTING is on.
+    The schema is left alone: run ``flask --app wsgi init-db`` per deploy.
+    """
+    if _runtime_ready:
+        raise RuntimeError('create_app() must run before the app is first used')
+    t0 = time.perf_counter()
+    engine_options = app.config['SQLALCHEMY_ENGINE_OPTIONS']
+    app.config.from_prefixed_env()
+    if config:
+        app.config.update(config)
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    if uri != db_profile.url:
+        # Pragmas and pool settings follow the database actually used.
+        db_profile.url = uri
+        if app.config['SQLALCHEMY_ENGINE_OPTIONS'] is engine_options:
+            app.config['SQLALCHEMY_ENGINE_OPTIONS'] = db_profile.engine_options()
+    if not app.secret_key:
+        if not (app.debug or app.testing):
+            raise RuntimeError('SECRET_KEY is not set; sessions and carts cannot be signed safely')
+        app.logger.warning('SECRET_KEY is not set; using the insecure development key')
+        app.secret_key = DEV_SECRET_KEY
+    with app.app_context():
+        init_runtime()
+    startup_timings['create_app'] = time.perf_counter() - t0
+    return app
+
+
 if __name__ == '__main__':
-    # Ensure DB creation and seeding run inside the Flask application context
+    # Development only: prepare the database, then start the debug server.
+    # In production serve wsgi:app (see wsgi.py).
+    create_app({'DEBUG': True})
     with app.app_context():
-        db.create_all()
+        init_db()
         seed_rooms()
-        db_path = os.path.join(basedir, 'hotel.db')
-        print('Database file created (or already exists):', db_path)
-
-    # Start the Flask development server so you can visit the site
+        print('Database ready:', db_profile.url)
     app.run(debug=True)
@@ -0,0 +1,135 @@
+"""Build step for the files under static/.
+
+    flask --app wsgi build-assets
+
+Every file in ``static/`` (uploads and the output directory excepted) is
+written to ``static/dist/`` as ``<name>.<hash>.<ext>``, stylesheets
+minified first.  Text files also get a ``.gz`` copy and, when the optional
+``brotli`` package is installed, a ``.br`` copy, so the server never
+compresses on the fly.  ``manifest.json`` maps each source path to its
+fingerprinted name and the encodings built for it.
+
+A fingerprinted name always means the same bytes, so it is served with an
+immutable, far-future Cache-Control; a changed file gets a new name.
+Without a build the app links the plain ``/static/`` files as before.
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - depends on the environment
+    brotli = None
+
+HASH_CHARS = 12
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.map', '.xml'}
+MIN_COMPRESS_BYTES = 256  # below this the headers outweigh the savings
+
+_CSS_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+_CSS_SPACE = re.compile(r'\s+')
+_CSS_PUNCT = re.compile(r'\s*([{};,>])\s*')
+
+
+def minify_css(text):
+    """Drop comments and layout whitespace; values and selectors are left alone"""
+    text = _CSS_COMMENT.sub('', text)
+    text = _CSS_SPACE.sub(' ', text)
+    text = _CSS_PUNCT.sub(r'\1', text)
+    text = re.sub(r':\s+', ':', text)
+    return text.replace(';}', '}').strip()
+
+
+def _write(path, data):
+    tmp = f'{path}.tmp{os.getpid()}'
+    with open(tmp, 'wb') as fh:
+        fh.write(data)
+    os.replace(tmp, path)
+
+
+def build(static_dir, out_dir, skip=('uploads',)):
+    """Fingerprint, minify and precompress ``static_dir`` into ``out_dir``; returns the manifest"""
+    os.makedirs(out_dir, exist_ok=True)
+    skip = set(skip) | {os.path.relpath(out_dir, static_dir)}
+    manifest = {}
+    for dirpath, dirnames, filenames in os.walk(static_dir):
+        rel_dir = os.path.relpath(dirpath, static_dir)
+        dirnames[:] = sorted(d for d in dirnames
+                             if os.path.normpath(os.path.join(rel_dir, d)) not in skip and not d.startswith('.'))
+        for filename in sorted(filenames):
+            if filename.startswith('.'):
+                continue
+            source = os.path.normpath(os.path.join(rel_dir, filename)).replace(os.sep, '/')
+            with open(os.path.join(dirpath, filename), 'rb') as fh:
+                data = fh.read()
+            stem, ext = os.path.splitext(source)
+            if ext == '.css':
+                data = minify_css(data.decode('utf-8')).encode('utf-8')
+            built = f'{stem}.{hashlib.sha256(data).hexdigest()[:HASH_CHARS]}{ext}'
+            path = os.path.join(out_dir, built)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if not os.path.exists(path):
+                _write(path, data)
+            encodings = []
+            if ext in COMPRESSIBLE and len(data) >= MIN_COMPRESS_BYTES:
+                if brotli is not None:
+                    _write(path + '.br', brotli.compress(data, quality=11))
+                    encodings.append('br')
+                _write(path + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+                encodings.append('gzip')
+            manifest[source] = {'path': built, 'encodings': encodings}
+    _write(os.path.join(out_dir, 'manifest.json'), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+
+class AssetManifest:
+    """Read side of ``manifest.json``, loaded on first use"""
+
+    SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+    def __init__(self, path):
+        self.path = path
+        self._sources = None
+        self._built = None
+        self._digest = None
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as fh:
+                raw = fh.read()
+            entries = json.loads(raw)
+        except (FileNotFoundError, ValueError):
+            raw, entries = b'', {}
+        self._built = {entry['path']: entry['encodings'] for entry in entries.values()}
+        self._sources = {source: entry['path'] for source, entry in entries.items()}
+        self._digest = hashlib.sha1(raw).hexdigest()[:HASH_CHARS]
+
+    def reload(self):
+        self._load()
+
+    def lookup(self, source):
+        """Fingerprinted name of a static file, or None if it wasn't built"""
+        if self._sources is None:
+            self._load()
+        return self._sources.get(source)
+
+    def digest(self):
+        """Short hash of the manifest; changes whenever a build changes any asset name"""
+        if self._digest is None:
+            self._load()
+        return self._digest
+
+    def encodings(self, built):
+        """Precompressed encodings available for a built file, or None if it isn't one"""
+        if self._built is None:
+            self._load()
+        return self._built.get(built)
+
+    def negotiate(self, built, accept_encoding):
+        """(filename to send, Content-Encoding or None) for a built file and an Accept-Encoding object"""
+        for encoding in self.encodings(built) or ():
+            if accept_encoding[encoding]:
+                return built + self.SUFFIXES[encoding], encoding
+        return built, None
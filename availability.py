@@ -0,0 +1,191 @@
+"""In-memory room availability index.
+
+Each room gets its own interval tree of booked stays so that
+"is room X free from A to B" is a single O(log n) descent instead of a
+scan over every Booking row.  Stays are half-open ``[check_in, check_out)``
+intervals, so a guest checking out on the 5th never conflicts with a guest
+checking in on the 5th.
+
+The tree is a treap keyed by ``(start, end, booking_id)`` where every node
+also tracks the largest ``end`` in its subtree (the classic augmented
+interval tree from CLRS).  The database stays the source of truth: the
+index is loaded lazily per room and is kept up to date by the commit hooks
+in app.py.
+"""
+import random
+import threading
+
+
+class _Node:
+    __slots__ = ('key', 'start', 'end', 'priority', 'max_end', 'left', 'right')
+
+    def __init__(self, start, end, booking_id):
+        self.key = (start, end, booking_id)
+        self.start = start
+        self.end = end
+        self.priority = random.random()
+        self.max_end = end
+        self.left = None
+        self.right = None
+
+    def update(self):
+        m = self.end
+        if self.left is not None and self.left.max_end > m:
+            m = self.left.max_end
+        if self.right is not None and self.right.max_end > m:
+            m = self.right.max_end
+        self.max_end = m
+
+
+def _split(node, key):
+    """Split into (< key, >= key)"""
+    if node is None:
+        return None, None
+    if node.key < key:
+        left, right = _split(node.right, key)
+        node.right = left
+        node.update()
+        return node, right
+    left, right = _split(node.left, key)
+    node.left = right
+    node.update()
+    return left, node
+
+
+def _merge(left, right):
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        left.update()
+        return left
+    right.left = _merge(left, right.left)
+    right.update()
+    return right
+
+
+def _delete(node, key):
+    """Remove the node with ``key``; returns (new subtree, removed?)"""
+    if node is None:
+        return None, False
+    if key == node.key:
+        return _merge(node.left, node.right), True
+    if key < node.key:
+        node.left, removed = _delete(node.left, key)
+    else:
+        node.right, removed = _delete(node.right, key)
+    if removed:
+        node.update()
+    return node, removed
+
+
+class IntervalTree:
+    """Augmented treap of half-open ``[start, end)`` intervals tagged with a booking id"""
+
+    def __init__(self):
+        self._root = None
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, start, end, booking_id):
+        node = _Node(start, end, booking_id)
+        left, right = _split(self._root, node.key)
+        self._root = _merge(_merge(left, node), right)
+        self._size += 1
+
+    def remove(self, start, end, booking_id):
+        self._root, removed = _delete(self._root, (start, end, booking_id))
+        if removed:
+            self._size -= 1
+
+    def find_any(self, start, end):
+        """Return the booking id of one interval overlapping [start, end), or None"""
+        node = self._root
+        while node is not None:
+            if node.start < end and node.end > start:
+                return node.key[2]
+            if node.left is not None and node.left.max_end > start:
+                node = node.left
+            else:
+                node = node.right
+        return None
+
+    def find_all(self, start, end):
+        """Return the booking ids of every interval overlapping [start, end)"""
+        out = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if node is None or node.max_end <= start:
+                continue
+            stack.append(node.left)
+            if node.start < end:
+                if node.end > start:
+                    out.append(node.key[2])
+                stack.append(node.right)
+        return out
+
+
+class AvailabilityIndex:
+    """Per-room interval trees, loaded on first use.
+
+    ``loader(room_id)`` must return an iterable of
+    ``(booking_id, check_in, check_out)`` for every active booking of the room
+    that hasn't ended yet; questions about past nights aren't answered.
+    """
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._rooms = {}
+        self._stays = {}  # booking_id -> (room_id, check_in, check_out)
+        self._lock = threading.RLock()
+
+    def _tree(self, room_id):
+        tree = self._rooms.get(room_id)
+        if tree is None:
+            tree = IntervalTree()
+            for booking_id, check_in, check_out in self._loader(room_id):
+                tree.add(check_in, check_out, booking_id)
+                self._stays[booking_id] = (room_id, check_in, check_out)
+            self._rooms[room_id] = tree
+        return tree
+
+    def is_available(self, room_id, check_in, check_out):
+        with self._lock:
+            return self._tree(room_id).find_any(check_in, check_out) is None
+
+    def conflicts(self, room_id, check_in, check_out):
+        with self._lock:
+            return self._tree(room_id).find_all(check_in, check_out)
+
+    def add(self, booking_id, room_id, check_in, check_out):
+        with self._lock:
+            self.discard(booking_id)
+            # Rooms that were never loaded will pick the stay up from the DB.
+            tree = self._rooms.get(room_id)
+            if tree is None:
+                return
+            tree.add(check_in, check_out, booking_id)
+            self._stays[booking_id] = (room_id, check_in, check_out)
+
+    def discard(self, booking_id):
+        with self._lock:
+            stay = self._stays.pop(booking_id, None)
+            if stay is None:
+                return
+            room_id, check_in, check_out = stay
+            tree = self._rooms.get(room_id)
+            if tree is not None:
+                tree.remove(check_in, check_out, booking_id)
+
+    def invalidate(self, room_id=None):
+        """Drop cached trees so they are reloaded from the database"""
+        with self._lock:
+            rooms = list(self._rooms) if room_id is None else [room_id]
+            for rid in rooms:
+                self._rooms.pop(rid, None)
+            self._stays = {bid: stay for bid, stay in self._stays.items() if stay[0] in self._rooms}
@@ -0,0 +1,224 @@
+"""End-to-end benchmark of the booking funnel and admin pages.
+
+    python benchmarks/bench_funnel.py --rooms 200 --bookings 50000 --reviews 20000 \
+        --iterations 200 --output results.json
+
+Creates a throwaway SQLite database, seeds it with the requested volumes,
+then drives the app through Flask's test client:
+
+    browse (/, /booking/<id>, /reviews) -> add to cart -> /my-bookings
+    -> /checkout -> /payment (GET + POST) -> /payment-success
+
+plus the admin dashboard, bookings list and API room listing.  Per-step
+p50/p95/p99 latency and throughput are printed and, with --output, written
+as JSON together with the run parameters.  --compare old.json prints the
+change in p50/p95 against an earlier run.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+TOKEN_RE = re.compile(r'name="payment_token" value="([0-9a-f]+)"')
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    k = (len(ordered) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def seed(app_module, n_rooms, n_bookings, n_reviews, rng):
+    db = app_module.db
+    room_types = [('Standard', 2, 1500.0), ('Deluxe', 2, 2500.0), ('Suite', 4, 4500.0), ('Family', 6, 5500.0)]
+    rooms = []
+    for i in range(n_rooms):
+        room_type, capacity, price = room_types[i % len(room_types)]
+        rooms.append({'name': f'{room_type} {i + 1}', 'room_type': room_type, 'capacity': capacity,
+                      'price_per_night': price, 'image_url': '', 'amenities': 'WiFi, AC, TV'})
+    db.session.execute(db.insert(app_module.Room), rooms)
+    room_ids = [rid for (rid,) in db.session.query(app_module.Room.id)]
+
+    # Historical stays laid end to end per room, all in the past, so they
+    # never collide with the funnel's future dates.
+    cursor = {rid: date.today() - timedelta(days=3 * n_bookings // max(n_rooms, 1) + 30) for rid in room_ids}
+    batch = []
+    for i in range(n_bookings):
+        rid = room_ids[i % len(room_ids)]
+        nights = rng.randint(1, 3)
+        check_in = cursor[rid]
+        cursor[rid] = check_in + timedelta(days=nights)
+        batch.append({'customer_name': f'Guest {i % 5000}', 'customer_email': f'guest{i % 5000}@example.com',
+                      'room_id': rid, 'room_name': f'Room {rid}', 'room_type': 'Standard',
+                      'check_in': check_in, 'check_out': cursor[rid], 'guests': 2,
+                      'price_per_night': 1500.0, 'nights': nights, 'total_price': 1500.0 * nights,
+                      'status': 'completed', 'created_at': datetime.now() - timedelta(days=rng.randint(0, 365))})
+        if len(batch) == 5000:
+            db.session.execute(db.insert(app_module.Booking), batch)
+            batch = []
+    if batch:
+        db.session.execute(db.insert(app_module.Booking), batch)
+
+    reviews = [{'room_id': rng.choice(room_ids), 'name': f'Reviewer {i}', 'rating': rng.randint(1, 5),
+                'comment': 'ห้องสะอาด บริการดี', 'created_at': datetime.now() - timedelta(minutes=i)}
+               for i in range(n_reviews)]
+    for start in range(0, len(reviews), 5000):
+        db.session.execute(db.insert(app_module.Review), reviews[start:start + 5000])
+    db.session.commit()
+    app_module.rebuild_review_stats()
+    return room_ids
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+
+    def call(self, step, fn, *args, expect=(200, 302, 304), **kwargs):
+        t0 = time.perf_counter()
+        response = fn(*args, **kwargs)
+        self.samples.setdefault(step, []).append(time.perf_counter() - t0)
+        if response.status_code not in expect:
+            self.errors[step] = self.errors.get(step, 0) + 1
+        return response
+
+    def report(self):
+        out = {}
+        for step, samples in self.samples.items():
+            total = sum(samples)
+            out[step] = {
+                'count': len(samples),
+                'errors': self.errors.get(step, 0),
+                'mean_ms': statistics.fmean(samples) * 1000,
+                'p50_ms': percentile(samples, 50) * 1000,
+                'p95_ms': percentile(samples, 95) * 1000,
+                'p99_ms': percentile(samples, 99) * 1000,
+                'throughput_rps': len(samples) / total if total else 0.0,
+            }
+        return out
+
+
+def run_funnel(app_module, room_ids, iterations, rng, rec):
+    app = app_module.app
+    start = date.today() + timedelta(days=30)
+    for i in range(iterations):
+        client = app.test_client()
+        room_id = room_ids[i % len(room_ids)]
+        check_in = start + timedelta(days=3 * (i // len(room_ids)))
+        check_out = check_in + timedelta(days=rng.randint(1, 2))
+
+        rec.call('browse_index', client.get, '/')
+        rec.call('booking_form', client.get, f'/booking/{room_id}')
+        rec.call('reviews_page', client.get, '/reviews')
+        rec.call('add_to_cart', client.post, f'/booking/{room_id}', data={
+            'check_in': check_in.isoformat(), 'check_out': check_out.isoformat(), 'guests': '2'})
+        rec.call('view_cart', client.get, '/my-bookings')
+        rec.call('checkout', client.get, '/checkout')
+        page = rec.call('payment_page', client.get, '/payment')
+        match = TOKEN_RE.search(page.get_data(as_text=True))
+        rec.call('pay', client.post, '/payment', data={
+            'full_name': f'Bench {i}', 'email': f'bench{i}@example.com', 'card_number': '4111111111111111',
+            'payment_token': match.group(1) if match else ''})
+        rec.call('payment_success', client.get, '/payment-success')
+
+
+def run_admin(app_module, iterations, rec):
+    client = app_module.app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': '1234'})
+    for _ in range(iterations):
+        rec.call('admin_dashboard', client.get, '/admin')
+        rec.call('admin_bookings', client.get, '/admin/bookings')
+        rec.call('api_rooms', client.get, '/api/v1/rooms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rooms', type=int, default=100)
+    parser.add_argument('--bookings', type=int, default=20000)
+    parser.add_argument('--reviews', type=int, default=5000)
+    parser.add_argument('--iterations', type=int, default=100, help='funnel runs (one new customer each)')
+    parser.add_argument('--admin-iterations', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write results as JSON to this path')
+    parser.add_argument('--compare', help='earlier --output file to diff against')
+    parser.add_argument('--keep-db', action='store_true', help='leave the temporary database behind')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='boonyisa-bench-')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tmpdir, 'bench.db')
+    os.environ.setdefault('CART_STORE', 'sqlite')
+    os.environ.setdefault('SECRET_KEY', 'bench-secret')
+    import app as app_module
+
+    app_module.create_app()
+    rng = random.Random(args.seed)
+    with app_module.app.app_context():
+        app_module.init_db()
+        t0 = time.perf_counter()
+        room_ids = seed(app_module, args.rooms, args.bookings, args.reviews, rng)
+        seed_seconds = time.perf_counter() - t0
+
+    rec = Recorder()
+    t0 = time.perf_counter()
+    run_funnel(app_module, room_ids, args.iterations, rng, rec)
+    run_admin(app_module, args.admin_iterations, rec)
+    wall = time.perf_counter() - t0
+
+    steps = rec.report()
+    print(f'seeded {args.rooms} rooms / {args.bookings} bookings / {args.reviews} reviews in {seed_seconds:.1f}s')
+    print(f'{"step":<18}{"n":>6}{"err":>5}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"req/s":>10}')
+    for step, r in steps.items():
+        print(f'{step:<18}{r["count"]:>6}{r["errors"]:>5}{r["p50_ms"]:>10.2f}{r["p95_ms"]:>10.2f}'
+              f'{r["p99_ms"]:>10.2f}{r["throughput_rps"]:>10.1f}')
+    total_requests = sum(r['count'] for r in steps.values())
+    print(f'{total_requests} requests in {wall:.1f}s ({total_requests / wall:.1f} req/s overall)')
+
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)['steps']
+        print(f'\nvs {args.compare}')
+        print(f'{"step":<18}{"p50 Δ%":>10}{"p95 Δ%":>10}')
+        for step, r in steps.items():
+            old = baseline.get(step)
+            if not old:
+                continue
+            d50 = (r['p50_ms'] / old['p50_ms'] - 1) * 100 if old['p50_ms'] else 0.0
+            d95 = (r['p95_ms'] / old['p95_ms'] - 1) * 100 if old['p95_ms'] else 0.0
+            print(f'{step:<18}{d50:>+10.1f}{d95:>+10.1f}')
+
+    if args.output:
+        result = {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'params': vars(args),
+            'seed_seconds': seed_seconds,
+            'wall_seconds': wall,
+            'steps': steps,
+        }
+        with open(args.output, 'w') as fh:
+            json.dump(result, fh, indent=2)
+        print(f'wrote {args.output}')
+
+    if args.keep_db:
+        print(f'database kept in {tmpdir}')
+    else:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Throughput of the cart pricing engine.
+
+    python benchmarks/bench_pricing.py [--carts 20000] [--lines 3]
+
+Reports lines/second for first-time pricing, repeat views of already
+priced carts, and batch pricing of many carts with overlapping stays.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pricing import CartPricer, _nights_and_total  # noqa: E402
+
+
+def make_carts(n_carts, n_lines, seed=1):
+    rng = random.Random(seed)
+    rooms = [SimpleNamespace(id=i, name=f'Room {i}', room_type='Standard',
+                             price_per_night=float(rng.choice((1500, 2500, 4500, 5500))))
+             for i in range(1, 51)]
+    start = date.today()
+    carts = []
+    for _ in range(n_carts):
+        lines = []
+        for _ in range(n_lines):
+            check_in = start + timedelta(days=rng.randrange(180))
+            check_out = check_in + timedelta(days=rng.randrange(1, 8))
+            lines.append((rng.choice(rooms), check_in, check_out, '2'))
+        carts.append(lines)
+    return carts
+
+
+def timed(label, n_lines, fn):
+    t0 = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - t0
+    print(f'{label:<28} {elapsed * 1000:9.1f} ms  {n_lines / elapsed:12,.0f} lines/s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--carts', type=int, default=20000)
+    parser.add_argument('--lines', type=int, default=3)
+    args = parser.parse_args()
+
+    pricer = CartPricer()
+    specs = make_carts(args.carts, args.lines)
+    n_lines = args.carts * args.lines
+    carts = []
+
+    _nights_and_total.cache_clear()
+    timed('add lines (parse + price)', n_lines,
+          lambda: carts.extend([pricer.make_line(*spec) for spec in lines] for lines in specs))
+    timed('re-view priced carts', n_lines, lambda: [pricer.price_cart(lines) for lines in carts])
+
+    for lines in carts:
+        for line in lines:
+            del line['price_key']
+    timed('batch reprice (price_carts)', n_lines, lambda: pricer.price_carts(carts))
+    info = _nights_and_total.cache_info()
+    print(f'stay memo: {info.hits} hits, {info.misses} misses')
+
+
+if __name__ == '__main__':
+    main()
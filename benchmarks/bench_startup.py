@@ -0,0 +1,92 @@
+"""Cold-start time of a web worker.
+
+    python benchmarks/bench_startup.py [--runs 10] [--output results.json]
+
+Prepares a throwaway database once (init-db + seed-rooms), then starts
+fresh interpreters the way a server spawns workers and times, in each:
+
+    import wsgi        module import plus create_app()
+    first request      GET / on a cold process (first connection, templates)
+    second request     the same page once warm
+
+plus the wall time of the whole process as seen from outside.  Medians and
+maxima are printed; --output writes every run as JSON.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r'''
+import json, time
+t0 = time.perf_counter()
+import wsgi
+t1 = time.perf_counter()
+import app as app_module
+client = wsgi.app.test_client()
+t2 = time.perf_counter()
+first = client.get('/')
+t3 = time.perf_counter()
+client.get('/')
+t4 = time.perf_counter()
+print(json.dumps({
+    'import_ms': (t1 - t0) * 1000,
+    'init_ms': app_module.startup_timings.get('init', 0) * 1000,
+    'first_request_ms': (t3 - t2) * 1000,
+    'second_request_ms': (t4 - t3) * 1000,
+    'status': first.status_code,
+}))
+'''
+
+
+def prepare(env):
+    code = ('import app as m; m.create_app()\n'
+            'with m.app.app_context():\n'
+            '    m.init_db()\n'
+            'm.seed_rooms()\n')
+    subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--output', help='write results as JSON to this path')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='boonyisa-startup-')
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + os.path.join(tmpdir, 'startup.db'),
+               MAIL_SINK_DIR=os.path.join(tmpdir, 'mail'), JOB_WORKERS='0', SECRET_KEY='startup-secret')
+    try:
+        prepare(env)
+        runs = []
+        for _ in range(args.runs):
+            t0 = time.perf_counter()
+            out = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, env=env, check=True,
+                                 capture_output=True, text=True).stdout
+            run = json.loads(out.strip().splitlines()[-1])
+            run['process_ms'] = (time.perf_counter() - t0) * 1000
+            runs.append(run)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    print(f'{"phase":<20}{"median ms":>12}{"max ms":>10}')
+    for key in ('import_ms', 'init_ms', 'first_request_ms', 'second_request_ms', 'process_ms'):
+        values = [run[key] for run in runs]
+        print(f'{key[:-3]:<20}{statistics.median(values):>12.1f}{max(values):>10.1f}')
+    bad = [run['status'] for run in runs if run['status'] != 200]
+    if bad:
+        print(f'warning: {len(bad)} first requests did not return 200: {sorted(set(bad))}')
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump({'runs': runs, 'python': sys.version}, fh, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,524 @@
+"""Concurrent booking, payment, cancel and review traffic against a live server.
+
+    python benchmarks/stress_booking.py [--mode threads|processes|both] [--clients 32]
+        [--duration 30] [--rooms 4] [--window 21] [--output results.json]
+
+For each mode a throwaway database is prepared (init-db, seed-rooms), the
+app is served on a local port by Werkzeug - one process with a thread per
+request, or a forking server plus a separate ``run-worker`` process for the
+job queue - and ``--clients`` threads, each with its own cookie jar, run
+random scenarios until ``--duration`` runs out:
+
+    pay      clear the cart, add 1-2 stays in a short, shared window of
+             dates on few rooms, open /payment and submit it, sometimes
+             twice at once (a double-clicked button)
+    cancel   add two stays far in the future, submit the cancel form of
+             the first one twice, and expect exactly one line left
+    review   post a review
+
+Afterwards the database is checked directly:
+
+    * no two live bookings of a room share a night;
+    * no payment token or payer appears twice, and each payment's
+      booking_count and total match the bookings it wrote;
+    * every booking's nights and total agree with its dates and rate;
+    * the occupancy / revenue rollups and the review rating totals agree
+      with the rows they summarise;
+    * every paid attempt seen by a client has its payment, and none other;
+    * the server never answered with a 5xx;
+    * the job queue drains (nothing left queued or running, nothing dead)
+      and the server log holds no tracebacks, so a dead worker fails the run.
+
+Connection errors are counted and reported but don't fail the run.
+
+Per-scenario latency and throughput are printed with the outcome counts,
+the write-lock wait histogram from /admin/metrics (threads mode only: the
+forking server keeps no state between requests), "database is locked"
+errors in the server log and job retries.  The exit status is 1 if any
+invariant failed.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TOKEN_RE = re.compile(r'name="payment_token" value="([0-9a-f]+)"')
+LINE_RE = re.compile(r'name="line_id" value="([0-9a-f]+)"')
+METRICS_TOKEN = 'stress'
+
+PREPARE = r'''
+import sys
+import app as m
+m.create_app()
+with m.app.app_context():
+    m.init_db()
+m.seed_rooms()
+extra = int(sys.argv[1])
+with m.app.app_context():
+    if extra:
+        rows = [{'name': f'Stress Room {i}', 'room_type': 'Standard', 'capacity': 2,
+                 'price_per_night': 1500.0, 'image_url': '', 'amenities': 'WiFi'} for i in range(extra)]
+        ids = list(m.db.session.scalars(m.db.insert(m.Room).returning(m.Room.id), rows))
+        m.sync_room_amenities(ids)
+        m.refresh_rate_calendar(ids)
+    # Sample rooms queue photo downloads; keep the network out of the run.
+    m.Job.query.delete()
+    m.db.session.commit()
+    print(','.join(str(rid) for (rid,) in m.db.session.query(m.Room.id).order_by(m.Room.id)))
+'''
+
+SERVE = r'''
+import sys
+from werkzeug.serving import run_simple
+from wsgi import app
+port, processes = int(sys.argv[1]), int(sys.argv[2])
+run_simple('127.0.0.1', port, app, threaded=processes == 1, processes=processes,
+           use_reloader=False, use_debugger=False)
+'''
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    k = (len(ordered) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = {}    # scenario -> [seconds]
+        self.outcomes = {}   # name -> count
+        self.statuses = {}   # HTTP status -> count
+        self.errors = []     # invariant-style problems seen by clients
+        self.paid_emails = set()
+        self.attempt_emails = set()
+        self.reviews_posted = 0
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.outcomes[name] = self.outcomes.get(name, 0) + n
+
+    def status(self, code):
+        with self._lock:
+            self.statuses[code] = self.statuses.get(code, 0) + 1
+
+    def timed(self, scenario, seconds):
+        with self._lock:
+            self.latency.setdefault(scenario, []).append(seconds)
+
+    def error(self, message):
+        with self._lock:
+            self.errors.append(message)
+
+
+class Client:
+    """One browser: its own cookie jar, no automatic redirects"""
+
+    def __init__(self, base, stats):
+        self.base = base
+        self.stats = stats
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect())
+
+    def request(self, path, data=None):
+        """(status, Location path or None, body text)"""
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        try:
+            with self.opener.open(self.base + path, data=body, timeout=60) as response:
+                status, location, text = response.status, None, response.read().decode('utf-8', 'replace')
+        except urllib.error.HTTPError as e:
+            status, location, text = e.code, e.headers.get('Location'), e.read().decode('utf-8', 'replace')
+        self.stats.status(status)
+        if status >= 500:
+            self.stats.error(f'{status} from {path}')
+        if location:
+            location = urllib.parse.urlsplit(location).path
+        return status, location, text
+
+
+def pay_scenario(client, rng, room_ids, window, double_submit_rate, stats):
+    client.request('/clear-bookings', {})
+    start = date.today() + timedelta(days=1)
+    added = 0
+    for _ in range(rng.choice((1, 1, 2))):
+        check_in = start + timedelta(days=rng.randrange(window))
+        check_out = check_in + timedelta(days=rng.randint(1, 3))
+        _, location, _ = client.request(f'/booking/{rng.choice(room_ids)}', {
+            'check_in': check_in.isoformat(), 'check_out': check_out.isoformat(), 'guests': '2'})
+        if location == '/my-bookings':
+            added += 1
+        else:
+            stats.count('pay:unavailable_at_add')
+    if not added:
+        return
+    status, _, page = client.request('/payment')
+    match = TOKEN_RE.search(page) if status == 200 else None
+    if not match:
+        stats.count('pay:no_payment_page')
+        return
+    email = f'{uuid.uuid4().hex[:16]}@stress.test'
+    stats.attempt_emails.add(email)
+    form = {'full_name': 'Stress Tester', 'email': email, 'card_number': '4111111111111111',
+            'payment_token': match.group(1)}
+
+    submits = 2 if rng.random() < double_submit_rate else 1
+    results = [None] * submits
+
+    def submit(i):
+        try:
+            results[i] = client.request('/payment', form)[1]
+        except OSError:
+            stats.count('connection_errors')
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(submits)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if submits > 1:
+        stats.count('pay:double_submits')
+    if '/payment-success' in results:
+        stats.count('pay:paid')
+        stats.paid_emails.add(email)
+    elif '/my-bookings' in results:
+        stats.count('pay:conflict_at_payment')
+    else:
+        stats.count('pay:other')
+
+
+def cancel_scenario(client, rng, room_ids, stats):
+    client.request('/clear-bookings', {})
+    # Far beyond the payment window, so availability never gets in the way.
+    start = date.today() + timedelta(days=300 + rng.randrange(300))
+    for offset in (0, 5):
+        check_in = start + timedelta(days=offset)
+        client.request(f'/booking/{rng.choice(room_ids)}', {
+            'check_in': check_in.isoformat(), 'check_out': (check_in + timedelta(days=2)).isoformat(),
+            'guests': '1'})
+    _, _, page = client.request('/my-bookings')
+    line_ids = LINE_RE.findall(page)
+    if len(line_ids) != 2:
+        stats.count('cancel:setup_failed')
+        return
+    for _ in range(2):  # the same form submitted twice
+        client.request('/cancel-booking/0', {'line_id': line_ids[0]})
+    _, _, page = client.request('/my-bookings')
+    left = LINE_RE.findall(page)
+    if left != line_ids[1:]:
+        stats.error(f'double cancel left {left}, expected {line_ids[1:]}')
+    stats.count('cancel:done')
+
+
+def review_scenario(client, rng, room_ids, stats):
+    status, _, _ = client.request(f'/review/{rng.choice(room_ids)}', {
+        'review_name': 'Stress', 'rating': str(rng.randint(1, 5)), 'comment': f'stress {uuid.uuid4().hex}'})
+    if status == 302:
+        with stats._lock:
+            stats.reviews_posted += 1
+
+
+def run_clients(base, room_ids, args, stats):
+    deadline = time.monotonic() + args.duration
+    scenarios = (('pay', 0.6), ('cancel', 0.15), ('review', 0.25))
+
+    def worker(n):
+        rng = random.Random(args.seed * 1000 + n)
+        client = Client(base, stats)
+        while time.monotonic() < deadline:
+            scenario = rng.choices([s for s, _ in scenarios], [w for _, w in scenarios])[0]
+            t0 = time.perf_counter()
+            try:
+                if scenario == 'pay':
+                    pay_scenario(client, rng, room_ids, args.window, args.double_submit_rate, stats)
+                elif scenario == 'cancel':
+                    cancel_scenario(client, rng, room_ids, stats)
+                else:
+                    review_scenario(client, rng, room_ids, stats)
+            except OSError:  # includes URLError; reset or refused connections
+                stats.count('connection_errors')
+                continue
+            stats.timed(scenario, time.perf_counter() - t0)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(args.clients)]
+    t0 = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - t0
+
+
+def scrape_lock_wait(base):
+    """(count, total seconds, {bucket: cumulative}) of write-lock waits, summed over endpoints"""
+    request = urllib.request.Request(base + '/admin/metrics', headers={'Authorization': f'Bearer {METRICS_TOKEN}'})
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            text = response.read().decode()
+    except OSError:
+        return None
+    count, total, buckets = 0, 0.0, {}
+    for line in text.splitlines():
+        if not line.startswith('sql_write_lock_wait_seconds'):
+            continue
+        name, value = line.rsplit(' ', 1)
+        if name.startswith('sql_write_lock_wait_seconds_count'):
+            count += int(value)
+        elif name.startswith('sql_write_lock_wait_seconds_sum'):
+            total += float(value)
+        elif name.startswith('sql_write_lock_wait_seconds_bucket'):
+            bound = re.search(r'le="([^"]+)"', name).group(1)
+            buckets[bound] = buckets.get(bound, 0) + int(value)
+    return count, total, buckets
+
+
+def wait_for_jobs(db_path, timeout=30):
+    deadline = time.monotonic() + timeout
+    with sqlite3.connect(db_path) as conn:
+        while time.monotonic() < deadline:
+            pending = conn.execute("SELECT count(*) FROM job WHERE status IN ('queued', 'running')").fetchone()[0]
+            if not pending:
+                return 0
+            time.sleep(0.5)
+        return pending
+
+
+def check_invariants(db_path, stats):
+    """List of failed invariants, each as a message"""
+    failures = list(stats.errors)
+    conn = sqlite3.connect(db_path)
+
+    def q(sql):
+        return conn.execute(sql).fetchall()
+
+    overlaps = q("""
+        SELECT a.id, b.id, a.room_id FROM booking a JOIN booking b
+          ON a.room_id = b.room_id AND a.id < b.id AND a.check_in < b.check_out AND b.check_in < a.check_out
+        WHERE a.status != 'cancelled' AND b.status != 'cancelled'""")
+    if overlaps:
+        failures.append(f'{len(overlaps)} double-booked pairs, e.g. {overlaps[:3]}')
+
+    for column in ('token', 'customer_email'):
+        dupes = q(f'SELECT {column}, count(*) FROM payment GROUP BY {column} HAVING count(*) > 1')
+        if dupes:
+            failures.append(f'duplicate payments by {column}: {dupes[:3]}')
+
+    mismatched = q("""
+        SELECT p.customer_email, p.booking_count, p.total_price, count(b.id), coalesce(sum(b.total_price), 0)
+        FROM payment p LEFT JOIN booking b ON b.customer_email = p.customer_email
+        GROUP BY p.id
+        HAVING p.booking_count != count(b.id) OR abs(p.total_price - coalesce(sum(b.total_price), 0)) > 0.01""")
+    if mismatched:
+        failures.append(f'{len(mismatched)} payments disagree with their bookings, e.g. {mismatched[:3]}')
+
+    bad_rows = q("""
+        SELECT id, nights, total_price, price_per_night FROM booking
+        WHERE nights != CAST(julianday(check_out) - julianday(check_in) AS INTEGER)
+           OR abs(total_price - price_per_night * nights) > 0.01 * nights + 0.01""")
+    if bad_rows:
+        failures.append(f'{len(bad_rows)} bookings with inconsistent nights/total, e.g. {bad_rows[:3]}')
+
+    (live_nights, live_revenue, live_count), = q(
+        "SELECT coalesce(sum(nights), 0), coalesce(sum(total_price), 0), count(*) FROM booking WHERE status != 'cancelled'")
+    (rolled_nights, rolled_revenue), = q('SELECT coalesce(sum(stays), 0), coalesce(sum(revenue), 0) FROM room_night_stat')
+    (rolled_count,), = q('SELECT coalesce(sum(bookings), 0) FROM daily_booking_stat')
+    if rolled_nights != live_nights or abs(rolled_revenue - live_revenue) > 0.01 * max(live_count, 1):
+        failures.append(f'night rollup {rolled_nights} nights / {rolled_revenue:.2f} '
+                        f'vs bookings {live_nights} nights / {live_revenue:.2f}')
+    if rolled_count != live_count:
+        failures.append(f'daily rollup counts {rolled_count} bookings vs {live_count} in the table')
+
+    rating_drift = q("""
+        SELECT s.room_id, s.review_count, s.rating_sum, count(r.id), coalesce(sum(r.rating), 0)
+        FROM room_rating_stats s LEFT JOIN review r ON r.room_id = s.room_id
+        GROUP BY s.room_id HAVING s.review_count != count(r.id) OR s.rating_sum != coalesce(sum(r.rating), 0)""")
+    if rating_drift:
+        failures.append(f'rating totals disagree with reviews: {rating_drift[:3]}')
+    (stress_reviews,), = q("SELECT count(*) FROM review WHERE comment LIKE 'stress %'")
+    if stress_reviews != stats.reviews_posted:
+        failures.append(f'{stats.reviews_posted} reviews accepted but {stress_reviews} stored')
+
+    stored = {email for (email,) in q("SELECT customer_email FROM payment WHERE customer_email LIKE '%@stress.test'")}
+    if stored - stats.attempt_emails:
+        failures.append(f'payments nobody attempted: {sorted(stored - stats.attempt_emails)[:3]}')
+    if stats.paid_emails - stored:
+        failures.append(f'{len(stats.paid_emails - stored)} paid attempts have no payment row')
+    conn.close()
+    return failures
+
+
+def check_jobs_and_log(jobs, log_text):
+    """Failed invariants for a queue that didn't drain and for errors in the server log"""
+    failures = []
+    if jobs['unfinished']:
+        failures.append(f"{jobs['unfinished']} jobs still queued or running after the run: {jobs['by_status']}")
+    if jobs['by_status'].get('dead'):
+        failures.append(f"{jobs['by_status']['dead']} dead jobs")
+    claim_errors = log_text.count('Job worker could not claim a job')
+    if claim_errors:
+        failures.append(f"{claim_errors} 'Job worker could not claim a job' errors in the server log")
+    tracebacks = log_text.split('Traceback (most recent call last):')[1:]
+    if tracebacks:
+        # The exception line is the first unindented line after the frames.
+        last = next((line for line in tracebacks[0].splitlines()[1:] if line and not line[0].isspace()), '?')
+        failures.append(f'{len(tracebacks)} tracebacks in the server log, e.g. {last}')
+    return failures
+
+
+def job_stats(db_path):
+    with sqlite3.connect(db_path) as conn:
+        by_status = dict(conn.execute('SELECT status, count(*) FROM job GROUP BY status').fetchall())
+        retried, = conn.execute('SELECT count(*) FROM job WHERE attempts > 1').fetchone()
+    return {'by_status': by_status, 'retried': retried}
+
+
+def run_mode(mode, args):
+    tmpdir = tempfile.mkdtemp(prefix=f'boonyisa-stress-{mode}-')
+    db_path = os.path.join(tmpdir, 'stress.db')
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + db_path, MAIL_SINK_DIR=os.path.join(tmpdir, 'mail'),
+               CART_STORE='sqlite', SECRET_KEY='stress-secret', METRICS_ENABLED='1',
+               METRICS_TOKEN=METRICS_TOKEN, JOB_WORKERS='2' if mode == 'threads' else '0')
+    log_path = os.path.join(tmpdir, 'server.log')
+    procs = []
+    try:
+        out = subprocess.run([sys.executable, '-c', PREPARE, str(max(args.rooms - 4, 0))], cwd=ROOT, env=env,
+                             check=True, capture_output=True, text=True).stdout
+        room_ids = [int(x) for x in out.strip().splitlines()[-1].split(',')][:args.rooms]
+
+        port = free_port()
+        processes = 1 if mode == 'threads' else args.processes
+        log = open(log_path, 'w')
+        procs.append(subprocess.Popen([sys.executable, '-c', SERVE, str(port), str(processes)],
+                                      cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT))
+        if mode == 'processes':
+            procs.append(subprocess.Popen([sys.executable, '-m', 'flask', '--app', 'wsgi', 'run-worker'],
+                                          cwd=ROOT, env=dict(env, JOB_WORKERS='2'),
+                                          stdout=log, stderr=subprocess.STDOUT))
+        base = f'http://127.0.0.1:{port}'
+        for _ in range(100):
+            try:
+                urllib.request.urlopen(base + '/', timeout=2).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        else:
+            raise RuntimeError(f'server did not start; see {log_path}')
+
+        stats = Stats()
+        wall = run_clients(base, room_ids, args, stats)
+        lock_wait = scrape_lock_wait(base) if mode == 'threads' else None
+        unfinished_jobs = wait_for_jobs(db_path)
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.wait()
+
+    with open(log_path, errors='replace') as fh:
+        log_text = fh.read()
+    locked_errors = log_text.count('database is locked')
+    jobs = dict(job_stats(db_path), unfinished=unfinished_jobs)
+    failures = check_invariants(db_path, stats) + check_jobs_and_log(jobs, log_text)
+    result = {
+        'mode': mode,
+        'wall_seconds': wall,
+        'scenarios': {
+            name: {'count': len(samples), 'per_second': len(samples) / wall,
+                   'p50_ms': percentile(samples, 50) * 1000, 'p95_ms': percentile(samples, 95) * 1000,
+                   'p99_ms': percentile(samples, 99) * 1000, 'mean_ms': statistics.fmean(samples) * 1000}
+            for name, samples in sorted(stats.latency.items())
+        },
+        'requests': sum(stats.statuses.values()),
+        'statuses': stats.statuses,
+        'outcomes': dict(sorted(stats.outcomes.items())),
+        'lock_wait': None if lock_wait is None else {
+            'count': lock_wait[0], 'total_seconds': lock_wait[1], 'buckets': lock_wait[2]},
+        'database_locked_errors': locked_errors,
+        'jobs': jobs,
+        'failures': failures,
+    }
+    if args.keep_db:
+        result['db_path'] = db_path
+    else:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return result
+
+
+def print_result(r):
+    print(f"\n== {r['mode']}: {r['requests']} requests in {r['wall_seconds']:.1f}s "
+          f"({r['requests'] / r['wall_seconds']:.1f} req/s)")
+    print(f'{"scenario":<10}{"n":>7}{"per s":>9}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}')
+    for name, s in r['scenarios'].items():
+        print(f"{name:<10}{s['count']:>7}{s['per_second']:>9.1f}{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}{s['p99_ms']:>10.1f}")
+    print('outcomes:', ', '.join(f'{k}={v}' for k, v in r['outcomes'].items()))
+    print('statuses:', ', '.join(f'{k}={v}' for k, v in sorted(r['statuses'].items())))
+    if r['lock_wait']:
+        lw = r['lock_wait']
+        mean = lw['total_seconds'] / lw['count'] * 1000 if lw['count'] else 0.0
+        print(f"write lock waits: {lw['count']} (mean {mean:.2f} ms, total {lw['total_seconds']:.2f}s)")
+    print(f"'database is locked' errors: {r['database_locked_errors']}; jobs: {r['jobs']}")
+    if r['failures']:
+        print(f"FAILED {len(r['failures'])} invariants:")
+        for failure in r['failures'][:20]:
+            print('  -', failure)
+    else:
+        print('all invariants hold')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=('threads', 'processes', 'both'), default='both')
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=30, help='seconds of traffic per mode')
+    parser.add_argument('--processes', type=int, default=8, help='forked request handlers in processes mode')
+    parser.add_argument('--rooms', type=int, default=4, help='rooms to spread bookings over (fewer = more conflicts)')
+    parser.add_argument('--window', type=int, default=21, help='days of check-in dates payers compete for')
+    parser.add_argument('--double-submit-rate', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write results as JSON to this path')
+    parser.add_argument('--keep-db', action='store_true', help='leave the temporary databases behind')
+    args = parser.parse_args()
+
+    modes = ('threads', 'processes') if args.mode == 'both' else (args.mode,)
+    results = [run_mode(mode, args) for mode in modes]
+    for result in results:
+        print_result(result)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump({'args': vars(args), 'results': results}, fh, indent=2, default=str)
+    sys.exit(1 if any(r['failures'] for r in results) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""Server-side storage for carts.
+
+Pending bookings and payment results used to ride in
+Flask's signed cookie session, so every request re-serialized, re-signed and
+re-sent the whole cart.  Now the cookie only carries an opaque cart id and
+the cart itself lives in one of these stores:
+
+* ``MemoryCartStore`` - an in-process LRU with TTL eviction.  Fast, but each
+  worker process has its own copy, so only suitable for a single process.
+* ``SQLCartStore`` - one row per cart in a database table, shared by every
+  worker.
+
+Both keep carts as plain JSON-serializable dicts.  A cart expires once it
+has been neither loaded nor saved for ``ttl`` seconds.
+"""
+import json
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+
+def new_cart_id():
+    return uuid.uuid4().hex
+
+
+class Cart(dict):
+    """A cart's contents plus the id it is stored under.
+
+    Like Flask's session, in-place changes to nested values are not
+    detected; set ``modified = True`` after mutating them.
+    """
+
+    def __init__(self, cart_id=None, data=None):
+        super().__init__(data or {})
+        self.id = cart_id
+        self.modified = False
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.modified = True
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.modified = True
+
+    def pop(self, key, *default):
+        if key in self:
+            self.modified = True
+        return super().pop(key, *default)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self.modified = True
+        return super().setdefault(key, default)
+
+
+class CartStore(ABC):
+    """Interface every cart backend implements"""
+
+    @abstractmethod
+    def load(self, cart_id):
+        """Return the stored dict for ``cart_id``, or None if missing/expired"""
+
+    @abstractmethod
+    def save(self, cart_id, data):
+        pass
+
+    @abstractmethod
+    def delete(self, cart_id):
+        pass
+
+    def purge_expired(self):
+        """Drop expired carts; returns how many were removed"""
+        return 0
+
+
+class MemoryCartStore(CartStore):
+    """Bounded in-process LRU; entries idle for longer than ``ttl`` seconds expire"""
+
+    def __init__(self, max_entries=10000, ttl=7 * 24 * 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # cart_id -> (expires_at, json)
+        self._lock = threading.Lock()
+
+    def load(self, cart_id):
+        with self._lock:
+            entry = self._entries.get(cart_id)
+            if entry is None:
+                return None
+            expires_at, payload = entry
+            now = time.monotonic()
+            if expires_at <= now:
+                del self._entries[cart_id]
+                return None
+            self._entries[cart_id] = (now + self.ttl, payload)
+            self._entries.move_to_end(cart_id)
+        # Hand out a fresh copy so callers can't mutate the stored cart.
+        return json.loads(payload)
+
+    def save(self, cart_id, data):
+        payload = json.dumps(data)
+        with self._lock:
+            self._entries[cart_id] = (time.monotonic() + self.ttl, payload)
+            self._entries.move_to_end(cart_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, cart_id):
+        with self._lock:
+            self._entries.pop(cart_id, None)
+
+    def purge_expired(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [cid for cid, (expires_at, _) in self._entries.items() if expires_at <= now]
+            for cid in expired:
+                del self._entries[cid]
+        return len(expired)
+
+
+class SQLCartStore(CartStore):
+    """Carts stored as JSON in a database table shared by all workers.
+
+    ``engine`` is a callable returning the SQLAlchemy engine (so the store can
+    be created before the app context exists); ``table`` needs ``id``,
+    ``data`` and ``updated_at`` columns.  Writes go through their own short
+    transaction and never touch the request's ORM session.
+
+    Loading a cart pushes ``updated_at`` forward so a cart that is only
+    viewed doesn't expire, but at most once per ``touch_interval`` seconds,
+    so browsing doesn't turn every page view into a write.
+    """
+
+    def __init__(self, engine, table, ttl=7 * 24 * 3600, touch_interval=3600):
+        self._engine = engine
+        self.table = table
+        self.ttl = ttl
+        self.touch_interval = touch_interval
+
+    def load(self, cart_id):
+        t = self.table
+        now = datetime.now()
+        cutoff = now - timedelta(seconds=self.ttl)
+        with self._engine().connect() as conn:
+            row = conn.execute(
+                t.select().with_only_columns(t.c.data, t.c.updated_at)
+                .where(t.c.id == cart_id, t.c.updated_at > cutoff)
+            ).first()
+        if row is None:
+            return None
+        payload, updated_at = row
+        if updated_at < now - timedelta(seconds=self.touch_interval):
+            with self._engine().begin() as conn:
+                conn.execute(t.update().where(t.c.id == cart_id, t.c.updated_at == updated_at)
+                             .values(updated_at=now))
+        return json.loads(payload)
+
+    def save(self, cart_id, data):
+        t = self.table
+        values = {'id': cart_id, 'data': json.dumps(data), 'updated_at': datetime.now()}
+        stmt = sqlite_insert(t).values(**values).on_conflict_do_update(
+            index_elements=[t.c.id],
+            set_={'data': values['data'], 'updated_at': values['updated_at']},
+        )
+        with self._engine().begin() as conn:
+            conn.execute(stmt)
+
+    def delete(self, cart_id):
+        t = self.table
+        with self._engine().begin() as conn:
+            conn.execute(t.delete().where(t.c.id == cart_id))
+
+    def purge_expired(self):
+        t = self.table
+        cutoff = datetime.now() - timedelta(seconds=self.ttl)
+        with self._engine().begin() as conn:
+            return conn.execute(t.delete().where(t.c.updated_at <= cutoff)).rowcount
@@ -0,0 +1,108 @@
+"""Database connection profile, read from the environment.
+
+Defaults suit several gunicorn workers with a few threads each sharing one
+SQLite file: WAL so readers never block the writer, synchronous=NORMAL
+(durable at checkpoints, no fsync per commit), a busy timeout so writers
+queue for the lock instead of failing with "database is locked", and a
+connection pool sized to the thread count.
+
+Environment variables (all optional):
+
+    DATABASE_URL            sqlite:///<app dir>/hotel.db
+    SQLITE_JOURNAL_MODE     WAL
+    SQLITE_SYNCHRONOUS      NORMAL
+    SQLITE_BUSY_TIMEOUT_MS  5000
+    SQLITE_CACHE_SIZE_KB    65536
+    SQLITE_MMAP_SIZE_MB     256
+    DB_POOL_SIZE            5
+    DB_MAX_OVERFLOW         10
+    DB_POOL_RECYCLE         3600   (seconds, -1 disables)
+"""
+import os
+
+from sqlalchemy import event
+
+
+def _int(env, name, default):
+    value = env.get(name)
+    try:
+        return int(value) if value not in (None, '') else default
+    except ValueError:
+        raise ValueError(f'{name} must be an integer, got {value!r}') from None
+
+
+class DatabaseProfile:
+    def __init__(self, url, journal_mode='WAL', synchronous='NORMAL', busy_timeout_ms=5000,
+                 cache_size_kb=64 * 1024, mmap_size_mb=256, pool_size=5, max_overflow=10, pool_recycle=3600):
+        self.url = url
+        self.journal_mode = journal_mode.upper()
+        self.synchronous = synchronous.upper()
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size_mb = mmap_size_mb
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_recycle = pool_recycle
+
+    @classmethod
+    def from_env(cls, default_url, env=None):
+        env = os.environ if env is None else env
+        return cls(
+            url=env.get('DATABASE_URL') or default_url,
+            journal_mode=env.get('SQLITE_JOURNAL_MODE') or 'WAL',
+            synchronous=env.get('SQLITE_SYNCHRONOUS') or 'NORMAL',
+            busy_timeout_ms=_int(env, 'SQLITE_BUSY_TIMEOUT_MS', 5000),
+            cache_size_kb=_int(env, 'SQLITE_CACHE_SIZE_KB', 64 * 1024),
+            mmap_size_mb=_int(env, 'SQLITE_MMAP_SIZE_MB', 256),
+            pool_size=_int(env, 'DB_POOL_SIZE', 5),
+            max_overflow=_int(env, 'DB_MAX_OVERFLOW', 10),
+            pool_recycle=_int(env, 'DB_POOL_RECYCLE', 3600),
+        )
+
+    @property
+    def is_sqlite(self):
+        return self.url.startswith('sqlite')
+
+    def engine_options(self):
+        """Keyword arguments for create_engine (SQLALCHEMY_ENGINE_OPTIONS)"""
+        options = {'pool_pre_ping': True, 'pool_recycle': self.pool_recycle}
+        if self.is_sqlite:
+            # Connections move between threads in a threaded server; the
+            # driver-level timeout matches busy_timeout for the initial BEGIN.
+            options['connect_args'] = {'check_same_thread': False, 'timeout': self.busy_timeout_ms / 1000}
+            if ':memory:' in self.url or self.url.rstrip('/') == 'sqlite:':
+                return options  # in-memory DBs use SQLAlchemy's single-connection pool
+        options['pool_size'] = self.pool_size
+        options['max_overflow'] = self.max_overflow
+        return options
+
+    def pragmas(self):
+        return [
+            f'PRAGMA journal_mode={self.journal_mode}',
+            f'PRAGMA synchronous={self.synchronous}',
+            f'PRAGMA busy_timeout={self.busy_timeout_ms}',
+            # Negative cache_size is in KiB rather than pages.
+            f'PRAGMA cache_size=-{self.cache_size_kb}',
+            f'PRAGMA mmap_size={self.mmap_size_mb * 1024 * 1024}',
+            'PRAGMA temp_store=MEMORY',
+        ]
+
+    def install(self, engine):
+        """Apply the pragmas to every new connection of ``engine``"""
+        if not self.is_sqlite:
+            return
+        pragmas = self.pragmas()
+
+        @event.listens_for(engine, 'connect')
+        def _set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            try:
+                for pragma in pragmas:
+                    cursor.execute(pragma)
+            finally:
+                cursor.close()
+
+        # A forked worker must not reuse sockets/file handles opened by the
+        # parent (gunicorn --preload); drop them without closing the parent's.
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=lambda: engine.dispose(close=False))
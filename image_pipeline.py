@@ -0,0 +1,93 @@
+"""Background resizing of uploaded review images and room photos.
+
+The request that receives an upload only saves the raw file and queues a
+job (see job_queue.py).  A background worker then decodes it once, applies
+the EXIF orientation, and writes a JPEG and a WebP copy at each requested
+width that is smaller than the original, plus one at the original width
+when that is below the largest requested.  Copies are re-encoded from
+pixels only, so EXIF/GPS and other metadata are not carried over, and are
+named after a hash of their content so they can be cached forever.
+
+Room photos are given as remote URLs; ``download()`` fetches one so the
+same job can make local copies of it.
+
+Pillow is optional: without it uploads are still saved and served as-is.
+"""
+import hashlib
+import logging
+import os
+import urllib.request
+from io import BytesIO
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - depends on the environment
+    Image = None
+
+log = logging.getLogger(__name__)
+
+VARIANT_WIDTHS = (320, 640, 1280)
+VARIANT_FORMATS = {'webp': ('WEBP', {'quality': 80, 'method': 4}),
+                   'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True})}
+
+
+def available():
+    return Image is not None
+
+
+def download(url, max_bytes=10 * 1024 * 1024, timeout=15):
+    """Fetch an http(s) URL; raises ValueError for other schemes or bodies over ``max_bytes``"""
+    if not url.lower().startswith(('http://', 'https://')):
+        raise ValueError(f'not an http(s) URL: {url!r}')
+    request = urllib.request.Request(url, headers={'User-Agent': 'boonyisa-hotel-image-cache/1'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        data = response.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise ValueError(f'image larger than {max_bytes} bytes: {url}')
+    return data
+
+
+def make_variants(source_path, output_dir, widths=VARIANT_WIDTHS):
+    """Write resized, metadata-free copies of an image.
+
+    Returns a list of ``(width, fmt, filename)``; empty if Pillow is missing
+    or the file cannot be decoded.
+    """
+    if Image is None:
+        return []
+    try:
+        with Image.open(source_path) as im:
+            im.seek(0)  # first frame of animated GIF/WebP
+            im = ImageOps.exif_transpose(im)
+            im = im.convert('RGB')
+    except Exception:
+        log.exception('Cannot decode image %s', source_path)
+        return []
+
+    requested = widths
+    widths = [w for w in requested if w < im.width]
+    if im.width < max(requested):
+        widths.append(im.width)
+    variants = []
+    for width in widths:
+        height = max(1, round(im.height * width / im.width))
+        resized = im if width == im.width else im.resize((width, height), Image.LANCZOS)
+        for ext, (fmt, options) in VARIANT_FORMATS.items():
+            data = _encode(resized, fmt, options)
+            filename = f'{hashlib.sha256(data).hexdigest()[:20]}_{width}.{ext}'
+            path = os.path.join(output_dir, filename)
+            if os.path.exists(path):
+                os.utime(path)  # another image already made it; restart its upload grace period
+            else:
+                tmp = f'{path}.tmp{os.getpid()}'
+                with open(tmp, 'wb') as fh:
+                    fh.write(data)
+                os.replace(tmp, path)
+            variants.append((width, ext, filename))
+    return variants
+
+
+def _encode(im, fmt, options):
+    buf = BytesIO()
+    im.save(buf, fmt, **options)
+    return buf.getvalue()
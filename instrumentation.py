@@ -0,0 +1,177 @@
+"""Opt-in request, SQL and template timing.
+
+Enabled with ``METRICS_ENABLED=1``.  Once installed it records
+
+* request latency per endpoint and method, as a histogram;
+* SQL statements per request, and time spent in SQL, per endpoint;
+* render time per template;
+* statements slower than ``SLOW_QUERY_MS``, logged to the ``slow_query``
+  logger with their endpoint;
+* time spent waiting for SQLite's write lock, as reported by the app's
+  ``begin_immediate()``.
+
+``Metrics.render_prometheus()`` formats everything in the Prometheus text
+exposition format for the admin metrics endpoint.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+from flask import g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+
+slow_query_log = logging.getLogger('slow_query')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'total', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + '}'
+
+
+class Metrics:
+    def __init__(self, slow_query_ms=200):
+        self.slow_query_seconds = slow_query_ms / 1000
+        self._lock = threading.Lock()
+        self.request_latency = {}   # (endpoint, method) -> Histogram
+        self.request_queries = {}   # endpoint -> Histogram of statements per request
+        self.query_seconds = {}     # endpoint -> total seconds in SQL
+        self.query_total = {}       # endpoint -> statements executed
+        self.template_seconds = {}  # template -> Histogram
+        self.responses = {}         # (endpoint, status) -> count
+        self.lock_wait = {}         # endpoint -> Histogram of seconds waiting for the write lock
+        self.slow_queries = 0
+
+    def _histogram(self, table, key, buckets):
+        hist = table.get(key)
+        if hist is None:
+            hist = table[key] = Histogram(buckets)
+        return hist
+
+    # --- wiring -------------------------------------------------------------
+
+    def install(self, app, engine):
+        app.before_request(self._start_request)
+        app.after_request(self._end_request)
+        before_render_template.connect(self._start_template, app)
+        template_rendered.connect(self._end_template, app)
+        event.listen(engine, 'before_cursor_execute', self._start_query)
+        event.listen(engine, 'after_cursor_execute', self._end_query)
+
+    def _start_request(self):
+        g._metrics = {'start': time.perf_counter(), 'queries': 0, 'templates': []}
+
+    def _end_request(self, response):
+        # Left on g so SQL issued by later after_request hooks (the cart
+        # save) is still attributed to this endpoint.
+        state = g.get('_metrics')
+        if state is None:
+            return response
+        elapsed = time.perf_counter() - state['start']
+        endpoint = request.endpoint or 'unmatched'
+        with self._lock:
+            self._histogram(self.request_latency, (endpoint, request.method), LATENCY_BUCKETS).observe(elapsed)
+            self._histogram(self.request_queries, endpoint, COUNT_BUCKETS).observe(state['queries'])
+            key = (endpoint, response.status_code)
+            self.responses[key] = self.responses.get(key, 0) + 1
+        return response
+
+    def _start_template(self, sender, template, context, **extra):
+        if has_request_context() and '_metrics' in g:
+            g._metrics['templates'].append(time.perf_counter())
+
+    def _end_template(self, sender, template, context, **extra):
+        if not (has_request_context() and '_metrics' in g) or not g._metrics['templates']:
+            return
+        # Renders nest (fragments inside pages), so starts form a stack.
+        elapsed = time.perf_counter() - g._metrics['templates'].pop()
+        with self._lock:
+            self._histogram(self.template_seconds, template.name or 'string', LATENCY_BUCKETS).observe(elapsed)
+
+    def _start_query(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('_query_start', []).append(time.perf_counter())
+
+    def _end_query(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('_query_start')
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        in_request = has_request_context() and '_metrics' in g
+        endpoint = (request.endpoint or 'unmatched') if in_request else 'background'
+        if in_request:
+            g._metrics['queries'] += 1
+        with self._lock:
+            self.query_seconds[endpoint] = self.query_seconds.get(endpoint, 0.0) + elapsed
+            self.query_total[endpoint] = self.query_total.get(endpoint, 0) + 1
+            if elapsed >= self.slow_query_seconds:
+                self.slow_queries += 1
+        if elapsed >= self.slow_query_seconds:
+            slow_query_log.warning('%.1f ms [%s] %s', elapsed * 1000, endpoint, ' '.join(statement.split()))
+
+    def observe_lock_wait(self, seconds):
+        endpoint = (request.endpoint or 'unmatched') if has_request_context() else 'background'
+        with self._lock:
+            self._histogram(self.lock_wait, endpoint, LATENCY_BUCKETS).observe(seconds)
+
+    # --- exposition ---------------------------------------------------------
+
+    def render_prometheus(self):
+        out = []
+
+        def histogram(name, help_text, table, label_names):
+            out.append(f'# HELP {name} {help_text}')
+            out.append(f'# TYPE {name} histogram')
+            for key, hist in sorted(table.items()):
+                key = key if isinstance(key, tuple) else (key,)
+                labels = dict(zip(label_names, key))
+                cumulative = 0
+                for bound, n in zip(hist.buckets + ('+Inf',), hist.counts):
+                    cumulative += n
+                    out.append(f'{name}_bucket{_labels(**labels, le=bound)} {cumulative}')
+                out.append(f'{name}_sum{_labels(**labels)} {hist.total:.6f}')
+                out.append(f'{name}_count{_labels(**labels)} {hist.count}')
+
+        def counter(name, help_text, table, label_names):
+            out.append(f'# HELP {name} {help_text}')
+            out.append(f'# TYPE {name} counter')
+            for key, value in sorted(table.items()):
+                key = key if isinstance(key, tuple) else (key,)
+                out.append(f'{name}{_labels(**dict(zip(label_names, key)))} {value}')
+
+        with self._lock:
+            histogram('http_request_duration_seconds', 'Request latency by endpoint.',
+                      self.request_latency, ('endpoint', 'method'))
+            counter('http_responses_total', 'Responses by endpoint and status code.',
+                    self.responses, ('endpoint', 'status'))
+            histogram('http_request_sql_queries', 'SQL statements executed per request.',
+                      self.request_queries, ('endpoint',))
+            counter('sql_queries_total', 'SQL statements executed.', self.query_total, ('endpoint',))
+            counter('sql_query_seconds_total', 'Time spent executing SQL.', self.query_seconds, ('endpoint',))
+            histogram('template_render_seconds', 'Template render time.', self.template_seconds, ('template',))
+            histogram('sql_write_lock_wait_seconds', 'Time waiting for the SQLite write lock.',
+                      self.lock_wait, ('endpoint',))
+            out.append('# HELP sql_slow_queries_total Statements slower than the slow-query threshold.')
+            out.append('# TYPE sql_slow_queries_total counter')
+            out.append(f'sql_slow_queries_total {self.slow_queries}')
+        return '\n'.join(out) + '\n'
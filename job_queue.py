@@ -0,0 +1,224 @@
+"""Durable background jobs kept in a database table.
+
+Work that doesn't have to finish before the response (emails, thumbnails,
+rate calendar refreshes) is written to the ``job`` table instead of being
+done inline.  Enqueueing can share the caller's transaction, so a job
+exists if and only if the change that asked for it was committed.
+
+Workers claim one due job at a time with a single ``UPDATE ... RETURNING``
+statement, so any number of threads and processes can share the table.
+That write is only attempted after a read-only look finds a due job, and an
+idle worker polls less and less often (up to ``max_poll_interval``), so an
+empty queue doesn't keep taking the database write lock.  A
+claimed job is leased for ``lease`` seconds; if its worker dies the job
+becomes claimable again once the lease runs out.  A job that raises is
+retried after an exponential backoff (``backoff * 2 ** (attempts - 1)``
+seconds) and is moved to the ``dead`` state after ``max_attempts`` tries,
+where it stays, with its last error, until someone retries it.
+
+Job states: ``queued`` -> ``running`` -> ``done`` | ``queued`` (retry) | ``dead``.
+"""
+import json
+import logging
+import random
+import threading
+import traceback
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, or_
+
+log = logging.getLogger(__name__)
+
+
+class JobQueue:
+    """Jobs stored in ``table``; ``engine`` is a callable returning the engine.
+
+    The table needs ``id``, ``name``, ``payload``, ``status``, ``attempts``,
+    ``run_at``, ``locked_until``, ``last_error``, ``created_at`` and
+    ``finished_at`` columns (see ``Job`` in app.py).
+    """
+
+    def __init__(self, engine, table, max_attempts=5, backoff=30, lease=300):
+        self._engine = engine
+        self.table = table
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.lease = lease
+        self.handlers = {}
+
+    def handler(self, name):
+        """Register the function that runs jobs called ``name``; it gets the payload as kwargs"""
+        def register(fn):
+            self.handlers[name] = fn
+            return fn
+        return register
+
+    def enqueue(self, name, payload=None, conn=None, delay=0):
+        """Queue a job; with ``conn`` (a connection or session) it joins that transaction"""
+        if name not in self.handlers:
+            raise KeyError(f'no handler registered for job {name!r}')
+        now = datetime.now()
+        stmt = self.table.insert().values(
+            name=name, payload=json.dumps(payload or {}), status='queued', attempts=0,
+            run_at=now + timedelta(seconds=delay), created_at=now,
+        )
+        if conn is not None:
+            conn.execute(stmt)
+            return
+        with self._engine().begin() as own:
+            own.execute(stmt)
+
+    # --- worker side --------------------------------------------------------
+
+    @staticmethod
+    def _next_due(t, now):
+        return t.select().with_only_columns(t.c.id).where(or_(
+            (t.c.status == 'queued') & (t.c.run_at <= now),
+            (t.c.status == 'running') & (t.c.locked_until < now),
+        )).order_by(t.c.run_at, t.c.id).limit(1)
+
+    def has_due(self, now=None):
+        """Whether a job is due, checked without opening a write transaction"""
+        with self._engine().connect() as conn:
+            return conn.execute(self._next_due(self.table, now or datetime.now())).first() is not None
+
+    def claim(self):
+        """Lease the next due job; returns (id, name, payload, attempts) or None"""
+        t = self.table
+        now = datetime.now()
+        if not self.has_due(now):
+            return None
+        # Another worker may take the job first; the UPDATE re-checks, so that
+        # just means it matches nothing.  Aliased so the subquery isn't
+        # correlated to the UPDATE's own table.
+        due = self._next_due(t.alias('next_job'), now).scalar_subquery()
+        stmt = t.update().where(t.c.id == due).values(
+            status='running', attempts=t.c.attempts + 1, locked_until=now + timedelta(seconds=self.lease),
+        ).returning(t.c.id, t.c.name, t.c.payload, t.c.attempts)
+        with self._engine().begin() as conn:
+            row = conn.execute(stmt).first()
+        if row is None:
+            return None
+        return row[0], row[1], json.loads(row[2]), row[3]
+
+    def complete(self, job_id):
+        t = self.table
+        with self._engine().begin() as conn:
+            conn.execute(t.update().where(t.c.id == job_id).values(
+                status='done', finished_at=datetime.now(), locked_until=None, last_error=None))
+
+    def fail(self, job_id, attempts, error):
+        t = self.table
+        now = datetime.now()
+        if attempts >= self.max_attempts:
+            values = {'status': 'dead', 'finished_at': now}
+        else:
+            delay = self.backoff * 2 ** (attempts - 1) * random.uniform(0.8, 1.2)
+            values = {'status': 'queued', 'run_at': now + timedelta(seconds=delay)}
+        with self._engine().begin() as conn:
+            conn.execute(t.update().where(t.c.id == job_id).values(
+                locked_until=None, last_error=error[-4000:], **values))
+        return values['status']
+
+    def run_one(self, context=None):
+        """Claim and run a single job; returns False if nothing was due.
+
+        ``context`` is entered around the whole attempt, claim and
+        bookkeeping included, since ``engine`` may only work inside it.
+        """
+        with context() if context is not None else nullcontext():
+            job = self.claim()
+            if job is None:
+                return False
+            job_id, name, payload, attempts = job
+            try:
+                self.handlers[name](**payload)
+            except Exception:
+                status = self.fail(job_id, attempts, traceback.format_exc())
+                log.warning('Job %s (%s) failed on attempt %d, now %s', job_id, name, attempts, status,
+                            exc_info=True)
+            else:
+                self.complete(job_id)
+            return True
+
+    def work(self, stop, context=None, poll_interval=1.0, max_poll_interval=15.0):
+        """Run jobs until the ``stop`` event is set.
+
+        While the queue is empty the wait between polls doubles from
+        ``poll_interval`` up to ``max_poll_interval``; running a job resets it.
+        """
+        wait = poll_interval
+        while not stop.is_set():
+            try:
+                ran = self.run_one(context)
+            except Exception:
+                # The database itself is unhappy (locked, gone); back off.
+                log.exception('Job worker could not claim a job')
+                ran = False
+            if ran:
+                wait = poll_interval
+            else:
+                stop.wait(wait * random.uniform(0.8, 1.2))
+                wait = min(wait * 2, max(max_poll_interval, poll_interval))
+
+    # --- admin --------------------------------------------------------------
+
+    def retry(self, job_id=None):
+        """Put dead jobs (one, or all) back in the queue; returns how many"""
+        t = self.table
+        stmt = t.update().where(t.c.status == 'dead')
+        if job_id is not None:
+            stmt = stmt.where(t.c.id == job_id)
+        with self._engine().begin() as conn:
+            return conn.execute(stmt.values(status='queued', attempts=0, run_at=datetime.now(),
+                                            finished_at=None)).rowcount
+
+    def purge(self, older_than):
+        """Delete finished jobs older than a timedelta; dead jobs are kept"""
+        t = self.table
+        cutoff = datetime.now() - older_than
+        with self._engine().begin() as conn:
+            return conn.execute(t.delete().where(t.c.status == 'done', t.c.finished_at < cutoff)).rowcount
+
+    def stats(self):
+        t = self.table
+        with self._engine().connect() as conn:
+            counts = dict(conn.execute(
+                t.select().with_only_columns(t.c.status, func.count()).group_by(t.c.status)).all())
+        return {status: counts.get(status, 0) for status in ('queued', 'running', 'done', 'dead')}
+
+
+class WorkerPool:
+    """Threads running ``queue.work()``; ``context`` wraps each attempt (e.g. ``app.app_context``)"""
+
+    def __init__(self, queue, threads=2, context=None, poll_interval=1.0, max_poll_interval=15.0):
+        self.queue = queue
+        self.threads = threads
+        self.context = context
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._threads or self.threads < 1:
+                return
+            for n in range(self.threads):
+                thread = threading.Thread(target=self.queue.work, name=f'jobs-{n}', daemon=True,
+                                          args=(self._stop, self.context, self.poll_interval,
+                                                self.max_poll_interval))
+                thread.start()
+                self._threads.append(thread)
+
+    @property
+    def started(self):
+        return bool(self._threads)
+
+    def stop(self, wait=True):
+        self._stop.set()
+        if wait:
+            for thread in self._threads:
+                thread.join()
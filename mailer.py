@@ -0,0 +1,76 @@
+"""Outgoing mail.
+
+``SMTPMailer`` talks to a real server.  ``MailSink`` is the local stand-in
+used in development and tests: every message is written as an ``.eml``
+file to a directory, where it can be opened in a mail client or asserted
+on.  ``mailer_from_env()`` picks SMTP when ``SMTP_HOST`` is set.
+"""
+import os
+import smtplib
+import uuid
+from datetime import datetime
+from email.message import EmailMessage
+
+DEFAULT_SENDER = 'Boonyisa Hotel <no-reply@boonyisa-hotel.local>'
+
+
+def build_message(to, subject, body, sender=DEFAULT_SENDER):
+    msg = EmailMessage()
+    msg['From'] = sender
+    msg['To'] = to
+    msg['Subject'] = subject
+    msg['Message-ID'] = f'<{uuid.uuid4().hex}@boonyisa-hotel.local>'
+    msg.set_content(body)
+    return msg
+
+
+class MailSink:
+    """Writes each message to ``<directory>/<timestamp>-<id>.eml``"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def send(self, msg):
+        name = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.eml"
+        path = os.path.join(self.directory, name)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as fh:
+            fh.write(msg.as_bytes())
+        os.replace(tmp, path)  # readers never see half a message
+        return path
+
+    def messages(self):
+        """Paths of the stored messages, oldest first"""
+        return sorted(os.path.join(self.directory, n) for n in os.listdir(self.directory) if n.endswith('.eml'))
+
+
+class SMTPMailer:
+    def __init__(self, host, port=587, username=None, password=None, starttls=True, timeout=30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+
+    def send(self, msg):
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            smtp.send_message(msg)
+
+
+def mailer_from_env(sink_dir):
+    host = os.environ.get('SMTP_HOST')
+    if not host:
+        return MailSink(os.environ.get('MAIL_SINK_DIR', sink_dir))
+    return SMTPMailer(
+        host,
+        port=int(os.environ.get('SMTP_PORT', 587)),
+        username=os.environ.get('SMTP_USER'),
+        password=os.environ.get('SMTP_PASSWORD'),
+        starttls=os.environ.get('SMTP_STARTTLS', '1').lower() in ('1', 'true', 'yes'),
+    )
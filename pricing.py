@@ -0,0 +1,113 @@
+"""Cart pricing.
+
+Every cart line is priced once, when it is added: the dates are parsed and
+validated and the resulting ``nights`` and ``total`` are stored on the line
+together with a ``price_key`` fingerprint of the inputs they came from.
+Later page views reuse those numbers and only reprice a line whose dates or
+nightly rate have changed since, or when the rate calendar has moved on.
+
+With a ``stay_total`` callback the stay is priced from the nightly rate
+calendar (see rates.py); the fingerprint then includes the calendar's
+version, which app.py bumps on every calendar refresh.  Without one every
+night costs the line's ``price_per_night``.
+
+Cart lines are the plain dicts kept in the cart store::
+
+    {'room_id': 1, 'room_name': ..., 'room_type': ..., 'check_in': '2026-01-02',
+     'check_out': '2026-01-05', 'guests': '2', 'price_per_night': 2500.0,
+     'nights': 3, 'total': 7800.0, 'nightly_rate': 2600.0,
+     'price_key': '2026-01-02|2026-01-05|2500.0|7'}
+"""
+from datetime import date
+from functools import lru_cache
+
+
+class PricingError(ValueError):
+    pass
+
+
+def _price_key(check_in, check_out, price_per_night, rates_version=0):
+    return f'{check_in}|{check_out}|{price_per_night}|{rates_version}'
+
+
+@lru_cache(maxsize=4096)
+def _nights_and_total(check_in, check_out, price_per_night):
+    try:
+        nights = (date.fromisoformat(check_out) - date.fromisoformat(check_in)).days
+    except (TypeError, ValueError):
+        raise PricingError(f'invalid stay dates {check_in!r} - {check_out!r}') from None
+    if nights < 1:
+        raise PricingError(f'check-out {check_out} is not after check-in {check_in}')
+    return nights, price_per_night * nights
+
+
+class CartQuote:
+    """Priced lines of one cart and their grand total"""
+
+    def __init__(self, lines, total, changed, invalid=()):
+        self.lines = lines
+        self.total = total
+        self.changed = changed  # True if any line was (re)priced
+        self.invalid = list(invalid)  # lines that could not be priced
+
+    @property
+    def nights(self):
+        return sum(line['nights'] for line in self.lines)
+
+
+class CartPricer:
+    def __init__(self, stay_total=None):
+        # stay_total(room_id, check_in, check_out) -> price of the whole stay
+        self.stay_total = stay_total
+
+    def make_line(self, room, check_in, check_out, guests, rates_version=0):
+        """Build and price a new cart line; raises PricingError for bad dates"""
+        line = {
+            'room_id': room.id,
+            'room_name': room.name,
+            'room_type': room.room_type,
+            'check_in': check_in.isoformat(),
+            'check_out': check_out.isoformat(),
+            'guests': guests,
+            'price_per_night': room.price_per_night,
+        }
+        self.price_line(line, rates_version)
+        return line
+
+    def price_line(self, line, rates_version=0):
+        """Fill in ``nights``/``total`` unless they are current; returns True if repriced"""
+        key = _price_key(line.get('check_in'), line.get('check_out'), line.get('price_per_night', 0), rates_version)
+        if line.get('price_key') == key and 'total' in line:
+            return False
+        nights, total = _nights_and_total(line.get('check_in'), line.get('check_out'), line.get('price_per_night', 0))
+        if self.stay_total is not None:
+            total = self.stay_total(line['room_id'], line['check_in'], line['check_out'])
+        line['nights'] = nights
+        line['total'] = total
+        line['nightly_rate'] = round(total / nights, 2)
+        line['price_key'] = key
+        return True
+
+    def price_cart(self, lines, rates_version=0):
+        """Price every line; lines with bad dates are left out and listed in ``invalid``"""
+        changed = False
+        total = 0
+        priced, invalid = [], []
+        for line in lines:
+            try:
+                changed = self.price_line(line, rates_version) or changed
+            except PricingError:
+                invalid.append(line)
+                continue
+            priced.append(line)
+            total += line['total']
+        return CartQuote(priced, total, changed, invalid)
+
+    def price_carts(self, carts, rates_version=0):
+        """Price many carts at once, e.g. for quote emails or admin previews.
+
+        Identical stays across carts share one computation through the
+        module-level memo, so a batch costs roughly one dict lookup per line
+        (plus one calendar range sum when pricing from the rate calendar).
+        """
+        return [self.price_cart(lines, rates_version) for lines in carts]
@@ -0,0 +1,73 @@
+"""Rate rules and the nightly rate calendar.
+
+A room's price for one night is its base ``price_per_night`` multiplied by
+every active rule that matches the night.  A rule can be limited to
+
+* a room type (``room_type``; empty means every room),
+* a date range (``start_date`` / ``end_date``, both inclusive, either open),
+* days of the week (``weekdays``, a string of ``date.weekday()`` digits,
+  e.g. ``'45'`` for Friday and Saturday nights),
+* busy nights (``min_occupancy``, the booked share of that room type's
+  rooms, 0-1).
+
+Matching rules stack multiplicatively, so their order does not matter.
+
+Evaluating rules is cheap per night but adds up across every cart view, so
+app.py materializes the results into a per-room, per-night ``RoomRate``
+table and a stay is quoted with one indexed range sum.  The functions here
+are the pure part: they know nothing about the database.
+"""
+from datetime import timedelta
+
+
+def iter_nights(start, end):
+    """Every night in the half-open range ``[start, end)``"""
+    night = start
+    while night < end:
+        yield night
+        night += timedelta(days=1)
+
+
+def rule_matches(rule, room_type, night, occupancy=0.0):
+    if not rule.active:
+        return False
+    if rule.room_type and rule.room_type != room_type:
+        return False
+    if rule.start_date and night < rule.start_date:
+        return False
+    if rule.end_date and night > rule.end_date:
+        return False
+    if rule.weekdays and str(night.weekday()) not in rule.weekdays:
+        return False
+    if rule.min_occupancy is not None and occupancy < rule.min_occupancy:
+        return False
+    return True
+
+
+def nightly_rate(base, room_type, night, rules, occupancy=0.0):
+    rate = base
+    for rule in rules:
+        if rule_matches(rule, room_type, night, occupancy):
+            rate *= rule.multiplier
+    return round(rate, 2)
+
+
+def rule_window(rule, start, end):
+    """The part of ``[start, end)`` whose nights the rule can affect, or None"""
+    lo = max(start, rule.start_date) if rule.start_date else start
+    hi = min(end, rule.end_date + timedelta(days=1)) if rule.end_date else end
+    return (lo, hi) if lo < hi else None
+
+
+def occupancy_by_night(stays, room_counts, start, end):
+    """Booked share per ``(room_type, night)`` within ``[start, end)``.
+
+    ``stays`` yields ``(room_type, check_in, check_out)`` of live bookings;
+    ``room_counts`` maps room type to how many rooms of it exist.
+    """
+    booked = {}
+    for room_type, check_in, check_out in stays:
+        for night in iter_nights(max(check_in, start), min(check_out, end)):
+            key = (room_type, night)
+            booked[key] = booked.get(key, 0) + 1
+    return {key: n / room_counts[key[0]] for key, n in booked.items() if room_counts.get(key[0])}
@@ -0,0 +1,71 @@
+"""Shared fixtures: the app, once per test session, on a throwaway SQLite database.
+
+app.py reads its settings from the environment at import, so they are set
+here before any test imports it.  Background job threads are off
+(JOB_WORKERS=0); tests run jobs themselves with ``run_jobs``.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_tmpdir = tempfile.mkdtemp(prefix='boonyisa-tests-')
+os.environ.update(
+    DATABASE_URL='sqlite:///' + os.path.join(_tmpdir, 'test.db'),
+    MAIL_SINK_DIR=os.path.join(_tmpdir, 'mail'),
+    SECRET_KEY='test-secret',
+    JOB_WORKERS='0',
+    CART_STORE='sqlite',
+)
+os.environ.pop('SMTP_HOST', None)
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    import app as app_module
+    app_module.create_app({'TESTING': True, 'UPLOAD_FOLDER': os.path.join(_tmpdir, 'uploads')})
+    with app_module.app.app_context():
+        app_module.init_db()
+    yield app_module
+    shutil.rmtree(_tmpdir, ignore_errors=True)
+
+
+@pytest.fixture
+def ctx(app_module):
+    """An app context for the test body"""
+    with app_module.app.app_context():
+        yield app_module
+
+
+@pytest.fixture
+def make_room(ctx):
+    """Create a room (without an image, so no download job) and return its id"""
+    def make(price=1000.0, capacity=2, name='Test Room', room_type='Standard'):
+        room = ctx.Room(name=name, room_type=room_type, capacity=capacity, price_per_night=price,
+                        image_url='', amenities='')
+        ctx.db.session.add(room)
+        ctx.db.session.commit()
+        return room.id
+    return make
+
+
+@pytest.fixture
+def run_jobs(app_module):
+    """Run due jobs on a fresh thread, which like a worker has no app context"""
+    def run(limit=100):
+        ran = []
+
+        def work():
+            while len(ran) < limit and app_module.job_queue.run_one(app_module.app.app_context):
+                ran.append(1)
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+        return len(ran)
+    return run
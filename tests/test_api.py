@@ -0,0 +1,22 @@
+from datetime import datetime, timedelta, timezone
+
+
+def test_review_detail_is_not_stale_after_image_delete(ctx, make_room):
+    room_id = make_room()
+    review = ctx.Review(room_id=room_id, name='Guest', rating=5, comment='Nice view', image='missing.jpg')
+    ctx.db.session.add(review)
+    ctx.db.session.commit()
+    client = ctx.app.test_client()
+
+    first = client.get(f'/api/v1/reviews/{review.id}')
+    assert first.status_code == 200 and first.json['image_url']
+    client.post(f'/review-image/{review.id}/delete')
+
+    later = datetime.now(timezone.utc) + timedelta(minutes=5)
+    again = client.get(f'/api/v1/reviews/{review.id}',
+                       headers={'If-Modified-Since': later.strftime('%a, %d %b %Y %H:%M:%S GMT')})
+    assert again.status_code == 200
+    assert again.json['image_url'] is None
+    # The body ETag still answers revalidation.
+    unchanged = client.get(f'/api/v1/reviews/{review.id}', headers={'If-None-Match': again.headers['ETag']})
+    assert unchanged.status_code == 304
@@ -0,0 +1,23 @@
+import assets
+
+
+def test_index_etag_changes_when_asset_names_change(app_module, tmp_path, monkeypatch):
+    static = tmp_path / 'static'
+    static.mkdir()
+    (static / 'style.css').write_text('body { color: red; }')
+    out = static / 'dist'
+    assets.build(str(static), str(out))
+    manifest = assets.AssetManifest(str(out / 'manifest.json'))
+    monkeypatch.setattr(app_module, 'asset_manifest', manifest)
+    client = app_module.app.test_client()
+
+    first = client.get('/')
+    assert first.status_code == 200
+    assert client.get('/', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+    (static / 'style.css').write_text('body { color: blue; }')
+    assets.build(str(static), str(out))
+    manifest.reload()
+    second = client.get('/', headers={'If-None-Match': first.headers['ETag']})
+    assert second.status_code == 200
+    assert manifest.lookup('style.css') in second.get_data(as_text=True)
@@ -0,0 +1,51 @@
+from datetime import date, timedelta
+
+
+def _book(ctx, room_id, check_in, nights, status='completed'):
+    booking = ctx.Booking(customer_name='Guest', customer_email='guest@example.com', room_id=room_id,
+                          room_name='Test Room', check_in=check_in, check_out=check_in + timedelta(days=nights),
+                          guests=2, price_per_night=1000.0, nights=nights, total_price=1000.0 * nights,
+                          status=status)
+    ctx.db.session.add(booking)
+    ctx.db.session.commit()
+    return booking.id
+
+
+def test_conflicting_stays_are_detected(ctx, make_room):
+    room_id = make_room()
+    start = date.today() + timedelta(days=30)
+    _book(ctx, room_id, start, 3)
+    ctx.availability_index.invalidate(room_id)
+
+    assert not ctx.room_is_available(room_id, start + timedelta(days=1), start + timedelta(days=2))
+    assert not ctx.room_is_available(room_id, start - timedelta(days=1), start + timedelta(days=1))
+    # Half-open stays: checking in on the day the last guest leaves is fine.
+    assert ctx.room_is_available(room_id, start + timedelta(days=3), start + timedelta(days=5))
+    assert ctx.room_is_available(room_id, start - timedelta(days=2), start)
+    assert ctx.overlapping_bookings(room_id, start + timedelta(days=2), start + timedelta(days=4)).count() == 1
+
+
+def test_new_and_cancelled_bookings_update_the_index(ctx, make_room):
+    room_id = make_room()
+    start = date.today() + timedelta(days=40)
+    assert ctx.room_is_available(room_id, start, start + timedelta(days=2))  # loads the room
+
+    booking_id = _book(ctx, room_id, start, 2)
+    assert not ctx.room_is_available(room_id, start, start + timedelta(days=2))
+    ctx.db.session.get(ctx.Booking, booking_id).status = 'cancelled'
+    ctx.db.session.commit()
+    assert ctx.room_is_available(room_id, start, start + timedelta(days=2))
+
+
+def test_past_stays_are_not_loaded(ctx, make_room):
+    room_id = make_room()
+    past_id = _book(ctx, room_id, date.today() - timedelta(days=400), 2)
+    ended_today_id = _book(ctx, room_id, date.today() - timedelta(days=2), 2)
+    current_id = _book(ctx, room_id, date.today() - timedelta(days=1), 3)
+    future_id = _book(ctx, room_id, date.today() + timedelta(days=20), 2)
+    ctx.availability_index.invalidate(room_id)
+
+    loaded = {booking_id for booking_id, _, _ in ctx._load_room_stays(room_id)}
+    assert loaded == {current_id, future_id}
+    assert past_id not in loaded and ended_today_id not in loaded
+    assert ctx.availability_index.conflicts(room_id, date.today() - timedelta(days=500), date.today()) == [current_id]
@@ -0,0 +1,133 @@
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, Text, create_engine
+
+from job_queue import JobQueue
+
+
+def _last_job(ctx, name):
+    ctx.db.session.expire_all()
+    return ctx.Job.query.filter_by(name=name).order_by(ctx.Job.id.desc()).first()
+
+
+def test_worker_runs_app_job_outside_app_context(ctx, run_jobs):
+    ctx.enqueue_job('send_mail', to='guest@example.com', subject='Booking confirmed', body='See you soon')
+    ctx.db.session.commit()
+
+    assert run_jobs() >= 1
+    job = _last_job(ctx, 'send_mail')
+    assert job.status == 'done', job.last_error
+    assert os.listdir(os.environ['MAIL_SINK_DIR'])
+
+
+def test_worker_pool_drains_queue(ctx):
+    ctx.enqueue_job('send_mail', to='pool@example.com', subject='Pool', body='Hello')
+    ctx.db.session.commit()
+
+    pool = ctx.WorkerPool(ctx.job_queue, threads=1, context=ctx.app.app_context, poll_interval=0.05)
+    pool.start()
+    try:
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline and _last_job(ctx, 'send_mail').status != 'done':
+            time.sleep(0.05)
+    finally:
+        pool.stop()
+    assert _last_job(ctx, 'send_mail').status == 'done'
+
+
+# --- JobQueue on its own table ------------------------------------------------
+
+
+@pytest.fixture
+def queue(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'jobs.db'}")
+    table = Table(
+        'job', MetaData(),
+        Column('id', Integer, primary_key=True),
+        Column('name', String(100), nullable=False),
+        Column('payload', Text, nullable=False),
+        Column('status', String(20), nullable=False),
+        Column('attempts', Integer, nullable=False),
+        Column('run_at', DateTime, nullable=False),
+        Column('locked_until', DateTime),
+        Column('last_error', Text),
+        Column('created_at', DateTime, nullable=False),
+        Column('finished_at', DateTime),
+    )
+    table.metadata.create_all(engine)
+    yield JobQueue(lambda: engine, table, max_attempts=3, backoff=60, lease=300)
+    engine.dispose()
+
+
+def _rows(queue):
+    with queue._engine().connect() as conn:
+        return conn.execute(queue.table.select().order_by(queue.table.c.id)).mappings().all()
+
+
+def test_job_runs_to_done(queue):
+    seen = []
+    queue.handler('greet')(lambda who: seen.append(who))
+    assert not queue.has_due()
+    assert queue.claim() is None
+
+    queue.enqueue('greet', {'who': 'world'})
+    assert queue.has_due()
+    assert queue.run_one() is True
+    assert queue.run_one() is False
+
+    assert seen == ['world']
+    [row] = _rows(queue)
+    assert (row['status'], row['attempts'], row['locked_until']) == ('done', 1, None)
+    assert row['finished_at'] is not None
+    assert queue.stats() == {'queued': 0, 'running': 0, 'done': 1, 'dead': 0}
+
+
+def test_failing_job_backs_off_then_dies(queue):
+    @queue.handler('boom')
+    def boom():
+        raise RuntimeError('no luck')
+
+    queue.enqueue('boom')
+    for attempt in range(1, 4):
+        assert queue.run_one() is True
+        [row] = _rows(queue)
+        assert row['attempts'] == attempt
+        assert 'RuntimeError: no luck' in row['last_error']
+        if attempt < 3:
+            assert row['status'] == 'queued'
+            assert row['run_at'] > datetime.now() + timedelta(seconds=30)
+            assert queue.run_one() is False  # not due until the backoff has passed
+            with queue._engine().begin() as conn:
+                conn.execute(queue.table.update().values(run_at=datetime.now()))
+    assert row['status'] == 'dead'
+    assert queue.run_one() is False
+
+    assert queue.retry() == 1
+    [row] = _rows(queue)
+    assert (row['status'], row['attempts']) == ('queued', 0)
+
+
+def test_expired_lease_is_claimed_again(queue):
+    queue.handler('noop')(lambda: None)
+    queue.enqueue('noop')
+    job_id, name, payload, attempts = queue.claim()
+    assert (name, payload, attempts) == ('noop', {}, 1)
+    assert queue.claim() is None  # leased to the first worker
+
+    with queue._engine().begin() as conn:
+        conn.execute(queue.table.update().values(locked_until=datetime.now() - timedelta(seconds=1)))
+    assert queue.claim()[::3] == (job_id, 2)
+
+
+def test_enqueue_joins_the_callers_transaction(queue):
+    queue.handler('noop')(lambda: None)
+    with pytest.raises(KeyError):
+        queue.enqueue('unknown')
+    with queue._engine().connect() as conn:
+        trans = conn.begin()
+        queue.enqueue('noop', conn=conn)
+        trans.rollback()
+    assert _rows(queue) == []
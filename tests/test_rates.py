@@ -0,0 +1,32 @@
+from datetime import date, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def admin_client(app_module):
+    client = app_module.app.test_client()
+    with client.session_transaction() as sess:
+        sess['admin'] = True
+    return client
+
+
+def test_quote_stay_uses_new_price_before_refresh_job(ctx, make_room, admin_client, run_jobs):
+    room_id = make_room(price=1000.0)
+    ctx.refresh_rate_calendar([room_id])
+    ctx.db.session.commit()
+    check_in = date.today() + timedelta(days=10)
+    check_out = check_in + timedelta(days=2)
+    assert ctx.quote_stay(room_id, check_in, check_out) == 2000.0
+
+    response = admin_client.post('/admin/rooms/batch', data={
+        'room_ids': [str(room_id)], 'action': 'set_price', 'value': '1500'})
+    assert response.status_code == 302
+
+    # The refresh job hasn't run, yet checkout already charges the new price.
+    ctx.db.session.expire_all()
+    assert ctx.quote_stay(room_id, check_in, check_out) == 3000.0
+    run_jobs()
+    ctx.db.session.expire_all()
+    assert ctx.RoomRate.query.filter_by(room_id=room_id, night=check_in).one().rate == 1500.0
+    assert ctx.quote_stay(room_id, check_in, check_out) == 3000.0
@@ -0,0 +1,29 @@
+def _add_review(ctx, room_id, comment, name='Guest'):
+    review = ctx.Review(room_id=room_id, name=name, rating=4, comment=comment)
+    ctx.db.session.add(review)
+    ctx.db.session.commit()
+    return review.id
+
+
+def test_snippet_keeps_context_around_the_match(ctx, make_room):
+    room_id = make_room()
+    comment = ('We arrived late at night and the staff were kind. ' * 3
+               + 'The breakfast buffet had fresh fruit and good coffee every morning. '
+               + 'Parking was easy. ' * 5)
+    review_id = _add_review(ctx, room_id, comment)
+
+    [hit] = [r for r in ctx.search_reviews('breakfast', room_id=room_id) if r['id'] == review_id]
+    assert '<mark>breakfast</mark>' in hit['snippet']
+    assert 'fresh fruit and good coffee' in hit['snippet']
+    assert len(hit['snippet']) > 100
+
+
+def test_snippet_thai_and_escaping(ctx, make_room):
+    room_id = make_room()
+    review_id = _add_review(ctx, room_id, 'ห้องพักสะอาดมาก พนักงานบริการดี อาหารเช้าอร่อย <b>แนะนำ</b>')
+
+    [hit] = ctx.search_reviews('อาหารเช้า', room_id=room_id)
+    assert hit['id'] == review_id
+    assert '<mark>อาหารเช้า</mark>' in hit['snippet']
+    assert 'ห้องพักสะอาดมาก' in hit['snippet']
+    assert '&lt;b&gt;' in hit['snippet'] and '<b>' not in hit['snippet']
@@ -0,0 +1,100 @@
+"""Content-addressed storage for uploaded files.
+
+Files are named after the SHA-256 of their bytes, so the same photo uploaded
+twice is stored once and a filename always means the same content - which
+lets it be served with an immutable, far-future Cache-Control header.
+
+The store does not track references itself: callers decide when a file is
+no longer used (app.py counts the Review / ReviewImageVariant rows naming
+it) and ``sweep()`` removes whatever nothing references.  Saving content
+that is already stored refreshes the file's mtime, and both ``delete()``
+and ``sweep()`` leave recently written files alone, so a file isn't removed
+under an upload of the same bytes whose row hasn't been committed yet.
+"""
+import hashlib
+import os
+import re
+import tempfile
+import time
+
+HASH_CHARS = 32
+CHUNK_SIZE = 64 * 1024
+
+# Original uploads are <hash>.<ext>; resized copies from image_pipeline are
+# <hash>_<width>.<ext>.  Both are content-addressed.
+_ADDRESSED = re.compile(r'^[0-9a-f]{20,64}(_\d+)?\.[a-z0-9]+$')
+
+
+def is_content_addressed(filename):
+    return bool(_ADDRESSED.match(filename))
+
+
+def etag_for(filename):
+    """The content hash embedded in a content-addressed filename"""
+    return filename.rsplit('.', 1)[0]
+
+
+class ContentStore:
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, filename):
+        return os.path.join(self.root, filename)
+
+    def save(self, stream, ext):
+        """Store the bytes read from ``stream``; returns (filename, is_new).
+
+        The upload is hashed while it is copied to a temp file in the same
+        directory, then renamed into place only if that content isn't
+        already stored.
+        """
+        digest = hashlib.sha256()
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    out.write(chunk)
+            filename = f'{digest.hexdigest()[:HASH_CHARS]}.{ext.lower()}'
+            final = self.path(filename)
+            if os.path.exists(final):
+                os.utime(final)  # restart its grace period
+                return filename, False
+            os.chmod(tmp, 0o644)  # mkstemp makes 0600; a static server must read it
+            os.replace(tmp, final)
+            tmp = None
+            return filename, True
+        finally:
+            if tmp is not None and os.path.exists(tmp):
+                os.remove(tmp)
+
+    def delete(self, filename, grace_seconds=0):
+        """Remove a file unless it was written within the grace period; returns True if removed"""
+        path = self.path(filename)
+        try:
+            if grace_seconds and os.stat(path).st_mtime > time.time() - grace_seconds:
+                return False
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def sweep(self, referenced, grace_seconds=3600):
+        """Delete files not in ``referenced`` that are older than the grace period.
+
+        The grace period keeps files whose review is still being written (or
+        whose resized copies are still being recorded) from being collected.
+        Returns the removed filenames.
+        """
+        cutoff = time.time() - grace_seconds
+        removed = []
+        for entry in os.scandir(self.root):
+            if not entry.is_file() or entry.name in referenced:
+                continue
+            if entry.name.startswith('.') and not entry.name.startswith('.upload-'):
+                continue  # .gitkeep and friends; stale .upload- temp files are fair game
+            if entry.stat().st_mtime > cutoff:
+                continue
+            os.remove(entry.path)
+            removed.append(entry.name)
+        return removed
@@ -0,0 +1,18 @@
+"""Production entry point.
+
+    gunicorn --workers 4 --threads 4 'wsgi:app'
+
+Importing builds the app and runs the per-process setup (upload folder,
+SQLite pragmas, mailer); database connections open on the first query.
+Prepare the database once per deploy rather than in every worker:
+
+    flask --app wsgi init-db
+    flask --app wsgi seed-rooms    # sample rooms, only into an empty database
+
+Configuration comes from the environment: DATABASE_URL and the SQLITE_* /
+DB_POOL_* variables (see db_profile.py), SECRET_KEY (required), JOB_WORKERS,
+SMTP_*, and any FLASK_* variable.
+"""
+from app import create_app
+
+app = create_app()